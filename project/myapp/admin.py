@@ -1,4 +1,6 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+
+from myapp import archive, sharding
 
 from myapp.models import (
     CustomUser,
@@ -14,7 +16,10 @@ from myapp.models import (
     Review,
     Product,
     ProductVariant,
-    Category
+    Category,
+    ImportJob,
+    OutboxEvent,
+    ArchivedProduct,
 )
 
 
@@ -23,21 +28,116 @@ class ProductAdmin(admin.ModelAdmin):
         "name", "price"
     )
     list_filter = ["category"]
+    actions = ["archive_inactive"]
 
+    @admin.action(description="Archive selected inactive products")
+    def archive_inactive(self, request, queryset):
+        count = archive.archive_batch(list(queryset.filter(is_active=False).values_list("pk", flat=True)))
+        self.message_user(request, f"{count} products archived")
 
 
-class OrderAdmin(admin.ModelAdmin):
+class ArchivedProductAdmin(admin.ModelAdmin):
+    list_display = (
+        "name", "sku", "price", "archived_at"
+    )
+    list_filter = ["category"]
+    search_fields = ["name", "sku"]
+    actions = ["restore"]
+
+    @admin.action(description="Reactivate selected products")
+    def restore(self, request, queryset):
+        ids = list(queryset.values_list("pk", flat=True))
+        count = archive.restore(ids)
+        self.message_user(request, f"{count} products reactivated")
+        if count < len(ids):
+            self.message_user(
+                request,
+                f"{len(ids) - count} products kept archived, a live product or variant uses their sku",
+                messages.WARNING,
+            )
+
+
+
+class ShardFilter(admin.SimpleListFilter):
+    title = "shard"
+    parameter_name = "shard"
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in sharding.get_shards()]
+
+    def queryset(self, request, queryset):
+        # ShardedModelAdmin.get_queryset already picked the shard
+        return queryset
+
+    def choices(self, changelist):
+        current = self.value() or sharding.get_shards()[0]
+        for alias, title in self.lookup_choices:
+            yield {
+                "selected": alias == current,
+                "query_string": changelist.get_query_string({self.parameter_name: alias}),
+                "display": title,
+            }
+
+
+class ShardedModelAdmin(admin.ModelAdmin):
+    """
+    Lists one shard at a time, picked in the sidebar; objects are looked up
+    on the shard their id points at and saved back there by the router.
+    """
+
+    # not False, that would join the foreign keys in list_display, which are
+    # on 'default'; list_prefetch_related fetches them from there instead
+    list_select_related = ()
+    list_prefetch_related = ()
+
+    def get_list_filter(self, request):
+        return [ShardFilter, *super().get_list_filter(request)]
+
+    def get_queryset(self, request):
+        shards = sharding.get_shards()
+        alias = request.GET.get(ShardFilter.parameter_name)
+        queryset = super().get_queryset(request).prefetch_related(*self.list_prefetch_related)
+        return queryset.using(alias if alias in shards else shards[0])
+
+    def get_object(self, request, object_id, from_field=None):
+        alias = sharding.shard_for_id(object_id)
+        if alias is None:
+            return None
+        return super().get_queryset(request).using(alias).filter(pk=object_id).first()
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if sharding.is_sharded(db_field.related_model):
+            kwargs["queryset"] = sharding.fan_out(db_field.related_model.objects.all())
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
+class OrderAdmin(ShardedModelAdmin):
     list_display = (
         "user", "total_amount", "order_status"
     )
     list_filter = ["order_status"]
+    list_prefetch_related = ["user"]
+
 
+class OrderItemAdmin(ShardedModelAdmin):
+    list_prefetch_related = ["order__user", "product_variant__product"]
+
+
+class PaymentAdmin(ShardedModelAdmin):
+    list_prefetch_related = ["order__user"]
+
+
+class OutboxEventAdmin(ShardedModelAdmin):
+    list_display = (
+        "id", "event_type", "order_id", "status", "attempts", "available_at"
+    )
+    list_filter = ["status", "event_type"]
 
 
 admin.site.register(Profile)
-admin.site.register(Payment)
+admin.site.register(Payment, PaymentAdmin)
 admin.site.register(Order,OrderAdmin)
-admin.site.register(OrderItem)
+admin.site.register(OrderItem, OrderItemAdmin)
 admin.site.register(Cart)
 admin.site.register(CartItem)
 admin.site.register(ShippingAddress)
@@ -48,3 +148,6 @@ admin.site.register(ProductVariant)
 admin.site.register(Wishlist)
 admin.site.register(Review)
 admin.site.register(CustomUser)
+admin.site.register(ImportJob)
+admin.site.register(OutboxEvent, OutboxEventAdmin)
+admin.site.register(ArchivedProduct, ArchivedProductAdmin)
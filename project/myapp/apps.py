@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class MyappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'myapp'
+
+    def ready(self):
+        from myapp import db  # noqa: F401  connects the SQLite pragma hook
+        from myapp import coupons  # noqa: F401  connects the coupon cache invalidation
+        from myapp import wishlist  # noqa: F401  connects the wishlist cache invalidation
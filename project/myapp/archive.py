@@ -0,0 +1,210 @@
+import time
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import BooleanField, Value
+from django.utils.dateparse import parse_datetime
+
+from myapp import wishlist
+from myapp.cache import invalidate_catalog
+from myapp.models import (
+    ArchivedProduct,
+    ArchivedProductVariant,
+    CartItem,
+    CustomUser,
+    Product,
+    ProductVariant,
+    Review,
+    Wishlist,
+    archiving,
+)
+
+
+# Inactive products are moved, with their variants, from Product and
+# ProductVariant into ArchivedProduct and ArchivedProductVariant, keeping
+# their ids. The hot tables and their indexes then only hold the live
+# catalog, which is all Product.objects and the product views ever see.
+# restore() moves products back when they are reactivated; all_products()
+# is the opt-in view of both, for staff.
+#
+# What points at an archived product:
+# - order items keep their variant id (no constraint, see OrderItem)
+# - reviews and wishlist entries are kept on the archived row and put back
+# - cart items are dropped, an inactive product can't be bought
+
+PRODUCT_FIELDS = (
+    "id", "sku", "name", "slug", "description", "price", "discount_price",
+    "category_id", "inventory_count", "created_at", "updates_at",
+)
+VARIANT_FIELDS = (
+    "id", "product_id", "sku", "variant_name", "variant_value", "price", "stock_count", "updates_at",
+)
+REVIEW_FIELDS = ("id", "user_id", "rating", "comment", "created_at", "updated_at")
+
+WishlistItem = Wishlist.products.through
+
+
+def copy(obj, model, fields, **extra):
+    return model(**{field: getattr(obj, field) for field in fields}, **extra)
+
+
+def archive_batch(ids):
+    """Move the products `ids` and their variants to the archive tables in one transaction."""
+    alias = router.db_for_write(Product)
+    with transaction.atomic(using=alias):
+        products = list(Product.objects.filter(pk__in=ids, is_active=False).select_for_update())
+        ids = [product.pk for product in products]
+        if not ids:
+            return 0
+        reviews, wishlists = {}, {}
+        for review in Review.objects.filter(product__in=ids).values("product_id", *REVIEW_FIELDS):
+            # isoformat() keeps the microseconds DjangoJSONEncoder would drop
+            for field in ("created_at", "updated_at"):
+                review[field] = review[field].isoformat()
+            reviews.setdefault(review.pop("product_id"), []).append(review)
+        for product_id, wishlist_id, user_id in WishlistItem.objects.filter(product__in=ids).values_list(
+            "product_id", "wishlist_id", "wishlist__user"
+        ):
+            wishlists.setdefault(product_id, []).append((wishlist_id, user_id))
+
+        ArchivedProduct.objects.bulk_create(
+            copy(
+                product, ArchivedProduct, PRODUCT_FIELDS,
+                reviews=reviews.get(product.pk, []),
+                wishlists=[wishlist_id for wishlist_id, _ in wishlists.get(product.pk, [])],
+            )
+            for product in products
+        )
+        variants = ProductVariant.objects.filter(product__in=ids)
+        ArchivedProductVariant.objects.bulk_create(
+            copy(variant, ArchivedProductVariant, VARIANT_FIELDS) for variant in variants
+        )
+
+        CartItem.objects.filter(product_variant__product__in=ids).delete()
+        WishlistItem.objects.filter(product__in=ids).delete()
+        # the order items of these variants stay (see archiving), the caches
+        # are dropped below
+        token = archiving.set(True)
+        try:
+            Product.objects.filter(pk__in=ids).delete()
+        finally:
+            archiving.reset(token)
+
+        users = {user_id for entries in wishlists.values() for _, user_id in entries}
+        transaction.on_commit(lambda: forget_wishlists(users), using=alias)
+    invalidate_catalog()
+    return len(ids)
+
+
+def archive_inactive(batch_size=None, pause=0, progress=None):
+    """Archive every inactive product, `batch_size` per transaction; returns how many."""
+    batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+    archived = 0
+    while True:
+        inactive = Product.objects.filter(is_active=False).order_by("pk")
+        ids = list(inactive.values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            return archived
+        archived += archive_batch(ids)
+        if progress is not None:
+            progress(archived)
+        if pause:
+            time.sleep(pause)
+
+
+def restore(ids):
+    """
+    Move the archived products `ids` back to Product, active again; returns
+    how many. Products whose sku, or one of their variants' skus, was taken
+    by a live product in the meantime stay archived.
+    """
+    alias = router.db_for_write(Product)
+    with transaction.atomic(using=alias):
+        archived = list(ArchivedProduct.objects.filter(pk__in=ids).prefetch_related("variants"))
+        archived = without_sku_clashes(archived)
+        if not archived:
+            return 0
+        products = Product.objects.bulk_create(
+            copy(product, Product, PRODUCT_FIELDS, is_active=True) for product in archived
+        )
+        # bulk_create() stamps auto_now_add fields, give them back their dates
+        for product, original in zip(products, archived):
+            product.created_at = original.created_at
+        Product.objects.bulk_update(products, ["created_at"])
+        ProductVariant.objects.bulk_create(
+            copy(variant, ProductVariant, VARIANT_FIELDS)
+            for product in archived
+            for variant in product.variants.all()
+        )
+
+        entries = [dict(review, product_id=product.pk) for product in archived for review in product.reviews]
+        # reviews of users deleted in the meantime went with them
+        user_ids = {entry["user_id"] for entry in entries}
+        users = set(CustomUser.objects.filter(pk__in=user_ids).values_list("pk", flat=True))
+        entries = [entry for entry in entries if entry["user_id"] in users]
+        reviews = Review.objects.bulk_create(Review(**entry) for entry in entries)
+        for review, entry in zip(reviews, entries):
+            review.created_at = parse_datetime(entry["created_at"])
+            review.updated_at = parse_datetime(entry["updated_at"])
+        Review.objects.bulk_update(reviews, ["created_at", "updated_at"])
+
+        wishlist_ids = {pk for product in archived for pk in product.wishlists}
+        wishlist_users = dict(Wishlist.objects.filter(pk__in=wishlist_ids).values_list("pk", "user"))
+        WishlistItem.objects.bulk_create(
+            WishlistItem(wishlist_id=wishlist_id, product_id=product.pk)
+            for product in archived
+            for wishlist_id in product.wishlists
+            if wishlist_id in wishlist_users
+        )
+
+        ArchivedProduct.objects.filter(pk__in=[product.pk for product in archived]).delete()
+        transaction.on_commit(lambda: forget_wishlists(wishlist_users.values()), using=alias)
+    invalidate_catalog()
+    return len(archived)
+
+
+def without_sku_clashes(archived):
+    """The archived products that can go back without breaking a unique sku."""
+    variant_skus = {product.pk: [v.sku for v in product.variants.all() if v.sku] for product in archived}
+    taken = set(
+        Product.objects.filter(sku__in=[product.sku for product in archived if product.sku])
+        .values_list("sku", flat=True)
+    )
+    taken_variants = set(
+        ProductVariant.objects.filter(sku__in=[sku for skus in variant_skus.values() for sku in skus])
+        .values_list("sku", flat=True)
+    )
+    free = []
+    for product in archived:
+        skus = variant_skus[product.pk]
+        if product.sku in taken or taken_variants.intersection(skus):
+            continue
+        # archived skus aren't unique, the first of two products sharing one gets it
+        if product.sku:
+            taken.add(product.sku)
+        taken_variants.update(skus)
+        free.append(product)
+    return free
+
+
+def restore_skus(skus):
+    """Restore the archived products with these skus, e.g. before an import reactivates them."""
+    ids = list(ArchivedProduct.objects.filter(sku__in=skus).values_list("pk", flat=True))
+    return restore(ids) if ids else 0
+
+
+def forget_wishlists(user_ids):
+    for user_id in set(user_ids):
+        wishlist.forget(user_id)
+
+
+def all_products(fields=("id", "sku", "name", "price", "category"), **filters):
+    """
+    Values of live and archived products matching `filters` together, with
+    an `archived` flag. The explicit way for staff queries to span both tables.
+    """
+    live = Product.objects.filter(**filters).values(*fields)
+    archived = ArchivedProduct.objects.filter(**filters).values(*fields)
+    return live.annotate(archived=Value(False, output_field=BooleanField())).union(
+        archived.annotate(archived=Value(True, output_field=BooleanField())), all=True
+    )
@@ -0,0 +1,190 @@
+import functools
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from myapp.models import Category
+from myapp.renderers import ORJSONRenderer
+from myapp.views import CategoryAPIView, ProductAPIView, ProductVariantAPIView, parse_ids
+
+
+# Async, read-only twins of the hottest catalog GETs, mounted under async/.
+# They run the DRF viewsets' own permissions, filter backends (filterset,
+# search, ordering, sparse fields) and paginator, so they take the same query
+# parameters and return the same JSON, but read the rows through the async
+# ORM and never block a thread while waiting on the database; under ASGI
+# (project/asgi.py) one worker process serves many of them at once. Under
+# WSGI they still work, Django just runs them to completion per thread.
+
+renderer = ORJSONRenderer()
+
+
+class AsyncJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication with the user lookup done through the async ORM."""
+
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        # signature and expiry checks are pure CPU, no query
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        try:
+            user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        try:
+            user = await self.user_model.objects.aget(**{jwt_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist:
+            raise exceptions.AuthenticationFailed("User not found", code="user_not_found")
+
+        if jwt_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise exceptions.AuthenticationFailed("User is inactive", code="user_inactive")
+        return user
+
+
+class Authenticated(BaseAuthentication):
+    """Hands the DRF Request what AsyncJWTAuthentication already found."""
+
+    def __init__(self, user_auth):
+        self.user_auth = user_auth
+
+    def authenticate(self, request):
+        return self.user_auth
+
+
+def json_response(response):
+    headers = {name: value for name, value in response.items() if name != "Content-Type"}
+    return HttpResponse(
+        renderer.render(response.data), status=response.status_code, content_type="application/json", headers=headers
+    )
+
+
+def async_api_view(viewset, action):
+    """
+    GET only. Builds `viewset` for `action` the way its router would, with
+    the request authenticated from the JWT header and the viewset's own
+    permission checks and error bodies, then hands it to the async view.
+    """
+
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        async def wrapper(request, **kwargs):
+            view = viewset(action=action, args=(), kwargs=kwargs, format_kwarg=None, headers={})
+            view.request = Request(request)
+            try:
+                if request.method != "GET":
+                    raise exceptions.MethodNotAllowed(request.method)
+                user_auth = await AsyncJWTAuthentication().aauthenticate(request)
+                # replaces the lazy session user, which would query synchronously
+                request.user = user_auth[0] if user_auth else AnonymousUser()
+                view.request = Request(request, authenticators=[Authenticated(user_auth)])
+                view.check_permissions(view.request)
+                return json_response(await view_func(view))
+            except exceptions.APIException as exc:
+                return json_response(view.handle_exception(exc))
+
+        return wrapper
+
+    return decorator
+
+
+async def filter_queryset(view):
+    # a filterset validates ?category= and friends against the database, so
+    # this one step runs in a thread; the rows are read asynchronously
+    return await sync_to_async(view.filter_queryset)(view.get_queryset())
+
+
+def get_mapper(view):
+    mapper = view.get_row_mapper()
+    if mapper is None:
+        raise ImproperlyConfigured(
+            f"{view.get_serializer_class().__name__} has fields the async views can't map from rows"
+        )
+    return mapper
+
+
+async def paginate(view, queryset, mapper):
+    """LimitOffsetPagination.paginate_queryset(), with acount() and async for in place of count() and list()."""
+    paginator = view.paginator
+    if not isinstance(paginator, LimitOffsetPagination):
+        raise ImproperlyConfigured(f"{type(view).__name__} must paginate with LimitOffsetPagination")
+
+    rows = queryset.values_list(*mapper.columns)
+    paginator.request = view.request
+    paginator.limit = paginator.get_limit(view.request)
+    if paginator.limit is None:
+        return Response([mapper(row) async for row in rows])
+    paginator.count = await queryset.acount()
+    paginator.offset = paginator.get_offset(view.request)
+    results = [mapper(row) async for row in rows[paginator.offset:paginator.offset + paginator.limit]]
+    return paginator.get_paginated_response(results)
+
+
+async def list_rows(view):
+    """The viewset's list(), and its ?ids= batch retrieve (BatchRetrieveMixin)."""
+    mapper = get_mapper(view)
+    queryset = await filter_queryset(view)
+
+    ids = view.request.query_params.get("ids")
+    if ids is None:
+        return await paginate(view, queryset, mapper)
+
+    ids = parse_ids(ids)
+    if isinstance(ids, Response):
+        return ids
+    rows = queryset.filter(pk__in=ids).values_list("pk", *mapper.columns)
+    found = {row[0]: mapper(row[1:]) async for row in rows}
+    return Response({
+        "results": [found[pk] for pk in ids if pk in found],
+        "missing": [pk for pk in ids if pk not in found],
+    })
+
+
+@async_api_view(ProductAPIView, "list")
+async def product_list(view):
+    return await list_rows(view)
+
+
+@async_api_view(ProductAPIView, "retrieve")
+async def product_retrieve(view):
+    mapper = get_mapper(view)
+    queryset = await filter_queryset(view)
+    row = await queryset.filter(pk=view.kwargs["pk"]).values_list(*mapper.columns).afirst()
+    if row is None:
+        raise exceptions.NotFound("No Product matches the given query.")
+    return Response(mapper(row))
+
+
+@async_api_view(ProductVariantAPIView, "list")
+async def variant_list(view):
+    return await list_rows(view)
+
+
+@async_api_view(CategoryAPIView, "hierarchy")
+async def category_hierarchy(view):
+    children = defaultdict(list)
+    async for pk, name, parent_id in Category.objects.order_by("id").values_list("id", "name", "parent_id"):
+        children[parent_id].append((pk, name))
+
+    def tree(parent_id):
+        return [{"id": pk, "name": name, "children": tree(pk)} for pk, name in children.get(parent_id, [])]
+
+    return Response(tree(None))
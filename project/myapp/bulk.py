@@ -0,0 +1,48 @@
+from django.db.models import F, FloatField, IntegerField, Value
+from django.db.models.functions import Cast, Greatest, Round
+
+from myapp.cache import invalidate_catalog
+from myapp.enum import BulkOperation
+
+
+PREVIEW_LIMIT = 20
+
+
+def build_expression(field, operation, value, floor=None):
+    if operation == BulkOperation.PERCENT.value:
+        factor = 1 + float(value) / 100
+        expression = Cast(
+            Round(F(field) * Value(factor, output_field=FloatField())), IntegerField()
+        )
+    elif operation == BulkOperation.ADD.value:
+        expression = F(field) + Value(int(value))
+    else:
+        expression = Value(int(value))
+
+    if floor is not None:
+        expression = Greatest(expression, Value(floor), output_field=IntegerField())
+    return expression
+
+
+def apply_bulk_update(queryset, field, operation, value, floor=None, dry_run=False, extra=None):
+    """
+    Rewrite `field` on every row of `queryset` with one UPDATE statement.
+
+    With dry_run nothing is written; the matched row count and a sample of
+    old/new values are returned instead.
+    """
+    if operation != BulkOperation.SET.value:
+        # NULL prices stay NULL, GREATEST() would otherwise turn them into the floor
+        queryset = queryset.filter(**{f"{field}__isnull": False})
+    expression = build_expression(field, operation, value, floor)
+
+    if dry_run:
+        preview = queryset.order_by("pk").annotate(new_value=expression)
+        return {
+            "matched": queryset.count(),
+            "preview": list(preview.values("id", field, "new_value")[:PREVIEW_LIMIT]),
+        }
+
+    updated = queryset.update(**{field: expression}, **(extra or {}))
+    invalidate_catalog()
+    return {"updated": updated}
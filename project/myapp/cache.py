@@ -0,0 +1,28 @@
+import time
+
+from django.core.cache import cache
+
+
+# Every catalog cache key embeds this version, so bumping it drops all of them
+# at once instead of deleting keys one by one.
+CATALOG_VERSION_KEY = "catalog:version"
+
+
+def _fresh_version():
+    # never reuse a version whose keys may still be in the cache after eviction
+    return int(time.time() * 1000)
+
+
+def catalog_version():
+    return cache.get_or_set(CATALOG_VERSION_KEY, _fresh_version, None)
+
+
+def catalog_key(*parts):
+    return ":".join(["catalog", str(catalog_version()), *(str(part) for part in parts)])
+
+
+def invalidate_catalog():
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, _fresh_version(), None)
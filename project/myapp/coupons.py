@@ -0,0 +1,191 @@
+import logging
+import threading
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, models, router, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Cast
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework import status
+
+from myapp import outbox, sharding
+from myapp.enum import OutboxEventType
+from myapp.models import Coupon, CouponUsage, Order
+
+
+logger = logging.getLogger(__name__)
+
+CachedCoupon = namedtuple(
+    "CachedCoupon", ("id", "code", "discount_amount", "is_active", "expiration_date", "usage_limit", "per_user_limit")
+)
+COLUMNS = CachedCoupon._fields
+
+
+class CouponCache:
+    """
+    The live coupons of this process, by code. Loaded in one query and
+    reloaded COUPON_CACHE_TTL seconds later or as soon as one of them
+    expires, whichever comes first, which also drops expired coupons.
+
+    Codes that aren't live are looked up one by one and remembered until the
+    next reload, up to COUPON_CACHE_MAX_MISSES of them, so a campaign's
+    mistyped or expired codes don't query every time either.
+
+    It only saves reads: redeem() checks limits and expiry in its UPDATEs.
+    """
+
+    def __init__(self):
+        self.coupons = {}
+        self.misses = {}
+        self.refresh_at = None
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        self.refresh_at = None
+
+    def warm(self):
+        now = timezone.now()
+        live = {
+            row[1]: CachedCoupon(*row)
+            for row in Coupon.objects.filter(is_active=True, expiration_date__gt=now).values_list(*COLUMNS)
+        }
+        refresh_at = now + timedelta(seconds=settings.COUPON_CACHE_TTL)
+        if live:
+            refresh_at = min(refresh_at, min(coupon.expiration_date for coupon in live.values()))
+        # readers keep using the old dicts until these are swapped in
+        self.coupons, self.misses, self.refresh_at = live, {}, refresh_at
+
+    def get(self, code):
+        """The coupon with this code, usable or not, or None if there is none."""
+        refresh_at = self.refresh_at
+        if refresh_at is None or timezone.now() >= refresh_at:
+            with self.lock:
+                # another thread may have reloaded while this one waited
+                if self.refresh_at is refresh_at:
+                    self.warm()
+        coupon = self.coupons.get(code)
+        if coupon is not None:
+            return coupon
+        if code in self.misses:
+            return self.misses[code]
+        row = Coupon.objects.filter(code=code).values_list(*COLUMNS).first()
+        coupon = CachedCoupon(*row) if row else None
+        if len(self.misses) < settings.COUPON_CACHE_MAX_MISSES:
+            self.misses[code] = coupon
+        return coupon
+
+
+coupon_cache = CouponCache()
+
+
+def warm_coupon_cache():
+    """Load the live coupons before the first request needs them."""
+    try:
+        coupon_cache.warm()
+    except DatabaseError:
+        # e.g. not migrated yet, the first lookup loads them instead
+        logger.warning("Could not warm the coupon cache", exc_info=True)
+
+
+@receiver([post_save, post_delete], sender=Coupon)
+def invalidate_coupon_cache(sender, **kwargs):
+    # other processes catch up within COUPON_CACHE_TTL
+    coupon_cache.invalidate()
+
+
+class RedemptionError(Exception):
+    def __init__(self, detail, status_code=status.HTTP_400_BAD_REQUEST, key="detail"):
+        super().__init__(detail)
+        self.data = {key: detail}
+        self.status_code = status_code
+
+
+def expired():
+    # the response apply_coupon always gave for an inactive coupon
+    return RedemptionError("Coupon has expired", key="Invalid Status")
+
+
+def claim_use(coupon):
+    """One more use of `coupon`, if it is still live and under its usage_limit."""
+    claimed = Coupon.objects.filter(
+        Q(usage_limit__isnull=True) | Q(used_count__lt=F("usage_limit")),
+        pk=coupon.id,
+        is_active=True,
+        expiration_date__gt=timezone.now(),
+    ).update(used_count=F("used_count") + 1)
+    if not claimed:
+        raise RedemptionError("Coupon usage limit reached") if coupon.usage_limit is not None else expired()
+
+
+def claim_user_use(coupon, user_id):
+    """One more use of `coupon` by `user_id`, if under its per_user_limit."""
+    usages = CouponUsage.objects.filter(coupon=coupon.id, user=user_id)
+    if usages.filter(used_count__lt=coupon.per_user_limit).update(used_count=F("used_count") + 1):
+        return
+    try:
+        # first use by this user; the unique constraint settles a race between two of them
+        with transaction.atomic():
+            CouponUsage.objects.create(coupon_id=coupon.id, user_id=user_id, used_count=1)
+        return
+    except IntegrityError:
+        pass
+    if not usages.filter(used_count__lt=coupon.per_user_limit).update(used_count=F("used_count") + 1):
+        raise RedemptionError("Coupon already used the maximum number of times")
+
+
+def redeem(code, order_id, user_id):
+    """
+    Apply coupon `code` to order `order_id` for `user_id`. Every check is a
+    conditional UPDATE, so concurrent redemptions neither over-redeem nor
+    wait on a lock held in Python.
+    Raises RedemptionError when the coupon or the order can't be used.
+    """
+    coupon = coupon_cache.get(code)
+    if coupon is None:
+        raise RedemptionError("Coupon not found", status.HTTP_404_NOT_FOUND)
+    if not coupon.is_active or coupon.expiration_date <= timezone.now():
+        raise expired()
+    alias = sharding.shard_for_id(order_id)
+    if alias is None:
+        raise RedemptionError("Order not found", status.HTTP_404_NOT_FOUND)
+
+    def apply_discount():
+        with transaction.atomic(using=alias):
+            orders = Order.objects.using(alias).filter(pk=order_id)
+            # Cast truncates like the IntegerField did when the total was saved from Python
+            if not orders.update(total_amount=Cast(F("total_amount") - coupon.discount_amount, models.IntegerField())):
+                raise RedemptionError("Order not found", status.HTTP_404_NOT_FOUND)
+            total = orders.values_list("total_amount", flat=True).get()
+            outbox.emit(OutboxEventType.COUPON_APPLIED, order_id, {
+                "coupon": coupon.code,
+                "discount_amount": coupon.discount_amount,
+                "total_amount": total,
+            })
+
+    counted_on = router.db_for_write(Coupon)
+    if alias == counted_on:
+        # one database: the counted use and the discount commit together, a
+        # missing order rolls both back
+        with transaction.atomic(using=alias):
+            claim_uses(coupon, user_id)
+            apply_discount()
+        return
+
+    # the order's shard can't commit together with the use counters, so the
+    # discount is only applied once the use is committed: a failure in
+    # between leaves a counted use without its discount, never the reverse
+    if not Order.objects.using(alias).filter(pk=order_id).exists():
+        raise RedemptionError("Order not found", status.HTTP_404_NOT_FOUND)
+    with transaction.atomic(using=counted_on):
+        claim_uses(coupon, user_id)
+        transaction.on_commit(apply_discount, using=counted_on)
+
+
+def claim_uses(coupon, user_id):
+    claim_use(coupon)
+    if coupon.per_user_limit is not None:
+        claim_user_use(coupon, user_id)
@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def is_read_only(settings_dict):
+    return "mode=ro" in str(settings_dict["NAME"])
+
+
+def pragma_statements(pragmas, read_only=False):
+    for name, value in pragmas.items():
+        # the journal mode is stored in the file, a read-only connection can't change it
+        if read_only and name == "journal_mode":
+            continue
+        yield f"PRAGMA {name} = {value}"
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """Runs SQLITE_PRAGMAS on every new SQLite connection of the production profile."""
+    if connection.vendor != "sqlite" or not getattr(settings, "SQLITE_PRODUCTION", False):
+        return
+    with connection.cursor() as cursor:
+        for statement in pragma_statements(
+            getattr(settings, "SQLITE_PRAGMAS", {}), is_read_only(connection.settings_dict)
+        ):
+            cursor.execute(statement)
+
+
+class ReadWriteRouter:
+    """
+    Sends reads to the read-only SQLITE_READ_ALIAS connection and everything
+    else to 'default'. Both point at the same WAL mode file, so readers never
+    wait on the writer and see every committed write.
+
+    Reads made inside a transaction on 'default' stay there, so they see
+    that transaction's own uncommitted writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        if connections["default"].in_atomic_block:
+            return "default"
+        return getattr(settings, "SQLITE_READ_ALIAS", "default")
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # both aliases are the same database
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
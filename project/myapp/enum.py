@@ -52,4 +52,62 @@ class TransactionStatus(Enum):
 
     @classmethod
     def choices(cls):
-        return [(key.value, key.name) for key in cls]
\ No newline at end of file
+        return [(key.value, key.name) for key in cls]
+
+
+class ImportKind(Enum):
+    PRODUCTS = "products"
+    VARIANTS = "variants"
+
+    @classmethod
+    def choices(cls):
+        return [(key.value, key.name) for key in cls]
+
+
+class ImportStatus(Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+    @classmethod
+    def choices(cls):
+        return [(key.value, key.name) for key in cls]
+
+
+class BulkOperation(Enum):
+    PERCENT = "percent"
+    SET = "set"
+    ADD = "add"
+
+    @classmethod
+    def choices(cls):
+        return [(key.value, key.name) for key in cls]
+
+
+class OutboxEventType(Enum):
+    PAYMENT_CREATED = "payment.created"
+    COUPON_APPLIED = "order.coupon_applied"
+
+    @classmethod
+    def choices(cls):
+        return [(key.value, key.name) for key in cls]
+
+
+class OutboxStatus(Enum):
+    PENDING = "pending"
+    DELIVERED = "delivered"
+    FAILED = "failed"
+
+    @classmethod
+    def choices(cls):
+        return [(key.value, key.name) for key in cls]
+
+
+class IdempotencyStatus(Enum):
+    IN_FLIGHT = "in-flight"
+    DONE = "done"
+
+    @classmethod
+    def choices(cls):
+        return [(key.value, key.name) for key in cls]
@@ -0,0 +1,42 @@
+import csv
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+class Echo:
+    """File-like object whose write() just hands the line back to csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def get_chunk_size():
+    return getattr(settings, "EXPORT_CHUNK_SIZE", 2000)
+
+
+def iter_ndjson(queryset, fields, chunk_size=None):
+    encoder = DjangoJSONEncoder(separators=(",", ":"))
+    for row in queryset.values(*fields).iterator(chunk_size=chunk_size or get_chunk_size()):
+        yield encoder.encode(row) + "\n"
+
+
+def iter_csv(queryset, fields, chunk_size=None):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in queryset.values_list(*fields).iterator(chunk_size=chunk_size or get_chunk_size()):
+        yield writer.writerow(row)
+
+
+def export_response(queryset, fields, fmt, filename):
+    rows = iter_csv(queryset, fields) if fmt == "csv" else iter_ndjson(queryset, fields)
+    response = StreamingHttpResponse(rows, content_type=EXPORT_FORMATS[fmt])
+    response["Content-Disposition"] = f'attachment; filename="{filename}.{fmt}"'
+    return response
@@ -0,0 +1,74 @@
+from rest_framework import serializers
+from rest_framework.response import Response
+
+
+# Field types whose to_representation() is a no-op on the python value the
+# database adapter already returns, so the raw column value can be emitted.
+PASSTHROUGH_FIELDS = (
+    serializers.BooleanField,
+    serializers.CharField,
+    serializers.ChoiceField,
+    serializers.IntegerField,
+    serializers.PrimaryKeyRelatedField,
+)
+
+_mappers = {}
+
+
+class RowMapper:
+    """Turns values_list() tuples into the dicts the serializer would build."""
+
+    def __init__(self, names, columns):
+        self.names = tuple(names)
+        self.columns = tuple(columns)
+
+    def __call__(self, row):
+        return dict(zip(self.names, row))
+
+
+def compile_row_mapper(serializer_class, field_names=None):
+    """
+    Build (once per serializer and field set) a RowMapper for a read-only fast
+    path. Returns None when any field needs real serializer machinery.
+    """
+    cache_key = (serializer_class, field_names)
+    if cache_key in _mappers:
+        return _mappers[cache_key]
+
+    mapper = None
+    fields = serializer_class().fields
+    names = tuple(fields) if field_names is None else field_names
+    if all(
+        name in fields
+        and isinstance(fields[name], PASSTHROUGH_FIELDS)
+        and not fields[name].write_only
+        and "." not in fields[name].source
+        and fields[name].source != "*"
+        for name in names
+    ):
+        mapper = RowMapper(names, (fields[name].source for name in names))
+
+    _mappers[cache_key] = mapper
+    return mapper
+
+
+class FastListMixin:
+    """
+    list() that reads values_list() rows instead of model instances when the
+    serializer only has plain column fields. Output is identical to the
+    ModelSerializer path.
+    """
+
+    def get_row_mapper(self):
+        return compile_row_mapper(self.get_serializer_class())
+
+    def list(self, request, *args, **kwargs):
+        mapper = self.get_row_mapper()
+        if mapper is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset()).values_list(*mapper.columns)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response([mapper(row) for row in page])
+        return Response([mapper(row) for row in queryset])
@@ -0,0 +1,164 @@
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, router, transaction
+from django.utils import timezone
+from rest_framework import exceptions, status
+from rest_framework.response import Response
+
+from myapp.enum import IdempotencyStatus
+from myapp.models import IdempotencyKey
+
+
+# Idempotency-Key support for POST actions: the first request with a key
+# runs and its response is kept for IDEMPOTENCY_TTL seconds; a retry with the
+# same key gets that response back without running the action again. Keys
+# are scoped to the user and the path. They are stored in the IdempotencyKey
+# table, so a retry that lands on another worker still finds them; expired
+# rows are deleted by `manage.py sweep`.
+
+IN_FLIGHT = IdempotencyStatus.IN_FLIGHT.value
+DONE = IdempotencyStatus.DONE.value
+
+# headers of the original response worth replaying
+REPLAYED_HEADERS = ("Location", "Content-Location")
+
+
+class KeyInFlight(exceptions.APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "A request with this Idempotency-Key is still being processed."
+    default_code = "idempotency_key_in_flight"
+
+
+class KeyReused(exceptions.APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = "This Idempotency-Key was already used with a different request."
+    default_code = "idempotency_key_reused"
+
+
+class Replay(Exception):
+    # raised by IdempotencyMixin.initial(), handle_exception() answers with the stored response
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+
+
+def get_key(request):
+    key = request.headers.get(settings.IDEMPOTENCY_HEADER)
+    if key is None:
+        return None
+    if not key or len(key) > 255:
+        raise exceptions.ValidationError({settings.IDEMPOTENCY_HEADER: ["Must be 1 to 255 characters."]})
+    return key
+
+
+def store_key(request, key):
+    scope = f"{request.user.pk}:{request.path}:{key}"
+    return hashlib.sha256(scope.encode()).hexdigest()
+
+
+def fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(f"{request.method}:{body}".encode()).hexdigest()[:16]
+
+
+def claim(stored_key, digest, entry=None):
+    """Take `stored_key` for this request; False when another request got it first."""
+    now = timezone.now()
+    fields = {
+        "fingerprint": digest,
+        "status": IN_FLIGHT,
+        "status_code": None,
+        "data": None,
+        "headers": {},
+        "expires_at": now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT),
+    }
+    if entry is not None:
+        # an expired key, whoever moves expires_at first owns it
+        return bool(IdempotencyKey.objects.filter(pk=entry.pk, expires_at=entry.expires_at).update(**fields))
+    try:
+        with transaction.atomic(using=router.db_for_write(IdempotencyKey)):
+            IdempotencyKey.objects.create(key=stored_key, **fields)
+    except IntegrityError:
+        return False
+    return True
+
+
+def begin(request, key):
+    """
+    Claim `key` for this request. Returns None when the action should run,
+    or the stored Response when it already ran.
+    """
+    stored_key, digest = store_key(request, key), fingerprint(request)
+    entry = IdempotencyKey.objects.filter(key=stored_key).first()
+    if entry is None or entry.expires_at <= timezone.now():
+        if claim(stored_key, digest, entry):
+            return None
+        # a concurrent request claimed it in between
+        return begin(request, key)
+
+    if entry.fingerprint != digest:
+        raise KeyReused()
+    if entry.status == IN_FLIGHT:
+        raise KeyInFlight()
+    return Response(entry.data, status=entry.status_code, headers={**entry.headers, "Idempotent-Replayed": "true"})
+
+
+def release(request, key):
+    IdempotencyKey.objects.filter(key=store_key(request, key)).delete()
+
+
+def finish(request, key, response):
+    """Keep `response` for replays, or free the key when it is worth retrying."""
+    if response.status_code >= 500:
+        release(request, key)
+        return
+    IdempotencyKey.objects.filter(key=store_key(request, key)).update(
+        status=DONE,
+        status_code=response.status_code,
+        data=getattr(response, "data", None),
+        headers={name: response[name] for name in REPLAYED_HEADERS if response.has_header(name)},
+        expires_at=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_TTL),
+    )
+
+
+class IdempotencyMixin:
+    """
+    Makes the POST actions named in `idempotent_actions` honour an
+    Idempotency-Key header. Requests without the header run as before.
+    """
+
+    idempotent_actions = ("create",)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.idempotency_key = None
+        if request.method != "POST" or self.action not in self.idempotent_actions:
+            return
+        key = get_key(request)
+        if key is None:
+            return
+        replay = begin(request, key)
+        if replay is not None:
+            # skips the action, dispatch() hands the exception to handle_exception()
+            raise Replay(replay)
+        self.idempotency_key = key
+
+    def handle_exception(self, exc):
+        if isinstance(exc, Replay):
+            return exc.response
+        try:
+            return super().handle_exception(exc)
+        except Exception:
+            # a crash is worth retrying, don't make the retry wait for the lock
+            if getattr(self, "idempotency_key", None) is not None:
+                release(self.request, self.idempotency_key)
+            raise
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, "idempotency_key", None) is not None:
+            finish(request, self.idempotency_key, response)
+        return response
@@ -0,0 +1,222 @@
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+
+from myapp import archive
+from myapp.cache import invalidate_catalog
+from myapp.enum import ImportKind, ImportStatus, PriceChoice
+from myapp.models import Category, ImportRowError, Product, ProductVariant
+
+
+PRODUCT_UPDATE_FIELDS = (
+    "name", "slug", "description", "price", "discount_price",
+    "category", "inventory_count", "is_active", "updates_at",
+)
+VARIANT_UPDATE_FIELDS = (
+    "product", "variant_name", "variant_value", "price", "stock_count", "updates_at",
+)
+
+TRUE_VALUES = ("1", "true", "yes", "y")
+
+
+class RowError(Exception):
+    pass
+
+
+class MalformedRow(dict):
+    # stands in for a line that doesn't parse, so it is reported like any
+    # other bad row instead of failing the job on every resume
+    def __init__(self, message):
+        super().__init__()
+        self.message = message
+
+
+def read_rows(fp, fmt):
+    """Yield one dict per input row without loading the whole file."""
+    if fmt == "csv":
+        yield from csv.DictReader(fp)
+    else:
+        for line in fp:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield MalformedRow(f"Invalid JSON: {e}")
+                continue
+            yield row if isinstance(row, dict) else MalformedRow("Row must be a JSON object")
+
+
+def detect_format(path):
+    return "csv" if str(path).lower().endswith(".csv") else "jsonl"
+
+
+def _required(row, name):
+    value = row.get(name)
+    if value in (None, ""):
+        raise RowError(f"{name} is required")
+    return str(value).strip()
+
+
+def _integer(row, name, required=False):
+    value = row.get(name)
+    if value in (None, ""):
+        if required:
+            raise RowError(f"{name} is required")
+        return None
+    # int() would quietly turn 12.5 into 12 and true into 1
+    if isinstance(value, bool):
+        raise RowError(f"{name} must be an integer")
+    try:
+        number = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise RowError(f"{name} must be an integer")
+    if not number.is_finite() or number != number.to_integral_value():
+        raise RowError(f"{name} must be an integer")
+    return int(number)
+
+
+def _boolean(value):
+    if value in (None, ""):
+        return True
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in TRUE_VALUES
+
+
+class CatalogImporter:
+    """
+    Upserts products or variants keyed on sku, one bulk INSERT ... ON CONFLICT
+    per batch. Each batch commits together with the job's progress counter, so
+    a failed run resumes from the first row that was not committed.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.categories = {}
+        self.products = {}
+
+    def run(self, fp, fmt):
+        job = self.job
+        job.status = ImportStatus.RUNNING.value
+        job.save(update_fields=["status", "updated_at"])
+
+        rows = islice(read_rows(fp, fmt), job.committed_rows, None)
+        try:
+            while True:
+                batch = list(islice(rows, job.batch_size))
+                if not batch:
+                    break
+                self.import_batch(batch, first_line=job.committed_rows + 1)
+        except Exception:
+            job.status = ImportStatus.FAILED.value
+            job.save(update_fields=["status", "updated_at"])
+            raise
+
+        job.status = ImportStatus.COMPLETED.value
+        job.save(update_fields=["status", "updated_at"])
+        return job
+
+    def import_batch(self, batch, first_line):
+        if self.job.kind == ImportKind.PRODUCTS.value:
+            self.resolve_categories(batch)
+            model, build, update_fields = Product, self.build_product, PRODUCT_UPDATE_FIELDS
+        else:
+            self.resolve_products(batch)
+            model, build, update_fields = ProductVariant, self.build_variant, VARIANT_UPDATE_FIELDS
+
+        objs = {}
+        errors = []
+        for line, row in enumerate(batch, start=first_line):
+            try:
+                if isinstance(row, MalformedRow):
+                    raise RowError(row.message)
+                obj = build(row)
+            except RowError as e:
+                errors.append(
+                    ImportRowError(job=self.job, line=line, sku=str(row.get("sku") or "")[:64], message=str(e))
+                )
+                continue
+            # a repeated sku in one batch would hit the same row twice in one statement
+            objs[obj.sku] = obj
+
+        with transaction.atomic():
+            if model is Product:
+                # an archived product's sku coming back in a valid row reactivates
+                # that product, and is undone with the batch
+                archive.restore_skus(set(objs))
+            model.objects.bulk_create(
+                objs.values(),
+                update_conflicts=True,
+                unique_fields=["sku"],
+                update_fields=update_fields,
+            )
+            ImportRowError.objects.bulk_create(errors)
+            self.job.committed_rows += len(batch)
+            self.job.error_count += len(errors)
+            self.job.save(update_fields=["committed_rows", "error_count", "updated_at"])
+        invalidate_catalog()
+
+    def resolve_categories(self, batch):
+        names = {str(row.get("category") or "").strip() for row in batch} - set(self.categories)
+        names.discard("")
+        if names:
+            # category names aren't unique, the oldest one wins
+            for pk, name in Category.objects.filter(name__in=names).order_by("-pk").values_list("pk", "name"):
+                self.categories[name] = pk
+
+    def resolve_products(self, batch):
+        skus = {str(row.get("product_sku") or "").strip() for row in batch} - set(self.products)
+        skus.discard("")
+        if skus:
+            self.products.update(Product.objects.filter(sku__in=skus).values_list("sku", "pk"))
+
+    def build_product(self, row):
+        category = _required(row, "category")
+        if category not in self.categories:
+            raise RowError(f"Unknown category '{category}'")
+
+        return Product(
+            sku=_required(row, "sku"),
+            name=_required(row, "name")[:50],
+            slug=row.get("slug") or "",
+            description=row.get("description") or None,
+            price=_integer(row, "price", required=True),
+            discount_price=_integer(row, "discount_price"),
+            category_id=self.categories[category],
+            inventory_count=_integer(row, "inventory_count") or 0,
+            is_active=_boolean(row.get("is_active")),
+        )
+
+    def build_variant(self, row):
+        product_sku = _required(row, "product_sku")
+        if product_sku not in self.products:
+            raise RowError(f"Unknown product sku '{product_sku}'")
+
+        variant_value = _required(row, "variant_value")
+        if variant_value not in (choice.value for choice in PriceChoice):
+            raise RowError("variant_value must be one of the price ranges")
+
+        return ProductVariant(
+            sku=_required(row, "sku"),
+            product_id=self.products[product_sku],
+            variant_name=_required(row, "variant_name")[:50],
+            variant_value=variant_value,
+            price=_integer(row, "price", required=True),
+            stock_count=_integer(row, "stock_count"),
+        )
+
+
+def run_import(job):
+    path = job.source.path
+    with open(path, newline="", encoding="utf-8") as fp:
+        return CatalogImporter(job).run(fp, detect_format(path))
+
+
+def write_error_report(job, fp):
+    writer = csv.writer(fp)
+    writer.writerow(("line", "sku", "message"))
+    writer.writerows(job.row_errors.order_by("line").values_list("line", "sku", "message").iterator())
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from myapp import archive
+from myapp.models import ArchivedProduct
+
+
+class Command(BaseCommand):
+    help = (
+        "Move inactive products and their variants to the archive tables, "
+        "--batch-size per transaction, or move archived ones back with --restore."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.ARCHIVE_BATCH_SIZE)
+        parser.add_argument("--pause", type=float, default=0, help="Seconds between batches")
+        parser.add_argument("--restore", type=int, nargs="+", metavar="ID", help="Reactivate these archived products")
+
+    def handle(self, *args, **options):
+        if options["restore"]:
+            ids = set(options["restore"])
+            count = archive.restore(ids)
+            self.stdout.write(f"{count} restored")
+            skipped = list(ArchivedProduct.objects.filter(pk__in=ids).order_by("pk").values_list("pk", flat=True))
+            if skipped:
+                self.stderr.write(f"Kept archived, their sku is in use: {', '.join(map(str, skipped))}")
+            return
+
+        def progress(count):
+            if options["verbosity"] > 1:
+                self.stdout.write(f"{count} archived so far")
+
+        count = archive.archive_inactive(options["batch_size"], options["pause"], progress)
+        self.stdout.write(f"{count} archived")
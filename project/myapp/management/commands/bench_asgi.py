@@ -0,0 +1,161 @@
+import asyncio
+import io
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db.backends.signals import connection_created
+from rest_framework_simplejwt.tokens import AccessToken
+
+from myapp.models import CustomUser, Product
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve the same catalog reads from one worker three ways, in process: sync views "
+        "behind WSGI, sync views behind ASGI and the async views behind ASGI, and report "
+        "throughput, latency and how many requests the worker kept in flight."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=400)
+        parser.add_argument("--concurrency", type=int, default=50, help="Clients hitting the ASGI worker at once")
+        parser.add_argument("--wsgi-threads", type=int, default=1, help="Threads of the WSGI worker, 1 is a sync worker")
+        parser.add_argument(
+            "--db-latency-ms", type=float, default=5,
+            help="Added to every query, standing in for a database across the network",
+        )
+
+    def handle(self, *args, **options):
+        user = CustomUser.objects.order_by("id").first()
+        product_id = Product.objects.order_by("id").values_list("id", flat=True).first()
+        if user is None or product_id is None:
+            raise CommandError("No catalog to read, run generate_catalog first")
+
+        self.headers = {
+            "accept": "application/json",
+            "authorization": f"Bearer {AccessToken.for_user(user)}",
+        }
+        paths = ["/product/?limit=20", f"/product/{product_id}/", "/productvariant/?limit=20", "/category/hierarchy/"]
+        self.install_latency(options["db_latency_ms"] / 1000)
+
+        total, concurrency = options["requests"], options["concurrency"]
+        sync_paths = [paths[i % len(paths)] for i in range(total)]
+        async_paths = ["/async" + path for path in sync_paths]
+
+        self.report("wsgi, sync views", *self.run_wsgi(sync_paths, options["wsgi_threads"]))
+        self.report("asgi, sync views", *asyncio.run(self.run_asgi(sync_paths, concurrency)))
+        self.report("asgi, async views", *asyncio.run(self.run_asgi(async_paths, concurrency)))
+
+    def install_latency(self, seconds):
+        if not seconds:
+            return
+
+        def delay(execute, sql, params, many, context):
+            time.sleep(seconds)
+            return execute(sql, params, many, context)
+
+        def add_delay(sender, connection, **kwargs):
+            # first in line, QueryBudgetMiddleware pops its own wrapper off the end
+            if delay not in connection.execute_wrappers:
+                connection.execute_wrappers.insert(0, delay)
+
+        self.add_delay = add_delay
+        connection_created.connect(add_delay)
+
+    def run_wsgi(self, paths, threads):
+        application = get_wsgi_application()
+
+        def call(path):
+            path, _, query = path.partition("?")
+            environ = {
+                "REQUEST_METHOD": "GET",
+                "PATH_INFO": path,
+                "QUERY_STRING": query,
+                "SERVER_NAME": "localhost",
+                "SERVER_PORT": "80",
+                "SERVER_PROTOCOL": "HTTP/1.1",
+                "wsgi.input": io.BytesIO(),
+                "wsgi.errors": sys.stderr,
+                "wsgi.url_scheme": "http",
+                **{f"HTTP_{name.upper()}": value for name, value in self.headers.items()},
+            }
+            status = []
+            start = time.perf_counter()
+            body = application(environ, lambda line, headers: status.append(int(line.split()[0])))
+            b"".join(body)
+            body.close()
+            return time.perf_counter() - start, status[0]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(call, paths))
+        return results, time.perf_counter() - started
+
+    async def run_asgi(self, paths, concurrency):
+        application = get_asgi_application()
+        queue = asyncio.Queue()
+        for path in paths:
+            queue.put_nowait(path)
+        results = []
+
+        async def call(path):
+            path, _, query = path.partition("?")
+            scope = {
+                "type": "http",
+                "asgi": {"version": "3.0"},
+                "http_version": "1.1",
+                "method": "GET",
+                "scheme": "http",
+                "path": path,
+                "raw_path": path.encode(),
+                "query_string": query.encode(),
+                "headers": [(b"host", b"localhost")] + [(k.encode(), v.encode()) for k, v in self.headers.items()],
+                "server": ("localhost", 80),
+                "client": ("127.0.0.1", 50000),
+            }
+            messages = [{"type": "http.request", "body": b"", "more_body": False}]
+            status = []
+
+            async def receive():
+                if messages:
+                    return messages.pop()
+                # the client never hangs up, Django cancels this once it responded
+                await asyncio.Event().wait()
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    status.append(message["status"])
+
+            start = time.perf_counter()
+            await application(scope, receive, send)
+            return time.perf_counter() - start, status[0]
+
+        async def client():
+            while not queue.empty():
+                results.append(await call(queue.get_nowait()))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return results, time.perf_counter() - started
+
+    def report(self, name, results, elapsed):
+        latencies = sorted(latency for latency, _ in results)
+        errors = sum(1 for _, status in results if status >= 400)
+        rps = len(results) / elapsed
+        self.stdout.write(
+            f"{name:<18} {rps:>8,.0f} req/s  p50 {percentile(latencies, 0.5) * 1000:>7.1f}ms  "
+            f"p95 {percentile(latencies, 0.95) * 1000:>7.1f}ms  "
+            # Little's law: requests the worker had in flight on average
+            f"in flight {rps * statistics.fmean(latencies):>5.1f}  errors {errors}"
+        )
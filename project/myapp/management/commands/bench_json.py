@@ -0,0 +1,94 @@
+import io
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from myapp.parsers import ORJSONParser
+from myapp.renderers import ORJSONRenderer, orjson
+
+
+def product_page(size):
+    return {
+        "count": size * 50,
+        "next": f"http://testserver/product/?limit={size}&offset={size}",
+        "previous": None,
+        "results": [
+            {"name": f"Product {i} – édition", "category": i % 40, "price": 1000 + i}
+            for i in range(size)
+        ],
+    }
+
+
+def cart(items):
+    return {
+        "user": "shopper@example.com : 2025-04-09",
+        "items": [
+            {"product_variant": i, "quantity": i % 5 + 1, "price_at_time": 250 + i}
+            for i in range(items)
+        ],
+    }
+
+
+def coupons(size):
+    # raw Decimal/datetime values, as returned by values() or custom actions
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    return [
+        {
+            "code": f"SAVE{i}",
+            "discount_amount": Decimal(f"{i % 90}.50"),
+            "is_active": i % 3 != 0,
+            "expiration_date": start + timedelta(days=i, microseconds=123456),
+            "created": (start + timedelta(days=i)).date(),
+        }
+        for i in range(size)
+    ]
+
+
+PAYLOADS = {
+    "product page (20)": product_page(20),
+    "product page (1000)": product_page(1000),
+    "cart (50 items)": cart(50),
+    "coupons (500)": coupons(500),
+}
+
+
+class Command(BaseCommand):
+    help = "Compare encode/decode throughput of the stdlib and orjson renderer/parser."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seconds", type=float, default=0.5, help="Time spent per measurement")
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stdout.write("orjson is not installed, both sides use the stdlib json module")
+
+        seconds = options["seconds"]
+        for name, payload in PAYLOADS.items():
+            stdlib = JSONRenderer().render(payload)
+            fast = ORJSONRenderer().render(payload)
+
+            encode_std = self.rate(lambda: JSONRenderer().render(payload), seconds)
+            encode_fast = self.rate(lambda: ORJSONRenderer().render(payload), seconds)
+            decode_std = self.rate(lambda: JSONParser().parse(io.BytesIO(stdlib)), seconds)
+            decode_fast = self.rate(lambda: ORJSONParser().parse(io.BytesIO(stdlib)), seconds)
+
+            self.stdout.write(
+                f"{name:<20} {len(stdlib):>8} bytes  identical={stdlib == fast}\n"
+                f"    encode  stdlib {encode_std:>10,.0f}/s  orjson {encode_fast:>10,.0f}/s  x{encode_fast / encode_std:.1f}\n"
+                f"    decode  stdlib {decode_std:>10,.0f}/s  orjson {decode_fast:>10,.0f}/s  x{decode_fast / decode_std:.1f}"
+            )
+
+    def rate(self, func, seconds):
+        calls = 0
+        start = time.perf_counter()
+        deadline = start + seconds
+        while True:
+            func()
+            calls += 1
+            now = time.perf_counter()
+            if now >= deadline:
+                return calls / (now - start)
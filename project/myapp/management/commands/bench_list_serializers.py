@@ -0,0 +1,79 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from myapp.fastpath import compile_row_mapper
+from myapp.models import Category, Product, ProductVariant
+from myapp.serializers import CategorySerializer, ProductSerializer, ProductVariantSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compare rows/sec of the ModelSerializer list path against the values() fast path."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=5000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        # synthetic rows are rolled back so the benchmark leaves no trace
+        try:
+            with transaction.atomic():
+                self.seed(options["rows"])
+                for model, serializer_class in (
+                    (Product, ProductSerializer),
+                    (ProductVariant, ProductVariantSerializer),
+                    (Category, CategorySerializer),
+                ):
+                    self.compare(model, serializer_class, options["repeat"])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, rows):
+        parent = Category.objects.create(name="bench")
+        Category.objects.bulk_create(
+            Category(name=f"bench {i}", slug=f"bench-{i}", parent=parent) for i in range(rows)
+        )
+        products = Product.objects.bulk_create(
+            Product(name=f"bench {i}", price=i, category=parent, description="x" * 200)
+            for i in range(rows)
+        )
+        ProductVariant.objects.bulk_create(
+            ProductVariant(product=product, variant_name="size", variant_value="medium", price=product.price)
+            for product in products
+        )
+
+    def compare(self, model, serializer_class, repeat):
+        queryset = model.objects.all()
+        mapper = compile_row_mapper(serializer_class)
+        renderer = JSONRenderer()
+
+        def slow():
+            return serializer_class(queryset.all(), many=True).data
+
+        def fast():
+            return [mapper(row) for row in queryset.values_list(*mapper.columns)]
+
+        slow_bytes, slow_rate = self.measure(slow, renderer, repeat)
+        fast_bytes, fast_rate = self.measure(fast, renderer, repeat)
+
+        self.stdout.write(
+            f"{serializer_class.__name__:<26} serializer {slow_rate:>10,.0f} rows/s   "
+            f"fast path {fast_rate:>10,.0f} rows/s   x{fast_rate / slow_rate:.1f}   "
+            f"identical={slow_bytes == fast_bytes}"
+        )
+
+    def measure(self, build, renderer, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            data = build()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return renderer.render(data), len(data) / best
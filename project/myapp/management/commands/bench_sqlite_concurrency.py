@@ -0,0 +1,157 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from myapp.db import pragma_statements
+from myapp.models import CartItem, Product
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure catalog read throughput while cart writers run, on a copy of the "
+        "database with the default SQLite settings and with the production profile."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--readers", type=int, default=8)
+        parser.add_argument("--writers", type=int, default=2)
+        parser.add_argument("--seconds", type=float, default=5)
+        parser.add_argument("--database", help="SQLite file to copy, defaults to the 'default' database")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        source = options["database"] or str(connections["default"].settings_dict["NAME"])
+        if not os.path.isfile(source):
+            raise CommandError(f"{source} is not a SQLite file")
+
+        self.product_table = Product._meta.db_table
+        self.item_table = CartItem._meta.db_table
+
+        results = {}
+        with tempfile.TemporaryDirectory() as directory:
+            for profile in ("default", "production"):
+                path = os.path.join(directory, f"{profile}.sqlite3")
+                self.copy(source, path, profile)
+                results[profile] = self.run(path, profile, options)
+                self.report(profile, results[profile])
+
+        before, after = results["default"]["reads"], results["production"]["reads"]
+        if before:
+            self.stdout.write(f"read throughput x{after / before:.1f} with the production profile")
+
+    def copy(self, source, path, profile):
+        # the backup API gives a consistent snapshot even while the source is in use
+        with sqlite3.connect(f"file:{source}?mode=ro", uri=True) as src, sqlite3.connect(path) as dst:
+            src.backup(dst)
+            if profile == "production":
+                dst.execute("PRAGMA journal_mode = WAL")
+            if not dst.execute(f"SELECT 1 FROM {self.item_table} LIMIT 1").fetchone():
+                raise CommandError("No cart items to write to, run generate_catalog first")
+            self.cart_ids = [row[0] for row in dst.execute(f"SELECT DISTINCT cart_id FROM {self.item_table}")]
+            self.product_count = dst.execute(f"SELECT COUNT(*) FROM {self.product_table}").fetchone()[0]
+
+    def connect(self, path, profile, read_only):
+        if profile == "production":
+            uri = f"file:{path}?mode=ro" if read_only else f"file:{path}"
+            connection = sqlite3.connect(uri, uri=True, timeout=5, isolation_level=None, check_same_thread=False)
+            for statement in pragma_statements(settings.SQLITE_PRAGMAS, read_only):
+                connection.execute(statement)
+        else:
+            # what Django does out of the box: rollback journal, deferred transactions
+            connection = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        return connection
+
+    def run(self, path, profile, options):
+        stats = {"reads": 0, "writes": 0, "read_errors": 0, "write_errors": 0, "latencies": []}
+        lock = threading.Lock()
+        done = threading.Event()
+
+        def reader(rng):
+            connection = self.connect(path, profile, read_only=True)
+            latencies, reads, errors = [], 0, 0
+            while not done.is_set():
+                offset = rng.randrange(max(1, min(self.product_count, 10000) - 20))
+                start = time.perf_counter()
+                try:
+                    # one product list page: the count and the rows
+                    connection.execute(f"SELECT COUNT(*) FROM {self.product_table} WHERE is_active").fetchone()
+                    connection.execute(
+                        f"SELECT id, name, price, category_id FROM {self.product_table} "
+                        f"WHERE is_active ORDER BY id LIMIT 20 OFFSET ?",
+                        (offset,),
+                    ).fetchall()
+                    reads += 1
+                    latencies.append(time.perf_counter() - start)
+                except sqlite3.OperationalError:
+                    errors += 1
+            connection.close()
+            with lock:
+                stats["reads"] += reads
+                stats["read_errors"] += errors
+                stats["latencies"].extend(latencies)
+
+        def writer(rng):
+            connection = self.connect(path, profile, read_only=False)
+            begin = "BEGIN IMMEDIATE" if profile == "production" else "BEGIN"
+            writes = errors = 0
+            while not done.is_set():
+                cart_id = rng.choice(self.cart_ids)
+                try:
+                    # a cart PATCH: read the items, then rewrite them
+                    connection.execute(begin)
+                    connection.execute(f"SELECT id, quantity FROM {self.item_table} WHERE cart_id = ?", (cart_id,)).fetchall()
+                    connection.execute(
+                        f"UPDATE {self.item_table} SET quantity = ? WHERE cart_id = ?", (rng.randint(1, 5), cart_id)
+                    )
+                    connection.execute("COMMIT")
+                    writes += 1
+                except sqlite3.OperationalError:
+                    if connection.in_transaction:
+                        connection.execute("ROLLBACK")
+                    errors += 1
+            connection.close()
+            with lock:
+                stats["writes"] += writes
+                stats["write_errors"] += errors
+
+        threads = [
+            threading.Thread(target=reader, args=(random.Random(options["seed"] + i),))
+            for i in range(options["readers"])
+        ] + [
+            threading.Thread(target=writer, args=(random.Random(-options["seed"] - i - 1),))
+            for i in range(options["writers"])
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(options["seconds"])
+        done.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        stats["latencies"].sort()
+        stats["reads"] /= elapsed
+        stats["writes"] /= elapsed
+        return stats
+
+    def report(self, profile, stats):
+        ms = lambda value: float("nan") if value is None else value * 1000  # noqa: E731
+        self.stdout.write(
+            f"{profile:<11} reads {stats['reads']:>9,.0f}/s  p95 {ms(percentile(stats['latencies'], 0.95)):>7.2f}ms  "
+            f"p99 {ms(percentile(stats['latencies'], 0.99)):>7.2f}ms  writes {stats['writes']:>7,.0f}/s  "
+            f"errors {stats['read_errors']} read / {stats['write_errors']} write"
+        )
@@ -0,0 +1,43 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.outbox import Dispatcher
+
+
+class Command(BaseCommand):
+    help = (
+        "Deliver order and payment events from the outbox to OUTBOX_ENDPOINTS, in "
+        "batches, retrying failures with backoff. Runs until stopped, or until the "
+        "outbox is empty with --once. Several can run side by side."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Exit once no event is due")
+        parser.add_argument("--interval", type=float, default=1, help="Seconds to wait when the outbox is empty")
+        parser.add_argument("--endpoint", action="append", help="Deliver here instead of OUTBOX_ENDPOINTS")
+        parser.add_argument("--batch-size", type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument("--concurrency", type=int, default=settings.OUTBOX_CONCURRENCY)
+
+    def handle(self, *args, **options):
+        endpoints = options["endpoint"] or settings.OUTBOX_ENDPOINTS
+        if not endpoints:
+            raise CommandError("No endpoints to deliver to, set OUTBOX_ENDPOINTS or pass --endpoint")
+
+        with Dispatcher(endpoints, options["batch_size"], options["concurrency"]) as dispatcher:
+            if options["once"]:
+                self.report(*dispatcher.drain())
+                return
+            try:
+                while True:
+                    delivered, failed = dispatcher.run_once()
+                    if delivered or failed:
+                        self.report(delivered, failed)
+                    else:
+                        time.sleep(options["interval"])
+            except KeyboardInterrupt:
+                pass
+
+    def report(self, delivered, failed):
+        self.stdout.write(f"{delivered} delivered, {failed} failed")
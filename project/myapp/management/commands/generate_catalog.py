@@ -0,0 +1,257 @@
+import random
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from myapp import sharding
+from myapp.cache import invalidate_catalog
+from myapp.enum import OrderStatus, PaymentMethod, PaymentStatus, PriceChoice
+from myapp.models import (
+    Cart,
+    CartItem,
+    Category,
+    Coupon,
+    CustomUser,
+    Order,
+    OrderItem,
+    Payment,
+    Product,
+    ProductVariant,
+    Review,
+)
+
+
+ADJECTIVES = ("Classic", "Urban", "Trail", "Lite", "Pro", "Eco", "Retro", "Prime", "Flex", "Nova")
+NOUNS = ("Runner", "Jacket", "Backpack", "Watch", "Lamp", "Kettle", "Headset", "Chair", "Bottle", "Tent")
+VARIANTS = ("Small", "Medium", "Large", "Red", "Blue", "Black", "32GB", "64GB")
+
+LOADTEST_EMAIL = "loadtest-{}@example.com"
+LOADTEST_COUPON = "LOADTEST{}"
+
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Command(BaseCommand):
+    help = "Fill the database with a synthetic catalog, users, carts, orders and reviews."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--depth", type=int, default=4, help="Levels in the category tree")
+        parser.add_argument("--breadth", type=int, default=5, help="Children per category")
+        parser.add_argument("--products", type=int, default=100000)
+        parser.add_argument("--variants", type=int, default=3, help="Variants per product")
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--reviews", type=int, default=50000)
+        parser.add_argument("--coupons", type=int, default=100)
+        parser.add_argument("--password", default="loadtest-pw", help="Password of every generated user")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=0, help="Random seed, same seed same data")
+
+    def handle(self, *args, **options):
+        if CustomUser.objects.filter(email=LOADTEST_EMAIL.format(0)).exists():
+            raise CommandError("Synthetic data is already present, run this against a fresh database")
+
+        self.random = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        started = time.perf_counter()
+
+        leaves = self.generate_categories(options["depth"], options["breadth"])
+        products = self.generate_products(options["products"], leaves)
+        variants = self.generate_variants(products, options["variants"])
+        users = self.generate_users(options["users"], options["password"])
+        self.generate_carts(users, variants)
+        self.generate_orders(users, variants)
+        self.generate_reviews(options["reviews"], products, users)
+        self.generate_coupons(options["coupons"])
+        invalidate_catalog()
+
+        self.stdout.write(f"Done in {time.perf_counter() - started:.1f}s")
+
+    def log(self, what, count):
+        self.stdout.write(f"  {count:>10,} {what}")
+
+    def create(self, model, objects, using=None):
+        """bulk_create in batches, returning the (first, last) primary keys."""
+        first = last = None
+        manager = model.objects.db_manager(using)
+        for batch in batched(objects, self.batch_size):
+            created = manager.bulk_create(batch)
+            first = created[0].pk if first is None else first
+            last = created[-1].pk
+        return first, last
+
+    def pick(self, id_range):
+        # ids from one bulk_create run are contiguous
+        return self.random.randint(*id_range)
+
+    def generate_categories(self, depth, breadth):
+        level = Category.objects.bulk_create(
+            Category(name=f"Department {i}", slug=f"department-{i}") for i in range(breadth)
+        )
+        total = len(level)
+        for _ in range(depth - 1):
+            level = Category.objects.bulk_create(
+                Category(name=f"{parent.name}.{i}", slug=f"{parent.slug}-{i}", parent_id=parent.pk)
+                for parent in level
+                for i in range(breadth)
+            )
+            total += len(level)
+        self.log("categories", total)
+        return [category.pk for category in level]
+
+    def generate_products(self, count, leaves):
+        choice, randint = self.random.choice, self.random.randint
+        ids = self.create(
+            Product,
+            (
+                Product(
+                    name=f"{choice(ADJECTIVES)} {choice(NOUNS)} {i}",
+                    slug=f"product-{i}",
+                    description=f"Synthetic product {i} for load testing.",
+                    price=(price := randint(500, 50000)),
+                    discount_price=price - price // 10 if i % 4 == 0 else None,
+                    category_id=choice(leaves),
+                    inventory_count=randint(0, 500),
+                    is_active=i % 20 != 0,
+                )
+                for i in range(count)
+            ),
+        )
+        self.log("products", count)
+        return ids
+
+    def generate_variants(self, products, per_product):
+        choices = [choice.value for choice in PriceChoice]
+        ids = self.create(
+            ProductVariant,
+            (
+                ProductVariant(
+                    product_id=product_id,
+                    variant_name=VARIANTS[(product_id + i) % len(VARIANTS)],
+                    variant_value=choices[i % len(choices)],
+                    price=self.random.randint(500, 50000),
+                    stock_count=self.random.randint(0, 100),
+                )
+                for product_id in range(products[0], products[1] + 1)
+                for i in range(per_product)
+            ),
+        )
+        self.log("variants", (products[1] - products[0] + 1) * per_product)
+        return ids
+
+    def generate_users(self, count, password):
+        # hashing once keeps this fast, every user shares the same password
+        password = make_password(password)
+        ids = self.create(
+            CustomUser,
+            (
+                CustomUser(
+                    email=LOADTEST_EMAIL.format(i), first_name="Load", last_name=f"Tester {i}", password=password
+                )
+                for i in range(count)
+            ),
+        )
+        self.log("users", count)
+        return ids
+
+    def generate_carts(self, users, variants):
+        carts = self.create(Cart, (Cart(user_id=user_id) for user_id in range(users[0], users[1] + 1)))
+        items = self.create(
+            CartItem,
+            (
+                CartItem(cart_id=cart_id, product_variant_id=self.pick(variants), quantity=1, price_at_time=1000)
+                for cart_id in range(carts[0], carts[1] + 1)
+                for _ in range(self.random.randint(1, 5))
+            ),
+        )
+        self.log("cart items", items[1] - items[0] + 1)
+
+    def generate_orders(self, users, variants):
+        # one run per shard, so each shard's order ids are contiguous and the
+        # items and payments land next to their order
+        by_shard = defaultdict(list)
+        for user_id in range(users[0], users[1] + 1):
+            by_shard[sharding.shard_for_user(user_id)].append(user_id)
+
+        statuses = [status.value for status in OrderStatus]
+        methods = [method.value for method in PaymentMethod]
+        payment_statuses = [status.value for status in PaymentStatus]
+        order_count = item_count = 0
+        for alias, user_ids in by_shard.items():
+            orders = self.create(
+                Order,
+                (
+                    Order(user_id=user_id, order_status=self.random.choice(statuses), total_amount=0)
+                    for user_id in user_ids
+                ),
+                using=alias,
+            )
+            items = self.create(
+                OrderItem,
+                (
+                    OrderItem(
+                        order_id=order_id,
+                        product_variant_id=self.pick(variants),
+                        quantity=self.random.randint(1, 3),
+                        price=self.random.randint(500, 50000),
+                    )
+                    for order_id in range(orders[0], orders[1] + 1)
+                    for _ in range(self.random.randint(1, 4))
+                ),
+                using=alias,
+            )
+            self.create(
+                Payment,
+                (
+                    Payment(
+                        order_id=order_id,
+                        payment_method=self.random.choice(methods),
+                        amount=self.random.randint(500, 50000),
+                        payment_status=self.random.choice(payment_statuses),
+                    )
+                    for order_id in range(orders[0], orders[1] + 1)
+                ),
+                using=alias,
+            )
+            order_count += orders[1] - orders[0] + 1
+            item_count += items[1] - items[0] + 1
+        self.log("orders", order_count)
+        self.log("order items", item_count)
+
+    def generate_reviews(self, count, products, users):
+        self.create(
+            Review,
+            (
+                Review(
+                    product_id=self.pick(products),
+                    user_id=self.pick(users),
+                    rating=self.random.randint(1, 5),
+                    comment="Synthetic review",
+                )
+                for _ in range(count)
+            ),
+        )
+        self.log("reviews", count)
+
+    def generate_coupons(self, count):
+        expires = timezone.now() + timedelta(days=365)
+        self.create(
+            Coupon,
+            (
+                Coupon(code=LOADTEST_COUPON.format(i), discount_amount="0.01", expiration_date=expires)
+                for i in range(count)
+            ),
+        )
+        self.log("coupons", count)
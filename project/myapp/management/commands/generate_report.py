@@ -0,0 +1,40 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.reports import REPORTS, build_report, write_columnar, write_csv
+
+
+class Command(BaseCommand):
+    help = "Build a grouped order/payment report without going through serializers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("report", choices=sorted(REPORTS))
+        parser.add_argument("--month", help="Limit to one month, as YYYY-MM")
+        parser.add_argument("--format", choices=("csv", "columnar"), default="csv")
+        parser.add_argument("--output", help="Output path (csv defaults to stdout)")
+        parser.add_argument("--chunk-size", type=int, default=None)
+
+    def handle(self, *args, **options):
+        start = end = None
+        if options["month"]:
+            try:
+                year, month = (int(part) for part in options["month"].split("-"))
+                start = date(year, month, 1)
+            except ValueError:
+                raise CommandError("--month must look like YYYY-MM")
+            end = date(year + month // 12, month % 12 + 1, 1)
+
+        report = build_report(
+            options["report"], start=start, end=end, chunk_size=options["chunk_size"]
+        )
+
+        if options["format"] == "columnar":
+            if not options["output"]:
+                raise CommandError("--output is required for columnar reports")
+            write_columnar(report, options["output"], key_name=options["report"])
+        elif options["output"]:
+            with open(options["output"], "w", newline="") as fp:
+                write_csv(report, fp, key_name=options["report"])
+        else:
+            write_csv(report, self.stdout, key_name=options["report"])
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from myapp import thumbnails
+from myapp.models import Profile
+
+
+class Command(BaseCommand):
+    help = (
+        "Render the thumbnails of profile pictures that don't have them yet, e.g. "
+        "uploaded before thumbnails existed or while a worker was down. --all renders "
+        "every picture again, after THUMBNAIL_SIZES or THUMBNAIL_FORMATS changed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Also render pictures that have thumbnails")
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.exclude(profile_picture="").exclude(profile_picture__isnull=True)
+        if not options["all"]:
+            profiles = profiles.filter(thumbnails={})
+        done = failed = 0
+        for profile_id, name in profiles.values_list("id", "profile_picture").iterator():
+            try:
+                thumbnails.process(profile_id, name)
+            except Exception as exc:
+                failed += 1
+                self.stderr.write(f"Profile {profile_id} ({name}): {exc}")
+            else:
+                done += 1
+        self.stdout.write(f"{done} rendered, {failed} failed")
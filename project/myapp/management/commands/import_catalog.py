@@ -0,0 +1,44 @@
+import os
+
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.enum import ImportKind, ImportStatus
+from myapp.imports import run_import, write_error_report
+from myapp.models import ImportJob
+
+
+class Command(BaseCommand):
+    help = "Upsert products or variants from a CSV/JSONL supplier feed in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", help="CSV or JSONL file to import")
+        parser.add_argument("--kind", choices=[kind.value for kind in ImportKind], default=ImportKind.PRODUCTS.value)
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--resume", type=int, metavar="JOB_ID", help="Continue a failed import")
+        parser.add_argument("--errors", help="Write the per-row error report to this CSV file")
+
+    def handle(self, *args, **options):
+        if options["resume"]:
+            try:
+                job = ImportJob.objects.get(id=options["resume"])
+            except ImportJob.DoesNotExist:
+                raise CommandError(f"Import {options['resume']} does not exist")
+            if job.status == ImportStatus.COMPLETED.value:
+                raise CommandError(f"Import {job.id} already completed")
+        elif options["path"]:
+            job = ImportJob(kind=options["kind"], batch_size=options["batch_size"])
+            with open(options["path"], "rb") as fp:
+                job.source.save(os.path.basename(options["path"]), File(fp))
+        else:
+            raise CommandError("Give a file to import or --resume JOB_ID")
+
+        self.stdout.write(f"Import {job.id}: starting at row {job.committed_rows + 1}")
+        job = run_import(job)
+        self.stdout.write(
+            f"Import {job.id}: {job.committed_rows} rows processed, {job.error_count} errors"
+        )
+
+        if options["errors"]:
+            with open(options["errors"], "w", newline="") as fp:
+                write_error_report(job, fp)
@@ -0,0 +1,217 @@
+import json
+import random
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp import sharding
+from myapp.management.commands.generate_catalog import LOADTEST_COUPON, LOADTEST_EMAIL
+from myapp.models import Category, CustomUser, Order, Product, ProductVariant
+
+
+# scenario name -> relative weight in the traffic mix
+SCENARIOS = {
+    "browse": 40,
+    "product_detail": 20,
+    "category_tree": 5,
+    "search": 15,
+    "cart_patch": 10,
+    "checkout": 5,
+    "coupon_apply": 5,
+}
+
+SEARCH_TERMS = ("Runner", "Jacket", "Pro", "Eco", "Lamp", "Tent", "Classic")
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Client:
+    """One virtual user: its own JWT, cart and order."""
+
+    def __init__(self, base_url, email, password, order_id, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.order_id = order_id
+        self.timeout = timeout
+        self.token = None
+        status, body = self.request("POST", "/api/token/", {"email": email, "password": password})
+        if status != 200:
+            raise CommandError(f"Could not log in as {email}: HTTP {status}")
+        self.token = json.loads(body)["access"]
+
+    def request(self, method, path, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method)
+        request.add_header("Accept", "application/json")
+        if data is not None:
+            request.add_header("Content-Type", "application/json")
+        if self.token:
+            request.add_header("Authorization", f"Bearer {self.token}")
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the real API routes with concurrent clients and report latency "
+        "percentiles and throughput as JSON. Run generate_catalog first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+        parser.add_argument("--clients", type=int, default=16, help="Concurrent virtual users")
+        parser.add_argument("--duration", type=float, default=30, help="Seconds to run")
+        parser.add_argument("--password", default="loadtest-pw")
+        parser.add_argument("--timeout", type=float, default=30)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        self.load_ids(options["clients"])
+
+        clients = [
+            Client(options["base_url"], email, options["password"], order_id, options["timeout"])
+            for email, order_id in self.users
+        ]
+
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+        deadline = time.perf_counter() + options["duration"]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(clients)) as pool:
+            futures = [
+                pool.submit(self.run_client, client, deadline, random.Random(options["seed"] + i))
+                for i, client in enumerate(clients)
+            ]
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - started
+
+        report = self.build_report(options, elapsed)
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as fp:
+                fp.write(output)
+        else:
+            self.stdout.write(output)
+
+    def load_ids(self, count):
+        emails = dict(
+            CustomUser.objects.filter(email__startswith=LOADTEST_EMAIL.split("{")[0])
+            .order_by("id")
+            .values_list("id", "email")[:count]
+        )
+        # orders live on the shards, users on 'default': no join between them
+        orders = [
+            (emails[user_id], order_id)
+            for alias in sharding.get_shards()
+            for user_id, order_id in Order.objects.using(alias).filter(user__in=list(emails)).values_list("user", "id")
+        ]
+        if len(orders) < count:
+            raise CommandError(f"Need {count} generated users with orders, found {len(orders)}")
+        self.users = orders
+
+        # a seeded sample keeps runs comparable without loading every id
+        self.product_ids = self.sample(Product.objects.values_list("id", flat=True))
+        self.variants = self.sample(ProductVariant.objects.values_list("id", "price"))
+        self.category_ids = self.sample(Category.objects.values_list("id", flat=True))
+        self.product_count = Product.objects.count()
+        if not self.product_ids or not self.variants:
+            raise CommandError("No catalog to test against, run generate_catalog first")
+
+    def sample(self, queryset, size=1000):
+        rows = list(queryset.order_by("id")[:size * 20])
+        return self.random.sample(rows, min(size, len(rows)))
+
+    def run_client(self, client, deadline, rng):
+        names = list(SCENARIOS)
+        weights = list(SCENARIOS.values())
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            method, path, payload = getattr(self, f"scenario_{name}")(client, rng)
+            start = time.perf_counter()
+            try:
+                status, _ = client.request(method, path, payload)
+            except OSError:
+                status = None
+            latency = time.perf_counter() - start
+            with self.lock:
+                self.samples[name].append(latency)
+                if status is None or status >= 400:
+                    self.errors[name] += 1
+
+    def scenario_browse(self, client, rng):
+        offset = rng.randrange(0, max(1, min(self.product_count, 10000) - 20))
+        if rng.random() < 0.5:
+            return "GET", f"/product/?limit=20&offset={offset}", None
+        return "GET", f"/product/category/{rng.choice(self.category_ids)}/?limit=20", None
+
+    def scenario_product_detail(self, client, rng):
+        return "GET", f"/product/{rng.choice(self.product_ids)}/detail/", None
+
+    def scenario_category_tree(self, client, rng):
+        return "GET", "/category/hierarchy/", None
+
+    def scenario_search(self, client, rng):
+        return "GET", f"/product/?search={rng.choice(SEARCH_TERMS)}&limit=20", None
+
+    def scenario_cart_patch(self, client, rng):
+        variant_id, price = rng.choice(self.variants)
+        items = [{"product_variant": variant_id, "quantity": 1, "price_at_time": price}]
+        return "PATCH", "/cart/0/", {"items": items}
+
+    def scenario_checkout(self, client, rng):
+        payload = {"order": client.order_id, "payment_method": "Visa", "payment_status": "paid"}
+        return "POST", "/payment/", payload
+
+    def scenario_coupon_apply(self, client, rng):
+        return "POST", f"/coupon/{client.order_id}/apply_coupon/", {"code": LOADTEST_COUPON.format(rng.randrange(10))}
+
+    def build_report(self, options, elapsed):
+        scenarios = {}
+        errors = 0
+        everything = []
+        for name in SCENARIOS:
+            latencies = sorted(self.samples.get(name, []))
+            everything.extend(latencies)
+            errors += self.errors.get(name, 0)
+            scenarios[name] = self.summary(latencies, self.errors.get(name, 0), elapsed)
+
+        everything.sort()
+        return {
+            "base_url": options["base_url"],
+            "clients": options["clients"],
+            "duration_s": round(elapsed, 3),
+            "seed": options["seed"],
+            "total": self.summary(everything, errors, elapsed),
+            "scenarios": scenarios,
+        }
+
+    def summary(self, latencies, errors, elapsed):
+        ms = lambda value: None if value is None else round(value * 1000, 2)  # noqa: E731
+        return {
+            "requests": len(latencies),
+            "errors": errors,
+            "rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+            "mean_ms": ms(statistics.fmean(latencies)) if latencies else None,
+            "p50_ms": ms(percentile(latencies, 0.50)),
+            "p95_ms": ms(percentile(latencies, 0.95)),
+            "p99_ms": ms(percentile(latencies, 0.99)),
+            "max_ms": ms(latencies[-1] if latencies else None),
+        }
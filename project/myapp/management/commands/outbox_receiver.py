@@ -0,0 +1,64 @@
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+
+class StubReceiverHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        server = self.server
+        if server.rng.random() < server.fail_rate:
+            self.send_response(503)
+        else:
+            with server.lock:
+                server.events.append(body)
+            server.log(body)
+            self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubReceiver(ThreadingHTTPServer):
+    """Accepts outbox events and keeps them in `events`, failing `fail_rate` of the requests."""
+
+    daemon_threads = True
+
+    def __init__(self, address, fail_rate=0.0, seed=None, log=None):
+        super().__init__(address, StubReceiverHandler)
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed)
+        self.events = []
+        self.lock = threading.Lock()
+        self.log = log or (lambda event: None)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+
+class Command(BaseCommand):
+    help = "Run a local endpoint that accepts and prints outbox events, for trying dispatch_outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--port", type=int, default=8025)
+        parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of requests answered with a 503")
+
+    def handle(self, *args, **options):
+        receiver = StubReceiver(
+            ("127.0.0.1", options["port"]),
+            fail_rate=options["fail_rate"],
+            log=lambda event: self.stdout.write(f"{event['id']} {event['type']} order {event['order']}"),
+        )
+        self.stdout.write(f"Receiving outbox events on {receiver.url}")
+        try:
+            receiver.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            receiver.server_close()
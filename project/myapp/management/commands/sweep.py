@@ -0,0 +1,60 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.sweeper import SWEEPS, run_sweep
+
+
+PROGRESS_EVERY = 5
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete abandoned carts, long expired coupons, expired tokens and "
+        "idempotency keys in short id-range chunks, pausing between them. Runs "
+        "once, or every --interval seconds with --loop."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("sweeps", nargs="*", help=f"Any of {', '.join(sorted(SWEEPS))}, default all of them")
+        parser.add_argument("--chunk-size", type=int, default=settings.SWEEP_CHUNK_SIZE)
+        parser.add_argument("--pause", type=float, default=settings.SWEEP_PAUSE, help="Seconds between chunks")
+        parser.add_argument("--dry-run", action="store_true", help="Count what would be deleted")
+        parser.add_argument("--loop", action="store_true", help="Keep sweeping until stopped")
+        parser.add_argument("--interval", type=float, default=settings.SWEEP_INTERVAL)
+
+    def handle(self, *args, **options):
+        names = options["sweeps"] or sorted(SWEEPS)
+        unknown = set(names) - set(SWEEPS)
+        if unknown:
+            raise CommandError(f"Unknown sweeps: {', '.join(sorted(unknown))}")
+        try:
+            while True:
+                for name in names:
+                    self.sweep(name, options)
+                if not options["loop"]:
+                    return
+                time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            pass
+
+    def sweep(self, name, options):
+        verb = "stale" if options["dry_run"] else "deleted"
+        started = reported = time.monotonic()
+
+        def progress(scanned_to, last, count):
+            nonlocal reported
+            # every chunk with -v 2, every few seconds otherwise
+            if options["verbosity"] > 1 or time.monotonic() - reported >= PROGRESS_EVERY:
+                reported = time.monotonic()
+                self.stdout.write(f"{name}: ids up to {scanned_to} of {last}, {count} {verb}")
+
+        count = run_sweep(
+            SWEEPS[name],
+            chunk_size=options["chunk_size"],
+            pause=options["pause"],
+            dry_run=options["dry_run"],
+            progress=progress if options["verbosity"] else None,
+        )
+        self.stdout.write(f"{name}: {count} {verb} in {time.monotonic() - started:.1f}s")
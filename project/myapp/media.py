@@ -0,0 +1,168 @@
+import hashlib
+import mimetypes
+import os
+import re
+import stat
+from functools import lru_cache
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+
+
+# Media files (MEDIA_ROOT, MEDIA_URL) are served by media_view: access is
+# checked here, then the front server sends the file when MEDIA_SENDFILE
+# says how to hand it over, otherwise FileResponse streams it, which WSGI
+# servers send with os.sendfile. URLs from HashedMediaStorage carry a
+# ?v=<content hash>, so a URL always means the same bytes and can be cached
+# for MEDIA_CACHE_MAX_AGE; replacing a file changes its URL.
+
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+@lru_cache(maxsize=4096)
+def _hash(path, mtime_ns, size):
+    digest = hashlib.blake2b(digest_size=8)
+    with open(path, "rb") as fp:
+        while chunk := fp.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_hash(path, st=None):
+    """Hash of the file's content, read again only when its mtime or size change."""
+    st = st or os.stat(path)
+    return _hash(path, st.st_mtime_ns, st.st_size)
+
+
+class HashedMediaStorage(FileSystemStorage):
+    """FileSystemStorage whose URLs are versioned by the file's content."""
+
+    def url(self, name):
+        url = super().url(name)
+        try:
+            return f"{url}?v={content_hash(self.path(name))}"
+        except OSError:
+            return url
+
+
+class FileRange:
+    """Reads `length` bytes of `fp` from `start`, for a single-range response."""
+
+    def __init__(self, fp, start, length):
+        fp.seek(start)
+        self.fp = fp
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fp.read(size) if size else b""
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.fp.close()
+
+
+def parse_range(header, size):
+    """
+    The (start, end) byte positions asked for by a Range header, None to send
+    the whole file, or "unsatisfiable". Multiple ranges are answered with the
+    whole file, which the RFC allows.
+    """
+    match = RANGE.match(header or "")
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if not first:
+        suffix = int(last)
+        return (max(size - suffix, 0), size - 1) if suffix and size else "unsatisfiable"
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        return "unsatisfiable"
+    return (start, end) if start <= end else None
+
+
+def is_public(path):
+    return path.startswith(tuple(settings.MEDIA_PUBLIC_PREFIXES))
+
+
+@require_safe
+def media_view(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    # checked on the normalised path, "profile_pics/../imports/x" is not public
+    path = os.path.relpath(full_path, os.path.abspath(settings.MEDIA_ROOT)).replace(os.sep, "/")
+
+    # anything outside MEDIA_PUBLIC_PREFIXES, e.g. import files, is for staff
+    # only, and doesn't exist for anyone else
+    public = is_public(path)
+    if not public and not request.user.is_staff:
+        raise Http404
+    try:
+        st = os.stat(full_path)
+    except OSError:
+        raise Http404
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404
+
+    version = content_hash(full_path, st)
+    etag = quote_etag(version)
+    headers = {"ETag": etag, "Last-Modified": http_date(st.st_mtime), "Accept-Ranges": "bytes"}
+    if request.GET.get("v") == version:
+        scope = "public" if public else "private"
+        headers["Cache-Control"] = f"{scope}, max-age={settings.MEDIA_CACHE_MAX_AGE}, immutable"
+    else:
+        # unversioned or stale URL: may change, revalidate with the ETag
+        headers["Cache-Control"] = "no-cache" if public else "private, no-cache"
+    if etag in request.headers.get("If-None-Match", ""):
+        response = HttpResponseNotModified()
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or "application/octet-stream"
+
+    # the front server answers Range requests itself
+    if settings.MEDIA_SENDFILE == "x-accel-redirect":
+        response = HttpResponse(content_type=content_type, headers=headers)
+        response["X-Accel-Redirect"] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + quote(path)
+        return response
+    if settings.MEDIA_SENDFILE == "x-sendfile":
+        response = HttpResponse(content_type=content_type, headers=headers)
+        response["X-Sendfile"] = full_path
+        return response
+
+    byte_range = None
+    if_range = request.headers.get("If-Range")
+    if if_range is None or if_range == etag:
+        byte_range = parse_range(request.headers.get("Range"), st.st_size)
+    if byte_range == "unsatisfiable":
+        response = HttpResponse(status=416, headers=headers)
+        response["Content-Range"] = f"bytes */{st.st_size}"
+        return response
+
+    fp = open(full_path, "rb")
+    if byte_range is None:
+        # a plain file object, so the WSGI server's file_wrapper can sendfile() it
+        response = FileResponse(fp, content_type=content_type, headers=headers)
+    else:
+        start, end = byte_range
+        response = FileResponse(
+            FileRange(fp, start, end - start + 1), status=206, content_type=content_type, headers=headers
+        )
+        response["Content-Range"] = f"bytes {start}-{end}/{st.st_size}"
+        response["Content-Length"] = str(end - start + 1)
+    if encoding:
+        response["Content-Encoding"] = encoding
+    return response
@@ -0,0 +1,117 @@
+import os
+import secrets
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+
+# With several workers per host, point PROMETHEUS_MULTIPROC_DIR at an empty
+# directory shared by all of them (wiped on deploy) and call
+# prometheus_client.multiprocess.mark_process_dead(pid) when a worker exits.
+# Each worker then writes its samples to mmap files there and /metrics sums
+# them up.
+
+LABELS = ("route", "action", "method")
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Request latency by route and viewset action",
+    LABELS,
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUEST_COUNT = Counter(
+    "http_requests_total",
+    "Requests by route, viewset action and status code",
+    LABELS + ("status",),
+)
+DB_DURATION = Histogram(
+    "http_request_db_duration_seconds",
+    "Time spent in SQL per request",
+    LABELS,
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+DB_QUERIES = Counter(
+    "http_request_db_queries_total",
+    "SQL queries run by route and viewset action",
+    LABELS,
+)
+
+
+def get_labels(request):
+    match = request.resolver_match
+    if match is None:
+        return "unmatched", "", request.method
+
+    view = match.func
+    action = getattr(view, "actions", {}).get(request.method.lower())
+    view_class = getattr(view, "cls", None) or getattr(view, "view_class", None)
+    if view_class is not None:
+        action = f"{view_class.__name__}.{action or request.method.lower()}"
+    return match.view_name or match.route, action or "", request.method
+
+
+class MetricsMiddleware:
+    """Records latency, status and DB time of every request under its route."""
+
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        return self.record(request, response, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        return self.record(request, response, time.perf_counter() - start)
+
+    def record(self, request, response, elapsed):
+        labels = get_labels(request)
+        REQUEST_LATENCY.labels(*labels).observe(elapsed)
+        REQUEST_COUNT.labels(*labels, str(response.status_code)).inc()
+
+        stats = getattr(request, "query_stats", None)
+        if stats is not None:
+            DB_DURATION.labels(*labels).observe(stats.duration)
+            DB_QUERIES.labels(*labels).inc(stats.count)
+
+        return response
+
+
+def may_scrape(request):
+    token = getattr(settings, "METRICS_TOKEN", "")
+    if token and secrets.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return True
+    return request.META.get("REMOTE_ADDR") in getattr(settings, "METRICS_ALLOWED_IPS", ())
+
+
+def metrics_view(request):
+    # closed unless the scraper has the token or its address is listed
+    if not may_scrape(request):
+        return HttpResponseForbidden()
+
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
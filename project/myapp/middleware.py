@@ -0,0 +1,124 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_in_lists = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_placeholders = re.compile(r"%s|\?")
+
+
+def fingerprint(sql):
+    """Query shape with literals and IN lists collapsed, so N+1 repeats compare equal."""
+    sql = _placeholders.sub("?", sql)
+    sql = _literals.sub("?", sql)
+    return _in_lists.sub("(...)", sql)
+
+
+class RepeatedQueryError(Exception):
+    pass
+
+
+class QueryStats:
+    """execute_wrapper() callback counting and timing every query of a request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def most_repeated(self):
+        if not self.fingerprints:
+            return None, 0
+        return self.fingerprints.most_common(1)[0]
+
+
+class QueryBudgetMiddleware:
+    """
+    Counts the queries of every request, reports them in a Server-Timing
+    header, logs requests over their budget and flags repeated query shapes.
+
+    Budgets are set per url name in QUERY_BUDGETS, falling back to
+    QUERY_BUDGET_DEFAULT. A shape repeated more than QUERY_REPEAT_LIMIT times
+    is logged, and raises RepeatedQueryError when QUERY_REPEAT_RAISE is on.
+    That happens once the view has returned, with its writes committed, so
+    it is meant for test suites, not for serving requests.
+    """
+
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = request.query_stats = QueryStats()
+        with self.instrument(stats):
+            response = self.get_response(request)
+        return self.check(request, response, stats)
+
+    async def __acall__(self, request):
+        # connections are per thread, and under ASGI every query of a request
+        # (async ORM or a sync view) runs in that request's thread-sensitive
+        # thread, so the wrappers are installed and removed from there
+        stats = request.query_stats = QueryStats()
+        stack = await sync_to_async(self.instrument)(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.check(request, response, stats)
+
+    def instrument(self, stats):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats))
+        return stack
+
+    def check(self, request, response, stats):
+        response.headers["Server-Timing"] = ", ".join(
+            filter(None, (
+                response.headers.get("Server-Timing"),
+                f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries"',
+            ))
+        )
+
+        view_name = request.resolver_match.view_name if request.resolver_match else request.path
+        budget = getattr(settings, "QUERY_BUDGETS", {}).get(
+            view_name, getattr(settings, "QUERY_BUDGET_DEFAULT", None)
+        )
+        if budget is not None and stats.count > budget:
+            logger.warning(
+                "%s %s ran %d queries (budget %d) in %.1fms",
+                request.method, view_name, stats.count, budget, stats.duration * 1000,
+            )
+
+        shape, repeats = stats.most_repeated()
+        if repeats > getattr(settings, "QUERY_REPEAT_LIMIT", 10):
+            message = f"{request.method} {view_name} repeated one query {repeats} times: {shape}"
+            if getattr(settings, "QUERY_REPEAT_RAISE", False):
+                raise RepeatedQueryError(message)
+            logger.warning(message)
+
+        return response
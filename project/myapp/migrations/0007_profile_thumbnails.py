@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-19 13:56
+
+import myapp.validators.image_header
+import myapp.validators.image_size
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0006_coupon_limits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='thumbnails',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='profile_picture',
+            field=models.ImageField(blank=True, help_text='Max img size 5mb', null=True, upload_to='profile_pics/', validators=[myapp.validators.image_size.validate_image, myapp.validators.image_header.validate_image_header]),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2 on 2026-10-19 14:16
+
+import django.core.serializers.json
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0007_profile_thumbnails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedProduct',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('sku', models.CharField(blank=True, db_index=True, max_length=64, null=True)),
+                ('name', models.CharField(max_length=50)),
+                ('slug', models.SlugField(blank=True, default='', null=True)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('price', models.IntegerField()),
+                ('discount_price', models.IntegerField(blank=True, null=True)),
+                ('inventory_count', models.IntegerField(default=0)),
+                ('created_at', models.DateField()),
+                ('updates_at', models.DateField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('reviews', models.JSONField(blank=True, default=list, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('wishlists', models.JSONField(blank=True, default=list)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_products', to='myapp.category')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedProductVariant',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('sku', models.CharField(blank=True, max_length=64, null=True)),
+                ('variant_name', models.CharField(max_length=50)),
+                ('variant_value', models.CharField(choices=[('high', 'HIGH'), ('medium', 'MEDIUM'), ('low', 'LOW')], max_length=50, verbose_name='Price Range')),
+                ('price', models.IntegerField()),
+                ('stock_count', models.IntegerField(blank=True, null=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='myapp.archivedproduct')),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-19 16:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0008_product_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productvariant',
+            name='updates_at',
+            field=models.DateField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='archivedproductvariant',
+            name='updates_at',
+            field=models.DateField(default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
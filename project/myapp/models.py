@@ -1,17 +1,31 @@
+from contextvars import ContextVar
+from datetime import date
+
 from django.db import models
 from django.contrib.auth.models import (
     AbstractBaseUser,
     PermissionsMixin,
     BaseUserManager,
 )
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from myapp.cache import catalog_key, invalidate_catalog
+from myapp import sharding
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 from myapp.customfield import CustomPhoneNumberField
 from myapp.validators.image_size import validate_image
-from myapp.enum import PriceChoice,OrderStatus,TransactionStatus,PaymentMethod,PaymentStatus
+from myapp.validators.image_header import validate_image_header
+from myapp.enum import PriceChoice,OrderStatus,TransactionStatus,PaymentMethod,PaymentStatus,ImportKind,ImportStatus,OutboxEventType,OutboxStatus,IdempotencyStatus
 # from django.conf import settings
 
 
+# True while myapp/archive.py moves products out. Their variants' order items
+# must stay, and the caches it drops itself in bulk are left to it.
+archiving = ContextVar("archiving", default=False)
+
+
 class CustomUserManager(BaseUserManager):
     def _create_user(self, email, password, first_name, last_name, **extra_fields):
         if not email:
@@ -77,10 +91,12 @@ class Profile(models.Model):
     profile_picture = models.ImageField(
         upload_to="profile_pics/",
         help_text="Max img size 5mb",
-        validators=[validate_image],
+        validators=[validate_image, validate_image_header],
         blank=True,
         null=True,
     )
+    # "<size>.<ext>" -> stored name, filled in by myapp/thumbnails.py
+    thumbnails = models.JSONField(default=dict, blank=True)
     contact_number = CustomPhoneNumberField(blank=True)
 
     def __str__(self):
@@ -101,6 +117,7 @@ class Category(models.Model):
 
 
 class Product(models.Model):
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=50)
     slug = models.SlugField(default="", null=True, blank=True)
     description = models.TextField(null=True, blank=True)
@@ -119,15 +136,54 @@ class Product(models.Model):
 
 class ProductVariant(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     variant_name = models.CharField( max_length=50)
     variant_value = models.CharField(max_length=50,choices=PriceChoice.choices(), verbose_name="Price Range")
     price = models.IntegerField()
     stock_count = models.IntegerField(null=True, blank=True)
+    updates_at = models.DateField(auto_now=True)
 
     def __str__(self):
         return f"{self.variant_name} : {self.product.name}"
 
 
+class ArchivedProduct(models.Model):
+    # inactive products moved out of Product, with their ids, by
+    # myapp/archive.py; restored into Product when they are reactivated
+    id = models.BigIntegerField(primary_key=True)
+    sku = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    name = models.CharField(max_length=50)
+    slug = models.SlugField(default="", null=True, blank=True)
+    description = models.TextField(null=True, blank=True)
+    price = models.IntegerField()
+    discount_price = models.IntegerField(null=True, blank=True)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="archived_products")
+    inventory_count = models.IntegerField(default=0)
+    created_at = models.DateField()
+    updates_at = models.DateField()
+    archived_at = models.DateTimeField(default=timezone.now)
+    # the product's reviews and the wishlists it was on, put back on restore
+    reviews = models.JSONField(default=list, blank=True, encoder=DjangoJSONEncoder)
+    wishlists = models.JSONField(default=list, blank=True)
+
+    def __str__(self):
+        return f"{self.name} (archived)"
+
+
+class ArchivedProductVariant(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    product = models.ForeignKey(ArchivedProduct, on_delete=models.CASCADE, related_name="variants")
+    sku = models.CharField(max_length=64, null=True, blank=True)
+    variant_name = models.CharField(max_length=50)
+    variant_value = models.CharField(max_length=50, choices=PriceChoice.choices(), verbose_name="Price Range")
+    price = models.IntegerField()
+    stock_count = models.IntegerField(null=True, blank=True)
+    updates_at = models.DateField()
+
+    def __str__(self):
+        return f"{self.variant_name} : {self.product.name} (archived)"
+
+
 class Cart(models.Model):
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, verbose_name="User Name", related_name="cart")
     created_at = models.DateField(auto_now_add=True)
@@ -136,6 +192,14 @@ class Cart(models.Model):
     def __str__(self):
         return f"{self.user.email}"
 
+    def touch(self):
+        # item changes don't save the cart; keep updates_at current for the
+        # abandoned cart sweep (myapp/sweeper.py), at most one UPDATE a day
+        today = date.today()
+        if self.updates_at != today:
+            Cart.objects.filter(pk=self.pk).update(updates_at=today)
+            self.updates_at = today
+
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart,on_delete=models.CASCADE )
@@ -149,12 +213,18 @@ class CartItem(models.Model):
 
 
 class Order(models.Model):
-    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, verbose_name="User Name", related_name="order")
+    # users and orders may sit in different databases (myapp/sharding.py), so
+    # no constraint, and delete_user_orders() does the cascade
+    user = models.OneToOneField(
+        CustomUser, on_delete=models.DO_NOTHING, db_constraint=False, verbose_name="User Name", related_name="order"
+    )
     order_status = models.CharField(max_length=50,choices=OrderStatus.choices(), verbose_name="Order Status")
     total_amount = models.IntegerField()
     created_at = models.DateField(auto_now_add=True)
     updates_at = models.DateField(auto_now=True)
 
+    objects = sharding.ShardAwareQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.user.email}"
 
@@ -162,12 +232,20 @@ class Order(models.Model):
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="order_item")
-    product_variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE)
+    # cascaded by delete_variant_order_items(), see Order.user
+    product_variant = models.ForeignKey(ProductVariant, on_delete=models.DO_NOTHING, db_constraint=False)
     quantity = models.IntegerField()
     price = models.IntegerField()
 
+    objects = sharding.ShardAwareQuerySet.as_manager()
+
     def __str__(self):
-        return f"{self.order.user.email} - {self.product_variant.product.name} "
+        try:
+            product = self.product_variant.product.name
+        except ProductVariant.DoesNotExist:
+            # archived along with its product (myapp/archive.py)
+            product = f"variant {self.product_variant_id}"
+        return f"{self.order.user.email} - {product} "
     
 
 
@@ -177,6 +255,7 @@ class Payment(models.Model):
     amount = models.IntegerField()
     payment_status = models.CharField(max_length=50, choices=PaymentStatus.choices(), verbose_name="Payment Status")
 
+    objects = sharding.ShardAwareQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.order.user.email} - {self.amount} "
@@ -232,8 +311,120 @@ class Coupon(models.Model):
     discount_amount = models.DecimalField(max_digits=10, decimal_places=2)
     is_active = models.BooleanField(default=True)
     expiration_date = models.DateTimeField()
+    # redemption limits, None is unlimited (myapp/coupons.py)
+    usage_limit = models.PositiveIntegerField(null=True, blank=True)
+    per_user_limit = models.PositiveIntegerField(null=True, blank=True)
+    used_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f"Coupon {self.code} - {'Active' if self.is_active else 'Inactive'}"
-    
 
+
+class CouponUsage(models.Model):
+    # only kept for coupons with a per_user_limit
+    coupon = models.ForeignKey(Coupon, on_delete=models.CASCADE, related_name="usages")
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    used_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["coupon", "user"], name="unique_coupon_usage")]
+
+    def __str__(self):
+        return f"{self.coupon_id} used {self.used_count} times by {self.user_id}"
+
+
+class ImportJob(models.Model):
+    kind = models.CharField(max_length=20, choices=ImportKind.choices())
+    source = models.FileField(upload_to="imports/")
+    status = models.CharField(max_length=20, choices=ImportStatus.choices(), default=ImportStatus.PENDING.value)
+    batch_size = models.PositiveIntegerField(default=1000)
+    committed_rows = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Import {self.id} ({self.kind}) - {self.status}"
+
+
+class ImportRowError(models.Model):
+    job = models.ForeignKey(ImportJob, on_delete=models.CASCADE, related_name="row_errors")
+    line = models.PositiveIntegerField()
+    sku = models.CharField(max_length=64, blank=True)
+    message = models.TextField()
+
+    def __str__(self):
+        return f"Import {self.job_id} line {self.line}"
+
+
+class OutboxEvent(models.Model):
+    # written on the order's shard in the same transaction as the change it
+    # describes (myapp/outbox.py), and kept when the order is deleted
+    order = models.ForeignKey(Order, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+")
+    event_type = models.CharField(max_length=50, choices=OutboxEventType.choices())
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=20, choices=OutboxStatus.choices(), default=OutboxStatus.PENDING.value)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=32, blank=True)
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+
+    objects = sharding.ShardAwareQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "available_at"])]
+
+    def __str__(self):
+        return f"{self.event_type} #{self.id} - {self.status}"
+
+
+class IdempotencyKey(models.Model):
+    # one row per Idempotency-Key (myapp/idempotency.py); the unique key lets
+    # exactly one of several concurrent retries claim it, on any worker
+    key = models.CharField(max_length=64, unique=True)
+    fingerprint = models.CharField(max_length=16)
+    status = models.CharField(max_length=20, choices=IdempotencyStatus.choices())
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    data = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    headers = models.JSONField(default=dict, blank=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.key} - {self.status}"
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductVariant)
+def invalidate_catalog_cache(sender, **kwargs):
+    # bulk_create()/update() skip signals, bulk paths invalidate once themselves
+    invalidate_catalog()
+
+
+@receiver([post_save, post_delete], sender=Review)
+def invalidate_product_detail(sender, instance, **kwargs):
+    if archiving.get():
+        return
+    # both the plain and the category route's copy of the detail response; a
+    # deleted product already dropped them by invalidating the catalog
+    category = Product.objects.filter(pk=instance.product_id).values_list("category", flat=True).first()
+    cache.delete_many([
+        catalog_key("product-detail", instance.product_id),
+        catalog_key("product-detail", instance.product_id, category),
+    ])
+
+
+@receiver(post_delete, sender=CustomUser)
+def delete_user_orders(sender, instance, **kwargs):
+    sharding.for_user(Order, instance.pk).filter(user_id=instance.pk).delete()
+
+
+@receiver(post_delete, sender=ProductVariant)
+def delete_variant_order_items(sender, instance, **kwargs):
+    if archiving.get():
+        return
+    for alias in sharding.get_shards():
+        OrderItem.objects.using(alias).filter(product_variant_id=instance.pk).delete()
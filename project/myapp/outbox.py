@@ -0,0 +1,166 @@
+import json
+import random
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+from django.utils import timezone
+
+from myapp import sharding
+from myapp.enum import OutboxStatus
+from myapp.models import OutboxEvent
+
+
+# Transactional outbox: views record what happened with emit() inside the
+# transaction that changes the order, so the event exists exactly when the
+# change was committed. `manage.py dispatch_outbox` delivers the events to
+# OUTBOX_ENDPOINTS afterwards, outside the request. Delivery is at least
+# once: receivers dedupe on the X-Outbox-Event id.
+
+
+def emit(event_type, order_id, payload):
+    """Queue an event about order `order_id`; call it inside transaction.atomic(using=<order's shard>)."""
+    return OutboxEvent.objects.create(order_id=order_id, event_type=event_type.value, payload=payload)
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter, so failed batches don't retry in lockstep."""
+    delay = min(settings.OUTBOX_RETRY_MAX_DELAY, settings.OUTBOX_RETRY_BACKOFF * 2 ** (attempts - 1))
+    return timedelta(seconds=delay * random.uniform(0.5, 1))
+
+
+def claim(alias, batch_size, lease):
+    """
+    Reserve up to `batch_size` due events on shard `alias` for `lease`
+    seconds and return them. The single UPDATE is the claim, so workers
+    running side by side never get the same event; a worker that dies
+    leaves its claim to expire.
+    """
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    events = OutboxEvent.objects.using(alias)
+    claimable = events.filter(
+        Q(claimed_until__isnull=True) | Q(claimed_until__lt=now),
+        status=OutboxStatus.PENDING.value,
+        available_at__lte=now,
+    )
+    due = claimable.order_by("id").values("id")[:batch_size]
+    if not claimable.filter(pk__in=due).update(claimed_by=token, claimed_until=now + timedelta(seconds=lease)):
+        return []
+    return list(events.filter(claimed_by=token).order_by("id"))
+
+
+def event_body(event):
+    return json.dumps(
+        {
+            "id": event.id,
+            "type": event.event_type,
+            "order": event.order_id,
+            "created_at": event.created_at,
+            "data": event.payload,
+        },
+        cls=DjangoJSONEncoder,
+    ).encode()
+
+
+def deliver(event, endpoints, timeout):
+    """POST the event to every endpoint. Returns None, or why it failed."""
+    body = event_body(event)
+    for url in endpoints:
+        request = urllib.request.Request(
+            url,
+            data=body,
+            method="POST",
+            headers={"Content-Type": "application/json", "X-Outbox-Event": str(event.id)},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                response.read()
+        except urllib.error.HTTPError as exc:
+            return f"{url}: HTTP {exc.code}"
+        except (urllib.error.URLError, OSError) as exc:
+            return f"{url}: {getattr(exc, 'reason', exc)}"
+    return None
+
+
+class Dispatcher:
+    """
+    Claims events shard by shard and delivers each batch over a pool of
+    at most `concurrency` connections, then records the outcome of the whole
+    batch in two queries.
+    """
+
+    def __init__(self, endpoints=None, batch_size=None, concurrency=None, timeout=None, aliases=None):
+        self.endpoints = list(endpoints or settings.OUTBOX_ENDPOINTS)
+        self.batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+        self.concurrency = concurrency or settings.OUTBOX_CONCURRENCY
+        self.timeout = timeout or settings.OUTBOX_TIMEOUT
+        self.aliases = list(aliases or sharding.get_shards())
+        self.pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="outbox")
+
+    def close(self):
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def run_once(self):
+        """One batch from every shard; returns (delivered, failed) counts."""
+        delivered = failed = 0
+        for alias in self.aliases:
+            events = claim(alias, self.batch_size, settings.OUTBOX_LEASE)
+            if events:
+                ok, errors = self.dispatch(alias, events)
+                delivered += ok
+                failed += errors
+        return delivered, failed
+
+    def drain(self):
+        """Deliver until no shard has a due event left."""
+        delivered = failed = 0
+        while True:
+            ok, errors = self.run_once()
+            if not ok and not errors:
+                return delivered, failed
+            delivered += ok
+            failed += errors
+
+    def dispatch(self, alias, events):
+        errors = list(self.pool.map(lambda event: deliver(event, self.endpoints, self.timeout), events))
+        now = timezone.now()
+
+        done = [event.id for event, error in zip(events, errors) if error is None]
+        if done:
+            OutboxEvent.objects.using(alias).filter(id__in=done).update(
+                status=OutboxStatus.DELIVERED.value,
+                attempts=F("attempts") + 1,
+                delivered_at=now,
+                claimed_by="",
+                claimed_until=None,
+                last_error="",
+            )
+
+        retry = []
+        for event, error in zip(events, errors):
+            if error is None:
+                continue
+            event.attempts += 1
+            event.last_error = error
+            event.available_at = now + retry_delay(event.attempts)
+            event.claimed_by, event.claimed_until = "", None
+            if event.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                event.status = OutboxStatus.FAILED.value
+            retry.append(event)
+        if retry:
+            OutboxEvent.objects.using(alias).bulk_update(
+                retry, ["attempts", "last_error", "available_at", "claimed_by", "claimed_until", "status"]
+            )
+        return len(done), len(retry)
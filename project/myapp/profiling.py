@@ -0,0 +1,269 @@
+import cProfile
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.utils.html import format_html, format_html_join
+
+
+PROFILE_NAME = re.compile(r"^[\w-]+\.(pstats|collapsed)$")
+
+
+def get_profile_dir():
+    return str(getattr(settings, "PROFILING_DIR", os.path.join(settings.BASE_DIR, "profiles")))
+
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+class StackSampler(threading.Thread):
+    """
+    Records the stack of one thread every `interval` seconds, in the
+    collapsed format flamegraph tools read. Much cheaper than cProfile.
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self.done.set()
+        self.join()
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ProfilingMiddleware:
+    """
+    Opt-in request profiling, removed from the chain entirely unless
+    PROFILING_ENABLED is set.
+
+    - PROFILING_SAMPLE_RATE of requests, and requests sending the
+      PROFILING_HEADER header equal to PROFILING_SECRET, run under cProfile
+      and are saved as .pstats plus .collapsed stacks.
+    - With PROFILING_SLOW_THRESHOLD_MS every other request is watched by a
+      StackSampler and its collapsed stacks are kept if it was that slow.
+
+    Saved profiles are listed for staff at /profiles/.
+
+    Under ASGI it stays async, so the thread recorded is the event loop's,
+    where the async views run. Other requests' coroutines interleave on it,
+    so cProfile runs for one request at a time per process there, and a sync
+    view shows up as the await on the worker thread it was handed to.
+    """
+
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, "PROFILING_ENABLED", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        # cProfile hooks the whole thread, the event loop can only run one
+        self.profiling = threading.Lock()
+        self.sample_rate = getattr(settings, "PROFILING_SAMPLE_RATE", 0.0)
+        self.header = "HTTP_" + getattr(settings, "PROFILING_HEADER", "X-Profile").upper().replace("-", "_")
+        self.secret = getattr(settings, "PROFILING_SECRET", "")
+        threshold = getattr(settings, "PROFILING_SLOW_THRESHOLD_MS", None)
+        self.threshold = threshold / 1000 if threshold is not None else None
+        self.interval = getattr(settings, "PROFILING_SAMPLE_INTERVAL_MS", 5) / 1000
+        self.max_files = getattr(settings, "PROFILING_MAX_FILES", 500)
+        os.makedirs(get_profile_dir(), exist_ok=True)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if self.wants_profile(request):
+            return self.profile(request)
+        if self.threshold is not None:
+            return self.watch(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if self.wants_profile(request) and self.profiling.acquire(blocking=False):
+            try:
+                return await self.aprofile(request)
+            finally:
+                self.profiling.release()
+        if self.threshold is not None:
+            return await self.awatch(request)
+        return await self.get_response(request)
+
+    def wants_profile(self, request):
+        if self.secret and constant_time_compare(request.META.get(self.header, ""), self.secret):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def profile(self, request):
+        profiler = cProfile.Profile()
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            response = profiler.runcall(self.get_response, request)
+        finally:
+            elapsed = time.perf_counter() - start
+            sampler.stop()
+        self.save(request, response, elapsed, "cprofile", sampler, profiler)
+        return response
+
+    def watch(self, request):
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - start
+            sampler.stop()
+        if elapsed >= self.threshold:
+            self.save(request, response, elapsed, "slow", sampler)
+        return response
+
+    async def aprofile(self, request):
+        profiler = cProfile.Profile()
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        sampler.start()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - start
+            sampler.stop()
+        await sync_to_async(self.save, thread_sensitive=False)(request, response, elapsed, "cprofile", sampler, profiler)
+        return response
+
+    async def awatch(self, request):
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - start
+            sampler.stop()
+        if elapsed >= self.threshold:
+            await sync_to_async(self.save, thread_sensitive=False)(request, response, elapsed, "slow", sampler)
+        return response
+
+    def save(self, request, response, elapsed, mode, sampler, profiler=None):
+        now = datetime.now(timezone.utc)
+        name = f"{now:%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+        directory = get_profile_dir()
+
+        files = []
+        if profiler is not None:
+            profiler.dump_stats(os.path.join(directory, f"{name}.pstats"))
+            files.append(f"{name}.pstats")
+        with open(os.path.join(directory, f"{name}.collapsed"), "w") as fp:
+            fp.write(sampler.collapsed())
+        files.append(f"{name}.collapsed")
+
+        with open(os.path.join(directory, f"{name}.json"), "w") as fp:
+            json.dump(
+                {
+                    "name": name,
+                    "time": now.isoformat(),
+                    "method": request.method,
+                    "path": request.get_full_path(),
+                    "status": response.status_code,
+                    "duration_ms": round(elapsed * 1000, 1),
+                    "mode": mode,
+                    "files": files,
+                },
+                fp,
+            )
+        self.prune(directory)
+
+    def prune(self, directory):
+        entries = sorted(entry for entry in os.listdir(directory) if entry.endswith(".json"))
+        for entry in entries[:-self.max_files]:
+            stem = entry[:-len(".json")]
+            for suffix in (".json", ".pstats", ".collapsed"):
+                try:
+                    os.remove(os.path.join(directory, stem + suffix))
+                except FileNotFoundError:
+                    pass
+
+
+def load_index():
+    directory = get_profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    entries = []
+    for entry in os.listdir(directory):
+        if entry.endswith(".json"):
+            try:
+                with open(os.path.join(directory, entry)) as fp:
+                    entries.append(json.load(fp))
+            except (OSError, ValueError):
+                continue
+    return sorted(entries, key=lambda entry: entry["time"], reverse=True)
+
+
+@staff_member_required
+def profile_index(request):
+    rows = format_html_join(
+        "\n",
+        "<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>",
+        (
+            (
+                entry["time"],
+                entry["mode"],
+                entry["method"],
+                entry["path"],
+                entry["status"],
+                entry["duration_ms"],
+                format_html_join(" ", '<a href="{}">{}</a>', ((name, name.rsplit(".", 1)[1]) for name in entry["files"])),
+            )
+            for entry in load_index()
+        ),
+    )
+    return HttpResponse(
+        format_html(
+            "<!doctype html><title>Profiles</title><h1>Request profiles</h1>"
+            "<table><tr><th>Time</th><th>Mode</th><th>Method</th><th>Path</th>"
+            "<th>Status</th><th>ms</th><th>Files</th></tr>{}</table>",
+            rows,
+        )
+    )
+
+
+@staff_member_required
+def profile_download(request, name):
+    path = os.path.join(get_profile_dir(), name)
+    if not PROFILE_NAME.match(name) or not os.path.isfile(path):
+        raise Http404
+    return FileResponse(open(path, "rb"), as_attachment=True, filename=name)
@@ -0,0 +1,148 @@
+import csv
+from collections import namedtuple
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Max
+
+from myapp import sharding
+from myapp.models import ArchivedProductVariant, OrderItem, Payment, ProductVariant
+
+
+def variant_categories():
+    """Array mapping variant id -> category id, -1 where there is none."""
+    # order items of archived products (myapp/archive.py) still count
+    querysets = (ProductVariant.objects.all(), ArchivedProductVariant.objects.all())
+    last = max((queryset.aggregate(last=Max("id"))["last"] or 0 for queryset in querysets), default=0)
+    lookup = np.full(last + 1, -1, dtype=np.int64)
+    # streamed a chunk at a time like the report rows, never a list of every variant
+    for queryset in querysets:
+        for ids, categories in iter_column_chunks(queryset.filter(id__lte=last), ("id", "product__category")):
+            known = categories != None  # noqa: E711
+            lookup[ids[known].astype(np.int64)] = categories[known].astype(np.int64)
+    return lookup
+
+
+def map_keys(lookup, keys):
+    keys = keys.astype(np.int64)
+    known = keys < len(lookup)
+    mapped = np.where(known, lookup[np.where(known, keys, 0)], -1)
+    if (mapped >= 0).all():
+        return mapped
+    # same None the join would have given for a deleted variant or category
+    return np.where(mapped >= 0, mapped, None)
+
+
+# key: column to group by, amount: columns multiplied together per row,
+# key_lookup: builds an array translating key values, for keys that live
+# on 'default' while the rows live on the order shards (myapp/sharding.py)
+ReportSpec = namedtuple("ReportSpec", ("model", "key", "amount", "key_lookup"), defaults=(None,))
+
+REPORTS = {
+    "payment_method": ReportSpec(Payment, "payment_method", ("amount",)),
+    "payment_status": ReportSpec(Payment, "payment_status", ("amount",)),
+    "category": ReportSpec(
+        OrderItem, "product_variant", ("price", "quantity"), key_lookup=variant_categories
+    ),
+    "day": ReportSpec(OrderItem, "order__created_at", ("price", "quantity")),
+}
+
+# Both Payment and OrderItem hang off Order, so they share the date filter.
+DATE_FIELD = "order__created_at"
+
+
+def get_chunk_size():
+    return getattr(settings, "REPORT_CHUNK_SIZE", 10000)
+
+
+def iter_column_chunks(queryset, fields, chunk_size=None):
+    """Yield one tuple of numpy arrays (one per field) for every chunk of rows."""
+    chunk_size = chunk_size or get_chunk_size()
+    rows = queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+
+    buffer = []
+    for row in rows:
+        buffer.append(row)
+        if len(buffer) == chunk_size:
+            yield _to_columns(buffer, len(fields))
+            buffer = []
+    if buffer:
+        yield _to_columns(buffer, len(fields))
+
+
+def _to_columns(rows, width):
+    columns = list(zip(*rows))
+    return tuple(np.asarray(columns[i]) for i in range(width))
+
+
+def build_report(name, start=None, end=None, chunk_size=None):
+    """
+    Group the report's rows by key and return (keys, counts, totals) arrays.
+
+    Only one chunk of rows plus one accumulator entry per distinct key is held
+    in memory at a time.
+    """
+    spec = REPORTS[name]
+    queryset = spec.model.objects.all()
+    if start:
+        queryset = queryset.filter(**{f"{DATE_FIELD}__gte": start})
+    if end:
+        queryset = queryset.filter(**{f"{DATE_FIELD}__lt": end})
+    lookup = spec.key_lookup() if spec.key_lookup else None
+
+    # every shard's chunks feed the same accumulator
+    chunks = (
+        columns
+        for alias in sharding.get_shards()
+        for columns in iter_column_chunks(queryset.using(alias), (spec.key,) + spec.amount, chunk_size)
+    )
+
+    totals = {}
+    for columns in chunks:
+        keys = columns[0] if lookup is None else map_keys(lookup, columns[0])
+        amount = np.prod(np.vstack(columns[1:]).astype(np.int64), axis=0)
+
+        for key, count, total in _group(keys, amount):
+            acc = totals.setdefault(key, [0, 0])
+            acc[0] += count
+            acc[1] += int(total)
+
+    # None (e.g. orphaned categories) sorts first, as the empty key
+    keys = sorted(totals, key=lambda key: (key is not None, key))
+    return (
+        np.array(["" if key is None else str(key) for key in keys]),
+        np.array([totals[key][0] for key in keys], dtype=np.int64),
+        np.array([totals[key][1] for key in keys], dtype=np.int64),
+    )
+
+
+def _group(keys, amount):
+    """Yield (key, count, total) per distinct key, with None kept as None."""
+    if keys.dtype == object:
+        # None keys can't be sorted by np.unique; group them on their own and
+        # give the rest back their native dtype so every chunk yields the same
+        # key types
+        missing = keys == None  # noqa: E711
+        if missing.any():
+            yield None, int(missing.sum()), amount[missing].sum()
+        keys, amount = np.asarray(keys[~missing].tolist()), amount[~missing]
+        if not len(keys):
+            return
+
+    unique, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse)
+    sums = np.bincount(inverse, weights=amount)
+    yield from zip(unique.tolist(), counts.tolist(), sums.tolist())
+
+
+def write_csv(report, fp, key_name="key"):
+    keys, counts, totals = report
+    writer = csv.writer(fp)
+    writer.writerow((key_name, "count", "total"))
+    writer.writerows(zip(keys.tolist(), counts.tolist(), totals.tolist()))
+
+
+def write_columnar(report, path, key_name="key"):
+    # one array per column, like a single parquet row group
+    keys, counts, totals = report
+    np.savez_compressed(path, **{key_name: keys, "count": counts, "total": totals})
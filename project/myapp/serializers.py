@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.db import transaction
 from rest_framework import serializers
 from myapp.models import (
     CustomUser,
@@ -14,10 +16,15 @@ from myapp.models import (
     Product,
     ProductVariant,
     Category,
+    ImportJob,
 )
 from rest_framework import status
 from rest_framework.response import Response
-from myapp.enum import PaymentMethod, PaymentStatus
+from myapp.enum import PaymentMethod, PaymentStatus, BulkOperation, OutboxEventType
+from myapp.sparse import SparseFieldsSerializerMixin
+from myapp import outbox, sharding, thumbnails
+from myapp.validators.image_header import validate_image_header
+from myapp.validators.image_size import validate_image
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -74,23 +81,50 @@ class UserRegisterSerializer(serializers.ModelSerializer):
 
 
 class ProfileSerializer(serializers.ModelSerializer):
+    # a plain FileField: DRF's ImageField would decode the whole upload to
+    # verify it, validate_image_header only reads the header
+    profile_picture = serializers.FileField(
+        required=False, allow_null=True, validators=[validate_image, validate_image_header]
+    )
+    thumbnails = serializers.SerializerMethodField()
+
     class Meta:
         model = Profile
         fields = (
             "user",
             "contact_number",
+            "profile_picture",
+            "thumbnails",
         )
 
+    def get_thumbnails(self, obj):
+        # empty until the thumbnail workers are done with the current picture
+        storage = obj.profile_picture.storage
+        return {key: storage.url(name) for key, name in obj.thumbnails.items()}
+
+    def create(self, validated_data):
+        if validated_data.get("profile_picture"):
+            validated_data["thumbnails"] = {}
+        profile = super().create(validated_data)
+        thumbnails.schedule(profile)
+        return profile
+
     def update(self, instance, validated_data):
         if "user" in validated_data:
             instance.user = validated_data["user"]
 
-        instance.contact_number = validated_data["contact_number"]
+        if "contact_number" in validated_data:
+            instance.contact_number = validated_data["contact_number"]
+        if "profile_picture" in validated_data:
+            instance.profile_picture = validated_data["profile_picture"]
+            instance.thumbnails = {}
         instance.save()
+        if "profile_picture" in validated_data:
+            thumbnails.schedule(instance)
         return instance
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Category
@@ -105,13 +139,18 @@ class CategoryTreeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'children')
 
     def get_children(self, obj):
+        # hierarchy() passes every category grouped by parent, no query per node
+        children = self.context.get("children")
+        if children is not None:
+            return CategoryTreeSerializer(children.get(obj.id, []), many=True, context=self.context).data
+
         if obj.children.exists():
             return CategoryTreeSerializer(obj.children.all(), many=True).data
         return []
     
     
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = ("name", "category", "price")
@@ -125,12 +164,40 @@ class ProductSerializer(serializers.ModelSerializer):
         return product
 
 
-class ProductVariantSerializer(serializers.ModelSerializer):
+class ProductVariantSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = ProductVariant
         fields = ("product", "variant_name", "variant_value", "price")
 
 
+class VariantDetailSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProductVariant
+        fields = ("id", "sku", "variant_name", "variant_value", "price", "stock_count")
+
+
+class ProductDetailSerializer(serializers.ModelSerializer):
+    variants = VariantDetailSerializer(source="productvariant_set", many=True, read_only=True)
+
+    class Meta:
+        model = Product
+        fields = (
+            "id",
+            "sku",
+            "name",
+            "slug",
+            "description",
+            "price",
+            "discount_price",
+            "category",
+            "inventory_count",
+            "is_active",
+            "created_at",
+            "updates_at",
+            "variants",
+        )
+
+
 class CartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
@@ -193,26 +260,34 @@ class CartSerializer(serializers.ModelSerializer):
 
 
 
-class PaymentSerializer(serializers.ModelSerializer):
+class ShardedOrderField(serializers.PrimaryKeyRelatedField):
+    """Looks the order up on the shard its id belongs to (myapp/sharding.py)."""
+
+    def get_queryset(self):
+        return sharding.fan_out(Order.objects.all())
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        try:
+            return sharding.for_id(Order, data).get(pk=data)
+        except Order.DoesNotExist:
+            self.fail("does_not_exist", pk_value=data)
+        except (TypeError, ValueError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
 
 
+class PaymentSerializer(serializers.ModelSerializer):
+    order = ShardedOrderField()
+
     class Meta:
         model = Payment
         fields = ("order", "payment_method", "payment_status")
 
     def validate(self, data):
-        order_id = data.get('order')
         payment_method = data.get('payment_method')
         payment_status = data.get('payment_status')
 
-        try:
-            Order.objects.get(id = order_id.id)
-        
-        except:
-            return Response(
-                    {"detail": "Object not found."},
-                    status=status.HTTP_400_BAD_REQUEST)
-        
         if payment_method not in (method.value for method in PaymentMethod):
             raise serializers.ValidationError(
                 {"Invalid Method": "PaymentMethod must be from the specified Methods"},
@@ -228,19 +303,27 @@ class PaymentSerializer(serializers.ModelSerializer):
     
     def create(self, validated_data):
 
-        order = Order.objects.get(id = validated_data["order"].id)
+        # the field already loaded the order, from its shard
+        order = validated_data["order"]
         amount = order.total_amount
 
-        payment = Payment.objects.create(
-            order = validated_data['order'],
-            payment_method = validated_data['payment_method'],
-            payment_status = validated_data['payment_status'],
-            amount= amount
-        )
+        with transaction.atomic(using=order._state.db):
+            payment = Payment.objects.create(
+                order = order,
+                payment_method = validated_data['payment_method'],
+                payment_status = validated_data['payment_status'],
+                amount= amount
+            )
+            outbox.emit(OutboxEventType.PAYMENT_CREATED, order.id, {
+                "payment": payment.id,
+                "payment_method": payment.payment_method,
+                "payment_status": payment.payment_status,
+                "amount": payment.amount,
+            })
         return payment
     
 
-class AddressSerializer(serializers.ModelSerializer):
+class AddressSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = ShippingAddress
         fields =(
@@ -263,13 +346,63 @@ class CouponSerializer(serializers.ModelSerializer):
         "code",
         "discount_amount",
         "is_active",
-        "expiration_date"
+        "expiration_date",
+        "usage_limit",
+        "per_user_limit",
+        "used_count",
         )
         read_only_fields =("discount_amount",
         "is_active",
-        "expiration_date")
+        "expiration_date",
+        "usage_limit",
+        "per_user_limit",
+        "used_count")
 
 
-       
+class ImportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ImportJob
+        fields = (
+        "id",
+        "kind",
+        "source",
+        "status",
+        "batch_size",
+        "committed_rows",
+        "error_count",
+        "created_at",
+        )
+        read_only_fields = ("status", "committed_rows", "error_count", "created_at")
+
+
+class WishlistChangeSerializer(serializers.Serializer):
+    products = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+    def validate_products(self, value):
+        max_ids = getattr(settings, "BATCH_RETRIEVE_MAX_IDS", 100)
+        if len(value) > max_ids:
+            raise serializers.ValidationError(f"At most {max_ids} products can be changed at once")
+        return list(dict.fromkeys(value))
 
 
+class BulkUpdateSerializer(serializers.Serializer):
+    field = serializers.CharField()
+    operation = serializers.ChoiceField(choices=BulkOperation.choices())
+    value = serializers.DecimalField(max_digits=12, decimal_places=2)
+    floor = serializers.IntegerField(required=False, allow_null=True)
+    category = serializers.IntegerField(required=False)
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False)
+    dry_run = serializers.BooleanField(default=False)
+
+    def validate_field(self, value):
+        if value not in self.context["fields"]:
+            raise serializers.ValidationError(
+                f"Field must be one of {', '.join(self.context['fields'])}"
+            )
+        return value
+
+    def validate(self, attrs):
+        # price and stock are whole numbers, only a percentage may be fractional
+        if attrs["operation"] != BulkOperation.PERCENT.value and attrs["value"] != attrs["value"].to_integral_value():
+            raise serializers.ValidationError({"value": "Must be a whole number for add and set"})
+        return attrs
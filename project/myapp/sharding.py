@@ -0,0 +1,323 @@
+import heapq
+import itertools
+import zlib
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, models, router
+from django.db.models.signals import post_migrate
+from django.dispatch import receiver
+
+
+# Order, OrderItem and Payment rows live on one of ORDER_SHARDS, picked by a
+# hash of the user id: an order goes to its user's shard and its items,
+# payment and outbox events follow the order. Everything else stays on
+# 'default'.
+#
+# Primary keys of shard N start at N << SHARD_ID_BITS, so an order, item or
+# payment id alone tells which shard holds it.
+#
+# Changing the number of shards moves users between them. Existing rows
+# would have to be migrated first.
+SHARD_ID_BITS = 40
+
+
+def get_shards():
+    return list(getattr(settings, "ORDER_SHARDS", None) or ["default"])
+
+
+def shard_for_user(user_id):
+    shards = get_shards()
+    # crc32 rather than hash(), it is the same in every process
+    return shards[zlib.crc32(str(user_id).encode()) % len(shards)]
+
+
+def shard_for_id(pk):
+    """Shard holding the Order, OrderItem or Payment `pk`, None for an id no shard hands out."""
+    shards = get_shards()
+    try:
+        index = int(pk) >> SHARD_ID_BITS
+    except (TypeError, ValueError):
+        return None
+    return shards[index] if 0 <= index < len(shards) else None
+
+
+def id_floor(alias):
+    return get_shards().index(alias) << SHARD_ID_BITS
+
+
+# model label -> (shard key attribute, function finding the shard from it)
+SHARD_KEYS = {
+    "myapp.order": ("user_id", shard_for_user),
+    "myapp.orderitem": ("order_id", shard_for_id),
+    "myapp.payment": ("order_id", shard_for_id),
+    "myapp.outboxevent": ("order_id", shard_for_id),
+}
+
+
+def is_sharded(model):
+    return model._meta.label_lower in SHARD_KEYS
+
+
+def shard_of(instance):
+    """Shard an Order/OrderItem/Payment instance belongs on."""
+    if instance._state.db is not None:
+        return instance._state.db
+    attribute, resolve = SHARD_KEYS[instance._meta.label_lower]
+    return resolve(getattr(instance, attribute))
+
+
+def for_user(model, user_id):
+    """`model.objects` on the shard holding `user_id`'s rows."""
+    return model.objects.using(shard_for_user(user_id))
+
+
+def for_id(model, pk):
+    """`model.objects` on the shard holding row `pk`, empty when no shard does."""
+    alias = shard_for_id(pk)
+    if alias is None:
+        return model.objects.none()
+    return model.objects.using(alias)
+
+
+class ShardRouter:
+    """
+    Routes sharded models by the instance Django hands over as a hint: a
+    saved row stays where it was loaded from, a new one goes to the shard of
+    its user or order, and user.order looks on that user's shard.
+
+    Queries with nothing to go by (Order.objects.filter(...)) fall through to
+    'default', which has no order tables once there are real shards, so a
+    missing for_user()/for_id()/fan_out() fails loudly.
+    """
+
+    def route(self, model, hints):
+        instance = hints.get("instance")
+        if instance is None:
+            return None
+        if is_sharded(model):
+            if is_sharded(type(instance)):
+                return shard_of(instance)
+            if instance._meta.label_lower == settings.AUTH_USER_MODEL.lower():
+                return shard_for_user(instance.pk)
+            return None
+        if is_sharded(type(instance)):
+            # order.user, item.product_variant: those tables are on 'default'
+            return "default"
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self.route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self.route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_sharded(type(obj1)) and is_sharded(type(obj2)):
+            return obj1._state.db == obj2._state.db
+        if is_sharded(type(obj1)) or is_sharded(type(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        shards = get_shards()
+        sharded = model_name is not None and f"{app_label}.{model_name}" in SHARD_KEYS
+        if db != "default" and db in shards:
+            return sharded
+        if db == "default" and sharded and "default" not in shards:
+            return False
+        return None
+
+
+class ShardAwareQuerySet(models.QuerySet):
+    """create()/bulk_create() that place each new row on its shard."""
+
+    def create(self, **kwargs):
+        if self._db is not None:
+            return super().create(**kwargs)
+        return self.using(router.db_for_write(self.model, instance=self.model(**kwargs))).create(**kwargs)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if self._db is not None:
+            return super().bulk_create(objs, *args, **kwargs)
+        objs = list(objs)
+        by_shard = defaultdict(list)
+        for obj in objs:
+            by_shard[router.db_for_write(self.model, instance=obj)].append(obj)
+        for alias, batch in by_shard.items():
+            self.using(alias).bulk_create(batch, *args, **kwargs)
+        return objs
+
+
+class Descending:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def fan_out(queryset, aliases=None):
+    return FanOut(queryset, aliases)
+
+
+class FanOut:
+    """
+    A queryset run on every shard with the results merged in its order_by()
+    order, for admin-wide listings. Supports what list views and pagination
+    use: filter/order_by chaining, count(), exists(), get(), iteration and
+    slicing. A slice [a:b] reads the first b rows of every shard.
+    """
+
+    CHAINABLE = {
+        "all", "filter", "exclude", "order_by", "select_related", "prefetch_related",
+        "only", "defer", "distinct", "annotate", "values",
+    }
+
+    def __init__(self, queryset, aliases=None):
+        self.queryset = queryset
+        self.model = queryset.model
+        self.aliases = list(aliases or get_shards())
+
+    def __getattr__(self, name):
+        if name not in self.CHAINABLE:
+            raise AttributeError(f"{type(self).__name__} has no {name}(), it can't run across shards")
+        method = getattr(self.queryset, name)
+        return lambda *args, **kwargs: FanOut(method(*args, **kwargs), self.aliases)
+
+    @property
+    def _prefetch_related_lookups(self):
+        # read by ModelChoiceField, so a FanOut can back a form's choices
+        return self.queryset._prefetch_related_lookups
+
+    def shard_querysets(self, stop=None):
+        queryset = self.queryset.order_by(*self.ordering())
+        if stop is not None:
+            queryset = queryset[:stop]
+        return [queryset.using(alias) for alias in self.aliases]
+
+    def ordering(self):
+        ordering = list(self.queryset.query.order_by or self.model._meta.ordering)
+        if not any(term.lstrip("-") in ("pk", self.model._meta.pk.name) for term in ordering):
+            # ids are unique across shards, so this makes the merge total
+            ordering.append("pk")
+        return ordering
+
+    def sort_key(self):
+        iterable = self.queryset._iterable_class
+        if iterable not in (models.query.ModelIterable, models.query.ValuesIterable):
+            raise ValueError("Only model instances and values() rows can be merged across shards")
+        values = iterable is models.query.ValuesIterable
+        getters = []
+        for term in self.ordering():
+            name = term.lstrip("-")
+            if name == "pk":
+                name = self.model._meta.pk.name
+            if "__" in name:
+                raise ValueError(f"Can't merge shards on the related field {name}")
+            if not values:
+                name = self.model._meta.get_field(name).attname
+            getters.append((name, term.startswith("-")))
+
+        def key(row):
+            parts = []
+            for name, descending in getters:
+                value = row[name] if values else getattr(row, name)
+                # NULLs first, like SQLite sorts them
+                value = (value is not None, value)
+                parts.append(Descending(value) if descending else value)
+            return tuple(parts)
+
+        return key
+
+    def merged(self, stop=None):
+        return heapq.merge(*self.shard_querysets(stop), key=self.sort_key())
+
+    def __iter__(self):
+        return iter(self.merged())
+
+    def iterator(self, *args, **kwargs):
+        return iter(self.merged())
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, item):
+        if isinstance(item, int):
+            return next(itertools.islice(self.merged(item + 1), item, None))
+        return list(itertools.islice(self.merged(item.stop), item.start, item.stop))
+
+    def count(self):
+        return sum(queryset.count() for queryset in self.shard_querysets())
+
+    def exists(self):
+        return any(queryset.exists() for queryset in self.shard_querysets())
+
+    def get(self, *args, **kwargs):
+        pk = kwargs.get("pk", kwargs.get(self.model._meta.pk.name))
+        aliases = self.aliases if pk is None else [shard_for_id(pk)]
+        found = [
+            row for alias in aliases if alias in self.aliases
+            for row in self.queryset.using(alias).filter(*args, **kwargs)[:2]
+        ]
+        if not found:
+            raise self.model.DoesNotExist(f"{self.model._meta.object_name} matching query does not exist.")
+        if len(found) > 1:
+            raise self.model.MultipleObjectsReturned(f"get() returned more than one {self.model._meta.object_name}")
+        return found[0]
+
+
+@receiver(post_migrate)
+def reserve_id_ranges(sender, using, **kwargs):
+    """Start the sharded tables of shard N at N << SHARD_ID_BITS."""
+    if sender.name != "myapp" or using not in get_shards() or not id_floor(using):
+        return
+    connection = connections[using]
+    reserve = ID_RESERVERS.get(connection.vendor)
+    if reserve is None:
+        # ids starting at 1 on every shard would all route to the first one
+        raise ImproperlyConfigured(
+            f"Order sharding can't reserve id ranges on {connection.vendor} (database '{using}')"
+        )
+    floor = id_floor(using)
+    with connection.cursor() as cursor:
+        for label in SHARD_KEYS:
+            meta = sender.get_model(label.split(".")[1])._meta
+            reserve(cursor, connection.ops.quote_name, meta.db_table, meta.pk.column, floor)
+
+
+def _reserve_sqlite(cursor, quote_name, table, pk_column, floor):
+    # AUTOINCREMENT tables continue from sqlite_sequence
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [table])
+    row = cursor.fetchone()
+    if row is None:
+        cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)", [table, floor])
+    elif row[0] < floor:
+        cursor.execute("UPDATE sqlite_sequence SET seq = %s WHERE name = %s", [floor, table])
+
+
+def _reserve_postgresql(cursor, quote_name, table, pk_column, floor):
+    # the next id is one past the larger of the floor and the ids already used
+    cursor.execute(
+        f"SELECT setval(pg_get_serial_sequence(%s, %s), "
+        f"GREATEST(%s, (SELECT COALESCE(MAX({quote_name(pk_column)}), 0) FROM {quote_name(table)})))",
+        [quote_name(table), pk_column, floor],
+    )
+
+
+def _reserve_mysql(cursor, quote_name, table, pk_column, floor):
+    # InnoDB keeps the counter where it is when it is already past the floor
+    cursor.execute(f"ALTER TABLE {quote_name(table)} AUTO_INCREMENT = {int(floor) + 1}")
+
+
+ID_RESERVERS = {
+    "sqlite": _reserve_sqlite,
+    "postgresql": _reserve_postgresql,
+    "mysql": _reserve_mysql,
+}
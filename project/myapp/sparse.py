@@ -0,0 +1,79 @@
+from rest_framework import serializers
+
+from myapp.fastpath import compile_row_mapper
+
+
+FIELDS_PARAM = "fields"
+EXCLUDE_PARAM = "exclude"
+
+_field_sources = {}
+
+
+def _split(value):
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+def get_sparse_field_names(request, available):
+    """
+    Names picked with ?fields=a,b or dropped with ?exclude=c on a GET request,
+    in serializer order. None when the request doesn't ask for a sparse set.
+    """
+    if request is None or request.method != "GET":
+        return None
+
+    # GET rather than query_params so plain Django requests (async views) work too
+    fields = request.GET.get(FIELDS_PARAM)
+    exclude = request.GET.get(EXCLUDE_PARAM)
+    if not fields and not exclude:
+        return None
+
+    wanted = set(_split(fields)) if fields else set(available)
+    dropped = set(_split(exclude)) if exclude else set()
+    unknown = (wanted | dropped) - set(available)
+    if unknown:
+        raise serializers.ValidationError(
+            {FIELDS_PARAM: f"Unknown field(s): {', '.join(sorted(unknown))}"}
+        )
+    return tuple(name for name in available if name in wanted and name not in dropped)
+
+
+class SparseFieldsSerializerMixin:
+    """Drops the fields not asked for with ?fields= / ?exclude=."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        names = get_sparse_field_names(self.context.get("request"), tuple(self.fields))
+        if names is not None:
+            for name in set(self.fields) - set(names):
+                self.fields.pop(name)
+
+
+class SparseFieldsViewMixin:
+    """
+    Pushes the ?fields= / ?exclude= projection into the queryset with only(),
+    so unrequested columns (e.g. description) are never read.
+    """
+
+    def get_field_sources(self):
+        serializer_class = self.get_serializer_class()
+        if serializer_class not in _field_sources:
+            _field_sources[serializer_class] = {
+                name: field.source for name, field in serializer_class().fields.items()
+            }
+        return _field_sources[serializer_class]
+
+    def get_sparse_fields(self):
+        return get_sparse_field_names(self.request, tuple(self.get_field_sources()))
+
+    def get_row_mapper(self):
+        return compile_row_mapper(self.get_serializer_class(), self.get_sparse_fields())
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        names = self.get_sparse_fields()
+        if names is None:
+            return queryset
+
+        sources = self.get_field_sources()
+        concrete = {field.name for field in queryset.model._meta.concrete_fields}
+        return queryset.only(*(sources[name] for name in names if sources[name] in concrete))
@@ -0,0 +1,100 @@
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+from myapp.models import Cart, Coupon, IdempotencyKey
+
+
+# Deletes rows nobody needs any more, a bounded id range at a time: each
+# chunk is its own short transaction, so the write lock is held for one
+# chunk only and requests get in between chunks. Only the primary key index
+# is used to find a chunk, stale rows are filtered inside it.
+
+
+class Sweep:
+    """Rows of `model` matching stale() can go; deleting them cascades as usual."""
+
+    model = None
+    help = ""
+
+    def stale(self):
+        raise NotImplementedError
+
+
+class AbandonedCarts(Sweep):
+    model = Cart
+    help = "carts idle for SWEEP_CART_MAX_AGE_DAYS, with their items"
+
+    def stale(self):
+        return Q(updates_at__lt=date.today() - timedelta(days=settings.SWEEP_CART_MAX_AGE_DAYS))
+
+
+class ExpiredCoupons(Sweep):
+    model = Coupon
+    help = "coupons expired for SWEEP_COUPON_MAX_AGE_DAYS, with their usage counts"
+
+    def stale(self):
+        return Q(expiration_date__lt=timezone.now() - timedelta(days=settings.SWEEP_COUPON_MAX_AGE_DAYS))
+
+
+class ExpiredTokens(Sweep):
+    model = OutstandingToken
+    help = "expired refresh tokens and their blacklist entries, which can't be used anyway"
+
+    def stale(self):
+        return Q(expires_at__lte=timezone.now())
+
+
+class ExpiredIdempotencyKeys(Sweep):
+    model = IdempotencyKey
+    help = "idempotency keys past IDEMPOTENCY_TTL, or abandoned while in flight"
+
+    def stale(self):
+        return Q(expires_at__lte=timezone.now())
+
+
+SWEEPS = {
+    "carts": AbandonedCarts(),
+    "coupons": ExpiredCoupons(),
+    "tokens": ExpiredTokens(),
+    "idempotency": ExpiredIdempotencyKeys(),
+}
+
+
+def run_sweep(sweep, chunk_size=None, pause=None, dry_run=False, progress=None):
+    """
+    Delete the stale rows of `sweep` chunk by chunk, sleeping `pause` seconds
+    after every chunk that deleted something. Calls progress(scanned_to,
+    last_id, deleted) after each chunk and returns the number of rows
+    deleted, or found with `dry_run`.
+    """
+    chunk_size = chunk_size or settings.SWEEP_CHUNK_SIZE
+    pause = settings.SWEEP_PAUSE if pause is None else pause
+    alias = router.db_for_write(sweep.model)
+    rows = sweep.model.objects.using(alias)
+    bounds = rows.aggregate(first=Min("pk"), last=Max("pk"))
+    if bounds["first"] is None:
+        return 0
+
+    deleted = 0
+    stale = sweep.stale()
+    # rows added after this point aren't stale yet
+    last = bounds["last"]
+    for start in range(bounds["first"], last + 1, chunk_size):
+        chunk = rows.filter(stale, pk__gte=start, pk__lt=start + chunk_size)
+        if dry_run:
+            count = chunk.count()
+        else:
+            with transaction.atomic(using=alias):
+                count = chunk.delete()[1].get(sweep.model._meta.label, 0)
+        deleted += count
+        if progress is not None:
+            progress(min(start + chunk_size - 1, last), last, deleted)
+        if count and pause:
+            time.sleep(pause)
+    return deleted
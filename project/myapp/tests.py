@@ -1,3 +1,1456 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+import uuid
+from contextlib import ExitStack, contextmanager
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connections, transaction
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+import numpy as np
+from PIL import Image, ImageFile
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from myapp import archive, coupons, outbox, profiling, reports, sharding, sweeper, thumbnails, views, wishlist
+from myapp.fastpath import compile_row_mapper
+from myapp.imports import CatalogImporter
+from myapp.enum import ImportStatus, OutboxEventType, OutboxStatus
+from myapp.management.commands.outbox_receiver import StubReceiver
+from myapp.renderers import ORJSONRenderer
+from myapp.serializers import BulkUpdateSerializer, PaymentSerializer
+from myapp.sparse import get_sparse_field_names
+from myapp.views import CategoryAPIView, ProductAPIView, ProductVariantAPIView
+from myapp.models import (
+    ArchivedProduct,
+    ArchivedProductVariant,
+    Cart,
+    CartItem,
+    Category,
+    Coupon,
+    CouponUsage,
+    CustomUser,
+    IdempotencyKey,
+    ImportJob,
+    ImportRowError,
+    Order,
+    OrderItem,
+    OutboxEvent,
+    Payment,
+    Product,
+    ProductVariant,
+    Profile,
+    Review,
+    ShippingAddress,
+    Wishlist,
+)
+
+
+SMALL = 10
+LARGE = 1000
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+# the staff payment list and the reports run their queries once per shard
+SHARDS = len(sharding.get_shards())
+
+# (name, method, url, payload, expected status, query budget)
+# urls are formatted with the ids from QueryCountTests.setUp()
+ENDPOINTS = [
+    ("api-root", "get", "/", None, 200, 0),
+    ("profile-list", "get", "/profile/", None, 200, 2),
+    ("profile-detail", "get", "/profile/{profile}/", None, 200, 1),
+    ("category-list", "get", "/category/", None, 200, 2),
+    ("category-detail", "get", "/category/{category}/", None, 200, 1),
+    ("category-hierarchy", "get", "/category/hierarchy/", None, 200, 1),
+    ("product-list", "get", "/product/", None, 200, 2),
+    ("product-list-sparse", "get", "/product/?fields=name,price", None, 200, 2),
+    ("product-batch", "get", "/product/?ids={product},{other_product}", None, 200, 1),
+    ("product-detail", "get", "/product/{product}/", None, 200, 1),
+    ("product-full-detail", "get", "/product/{product}/detail/", None, 200, 4),
+    ("product-group-by", "get", "/product/group-by/?attribute=category", None, 200, 1),
+    ("product-with-archived", "get", "/product/with-archived/", None, 200, 2),
+    ("product-export", "get", "/product/export/", None, 200, 1),
+    ("product-export-csv", "get", "/product/export/?export_format=csv", None, 200, 1),
+    ("product-bulk-update-preview", "post", "/product/bulk-update/",
+        {"field": "price", "operation": "percent", "value": "-10", "category": "{category}", "dry_run": True}, 200, 2),
+    ("product-bulk-update", "post", "/product/bulk-update/",
+        {"field": "price", "operation": "add", "value": "5", "category": "{category}"}, 200, 1),
+    ("product-by-category-list", "get", "/product/category/{category}/", None, 200, 2),
+    ("product-by-category-detail", "get", "/product/category/{category}/{product}/", None, 200, 1),
+    ("product-by-category-export", "get", "/product/category/{category}/export/", None, 200, 1),
+    ("variant-list", "get", "/productvariant/", None, 200, 2),
+    ("variant-batch", "get", "/productvariant/?ids={variant}", None, 200, 1),
+    ("variant-detail", "get", "/productvariant/{variant}/", None, 200, 1),
+    ("variant-export", "get", "/productvariant/export/", None, 200, 1),
+    ("variant-bulk-update", "post", "/productvariant/bulk-update/",
+        {"field": "stock_count", "operation": "set", "value": "3", "ids": ["{variant}"]}, 200, 1),
+    ("variant-by-product-list", "get", "/productvariant/product/{product}/", None, 200, 2),
+    ("variant-by-product-detail", "get", "/productvariant/product/{product}/{variant}/", None, 200, 1),
+    ("cart-list", "get", "/cart/", None, 200, 4),
+    ("cart-detail", "get", "/cart/{cart}/", None, 200, 3),
+    ("cart-add-item", "patch", "/cart/{cart}/",
+        {"items": [{"product_variant": "{variant}", "quantity": 1, "price_at_time": 0}]}, 200, 9),
+    ("cart-item-quantity", "patch", "/cart/{cart_item}/update_cart_quantity/", {"quantity": 3}, 200, 3),
+    ("cart-item-delete", "delete", "/cart/{cart_item}/", None, 200, 5),
+    ("payment-list", "get", "/payment/", None, 200, 2 * SHARDS),
+    ("payment-detail", "get", "/payment/{order}/", None, 200, 2),
+    ("payment-create", "post", "/payment/",
+        {"order": "{order}", "payment_method": "PayPal", "payment_status": "paid"}, 201, 5),
+    ("shipping-address-list", "get", "/shippingaddress/", None, 200, 2),
+    ("shipping-address-detail", "get", "/shippingaddress/{user}/", None, 200, 1),
+    ("coupon-list", "get", "/coupon/", None, 200, 2),
+    ("coupon-detail", "get", "/coupon/{coupon}/", None, 200, 1),
+    ("coupon-apply", "post", "/coupon/{order}/apply_coupon/", {"code": "{coupon_code}"}, 200, 9),
+    ("wishlist-list", "get", "/wishlist/", None, 200, 1),
+    ("wishlist-contains", "get", "/wishlist/contains/?ids={product},{other_product}", None, 200, 1),
+    ("wishlist-add", "post", "/wishlist/add/", {"products": ["{product}", "{other_product}"]}, 200, 6),
+    ("wishlist-remove", "post", "/wishlist/remove/", {"products": ["{other_product}"]}, 200, 2),
+    ("import-list", "get", "/import/", None, 200, 2),
+    ("import-detail", "get", "/import/{import_job}/", None, 200, 1),
+    ("import-errors", "get", "/import/{import_job}/errors/", None, 200, 2),
+    ("import-resume-completed", "post", "/import/{import_job}/resume/", None, 400, 1),
+    ("report", "get", "/reports/payment_method/", None, 200, SHARDS),
+    ("media", "get", "{media_url}", None, 200, 0),
+    # async views authenticate from the JWT header, one query for the user
+    ("async-product-list", "get", "/async/product/", None, 200, 3),
+    ("async-product-list-sparse", "get", "/async/product/?fields=name,price", None, 200, 3),
+    ("async-product-batch", "get", "/async/product/?ids={product},{other_product}", None, 200, 2),
+    ("async-product-detail", "get", "/async/product/{product}/", None, 200, 2),
+    ("async-product-by-category-list", "get", "/async/product/category/{category}/", None, 200, 3),
+    ("async-variant-list", "get", "/async/productvariant/", None, 200, 3),
+    ("async-variant-by-product-list", "get", "/async/productvariant/product/{product}/", None, 200, 3),
+    ("async-category-hierarchy", "get", "/async/category/hierarchy/", None, 200, 2),
+    ("register", "post", "/register/",
+        {"email": "new@example.com", "first_name": "New", "last_name": "User", "password": "pw-12345!",
+         "confirm_password": "pw-12345!", "contact_number": "123456"}, 201, 4),
+    ("token", "post", "/api/token/", {"email": "shopper@example.com", "password": "secret-pw"}, 200, 4),
+    ("token-refresh", "post", "/api/token/refresh/", {"refresh": "{refresh}"}, 200, 2),
+    ("logout", "post", "/logout/", {"refresh_token": "{refresh}"}, 205, 7),
+]
+
+
+def aliases():
+    # not "__all__", that would also open a transaction on the production
+    # profile's read-only mirror of 'default'
+    return list(dict.fromkeys(["default", *sharding.get_shards()]))
+
+
+@contextmanager
+def rolled_back():
+    with ExitStack() as stack:
+        for alias in aliases():
+            stack.enter_context(transaction.atomic(using=alias))
+        yield
+        for alias in aliases():
+            transaction.set_rollback(True, using=alias)
+
+
+@contextmanager
+def capture_queries():
+    """CaptureQueriesContext over 'default' and every order shard."""
+    queries = []
+    with ExitStack() as stack:
+        contexts = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in aliases()]
+        yield queries
+        for context in contexts:
+            queries.extend(context.captured_queries)
+
+
+def fill(value, ids):
+    if isinstance(value, str):
+        formatted = value.format(**ids)
+        return int(formatted) if formatted.isdigit() and value != formatted else formatted
+    if isinstance(value, list):
+        return [fill(item, ids) for item in value]
+    if isinstance(value, dict):
+        return {key: fill(item, ids) for key, item in value.items()}
+    return value
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, QUERY_REPEAT_RAISE=True)
+class QueryCountTests(TestCase):
+    """
+    Every route must run the same number of queries whether the related
+    tables hold SMALL or LARGE rows, and stay within its budget.
+    """
+
+    databases = set(aliases())
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="shopper@example.com", password="secret-pw", first_name="Shop", last_name="Per"
+        )
+        profile = Profile.objects.create(user=self.user, contact_number="123456")
+        self.root = Category.objects.create(name="root")
+        self.category = Category.objects.create(name="shoes", parent=self.root)
+        self.product = Product.objects.create(name="sneaker", price=100, category=self.category)
+        other_product = Product.objects.create(name="boot", price=150, category=self.category)
+        self.variant = ProductVariant.objects.create(
+            product=self.product, variant_name="size 42", variant_value="medium", price=100, stock_count=5
+        )
+        self.cart = Cart.objects.create(user=self.user)
+        cart_item = CartItem.objects.create(cart=self.cart, product_variant=self.variant, quantity=1, price_at_time=100)
+        self.order = Order.objects.create(user=self.user, order_status="pending", total_amount=500)
+        Payment.objects.create(order=self.order, payment_method="Visa", amount=500, payment_status="unpaid")
+        coupon = Coupon.objects.create(
+            code="WELCOME", discount_amount="5.00", expiration_date=timezone.now() + timedelta(days=30)
+        )
+        import_job = ImportJob.objects.create(
+            kind="products", source="imports/feed.csv", status=ImportStatus.COMPLETED.value
+        )
+        Wishlist.objects.create(user=self.user).products.add(other_product)
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # only read by the async views, the DRF views use the forced user
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+        self.ids = {
+            "user": self.user.id,
+            "profile": profile.id,
+            "category": self.category.id,
+            "product": self.product.id,
+            "other_product": other_product.id,
+            "variant": self.variant.id,
+            "cart": self.cart.id,
+            "cart_item": cart_item.id,
+            "order": self.order.id,
+            "coupon": coupon.id,
+            "coupon_code": coupon.code,
+            "import_job": import_job.id,
+            "refresh": str(RefreshToken.for_user(self.user)),
+            "media_url": default_storage.url(
+                default_storage.save("profile_pics/me.png", image_upload(size=(20, 20)))
+            ),
+        }
+        self.seeded = 0
+
+    def seed(self, total):
+        """Grow every table an endpoint reads to `total` related rows."""
+        count = total - self.seeded
+        start = self.seeded
+        self.seeded = total
+
+        Category.objects.bulk_create(
+            Category(name=f"category {start + i}", parent=self.category) for i in range(count)
+        )
+        products = Product.objects.bulk_create(
+            Product(name=f"product {start + i}", price=10 + i, category=self.category, description="x" * 100)
+            for i in range(count)
+        )
+        variants = ProductVariant.objects.bulk_create(
+            ProductVariant(product=self.product, variant_name=f"variant {start + i}", variant_value="low", price=10)
+            for i in range(count)
+        )
+        ProductVariant.objects.bulk_create(
+            ProductVariant(product=product, variant_name="default", variant_value="high", price=product.price)
+            for product in products
+        )
+        CartItem.objects.bulk_create(
+            CartItem(cart=self.cart, product_variant=variant, quantity=1, price_at_time=10) for variant in variants
+        )
+        OrderItem.objects.bulk_create(
+            OrderItem(order=self.order, product_variant=variant, quantity=2, price=10) for variant in variants
+        )
+        Review.objects.bulk_create(
+            Review(product=self.product, user=self.user, rating=i % 5 + 1, comment="ok") for i in range(count)
+        )
+        ShippingAddress.objects.bulk_create(
+            ShippingAddress(
+                user=self.user, address_line1=f"{start + i} Main St", city="Town", state="State",
+                postal_code="12345", country="Country", phone_number="123456",
+            )
+            for i in range(count)
+        )
+        Coupon.objects.bulk_create(
+            Coupon(code=f"CODE{start + i}", discount_amount="1.00", expiration_date=timezone.now())
+            for i in range(count)
+        )
+        ImportJob.objects.bulk_create(
+            ImportJob(kind="variants", source="imports/old.csv") for i in range(count)
+        )
+        wishlist = Wishlist.objects.get(user=self.user)
+        Wishlist.products.through.objects.bulk_create(
+            Wishlist.products.through(wishlist=wishlist, product=product) for product in products
+        )
+        users = CustomUser.objects.bulk_create(
+            CustomUser(email=f"user{start + i}@example.com", first_name="U", last_name="Ser", password="!")
+            for i in range(count)
+        )
+        orders = Order.objects.bulk_create(
+            Order(user=user, order_status="pending", total_amount=100) for user in users
+        )
+        Payment.objects.bulk_create(
+            Payment(order=order, payment_method="PayPal", amount=100, payment_status="paid") for order in orders
+        )
+
+    def count_queries(self, method, url, payload):
+        # each measurement is rolled back so writes don't leak into the next one
+        cache.clear()
+        coupons.coupon_cache.invalidate()
+        with rolled_back(), capture_queries() as queries:
+            response = getattr(self.client, method)(url, payload, format="json")
+            if response.streaming:
+                b"".join(response.streaming_content)
+        return response, len(queries)
+
+    def test_query_counts_do_not_grow_with_rows(self):
+        for name, method, url, payload, expected_status, budget in ENDPOINTS:
+            url = fill(url, self.ids)
+            payload = fill(payload, self.ids)
+            with self.subTest(endpoint=name), rolled_back():
+                self.seeded = 0
+
+                self.seed(SMALL)
+                response, small = self.count_queries(method, url, payload)
+                self.assertEqual(response.status_code, expected_status, getattr(response, "content", b"")[:200])
+
+                self.seed(LARGE)
+                response, large = self.count_queries(method, url, payload)
+                self.assertEqual(response.status_code, expected_status, getattr(response, "content", b"")[:200])
+
+                self.assertEqual(small, large, f"{name} ran {small} queries at {SMALL} rows, {large} at {LARGE}")
+                self.assertLessEqual(large, budget, f"{name} is over its query budget")
+
+    def test_import_upload_queries_are_constant(self):
+        feed = b"sku,name,price,category\nSKU-1,Runner,80,shoes\nSKU-2,Walker,90,unknown\n"
+        counts = []
+        for size in (SMALL, LARGE):
+            self.seed(size)
+            upload = SimpleUploadedFile("feed.csv", feed, content_type="text/csv")
+            with rolled_back(), capture_queries() as queries:
+                response = self.client.post(
+                    "/import/", {"kind": "products", "batch_size": 100, "source": upload}, format="multipart"
+                )
+            self.assertEqual(response.status_code, 201, response.content)
+            self.assertEqual(response.json()["error_count"], 1)
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+        self.assertLessEqual(counts[1], 10)
+
+    def test_product_detail_not_found(self):
+        other = Category.objects.create(name="hats")
+        self.assertEqual(self.client.get("/product/abc/detail/").status_code, 404)
+        # the plain route's cached copy doesn't leak into another category's route
+        self.assertEqual(self.client.get(f"/product/{self.product.id}/detail/").status_code, 200)
+        self.assertEqual(self.client.get(f"/product/category/{other.id}/{self.product.id}/detail/").status_code, 404)
+        self.assertEqual(
+            self.client.get(f"/product/category/{self.category.id}/{self.product.id}/detail/").status_code, 200
+        )
+
+    def test_async_views_match_the_drf_views(self):
+        self.seed(SMALL)
+        for url in (
+            "/product/?limit=5&offset=3",
+            "/product/?fields=name,price&sort=-price&search=product",
+            "/product/?is_active=true&limit=2",
+            "/product/{product}/",
+            "/product/category/{category}/?limit=4",
+            "/productvariant/?limit=5&offset=5",
+            "/productvariant/product/{product}/",
+            "/productvariant/?sort=-price,variant_name&limit=4",
+            "/productvariant/?ids={variant},999999",
+            "/product/?ids={other_product},{product},999999,{product}",
+            "/product/?ids=1,x",
+            "/product/?category={category}&limit=3&fields=name",
+            "/product/?category=999999",
+            "/product/?is_active=maybe",
+            "/product/?fields=colour",
+            "/product/{product}/?is_active=false",
+            "/category/hierarchy/",
+        ):
+            url = fill(url, self.ids)
+            with self.subTest(url=url):
+                expected = self.client.get(url, HTTP_ACCEPT="application/json")
+                actual = self.client.get("/async" + url)
+                self.assertEqual(actual.status_code, expected.status_code)
+                expected, actual = expected.json(), actual.json()
+                if "next" in expected:
+                    for link in ("next", "previous"):
+                        if expected[link]:
+                            expected[link] = expected[link].replace("testserver/", "testserver/async/", 1)
+                self.assertEqual(actual, expected)
+
+        anonymous = APIClient()
+        for url in ("/category/hierarchy/", "/product/"):
+            with self.subTest(url=url, user=None):
+                expected, actual = anonymous.get(url, HTTP_ACCEPT="application/json"), anonymous.get("/async" + url)
+                self.assertEqual((actual.status_code, actual.json()), (expected.status_code, expected.json()))
+                self.assertEqual(actual.get("WWW-Authenticate"), expected.get("WWW-Authenticate"))
+
+
+class ReportTests(TestCase):
+    databases = set(aliases())
+
+    def test_category_report_streams_the_variant_lookup(self):
+        user = CustomUser.objects.create_user(email="buyer@example.com", password="pw", first_name="B", last_name="Uyer")
+        hats, shoes = Category.objects.create(name="hats"), Category.objects.create(name="shoes")
+        variants = [
+            ProductVariant.objects.create(
+                product=Product.objects.create(name=category.name, price=10, category=category),
+                variant_name="one", variant_value="low", price=10,
+            )
+            for category in (hats, shoes, shoes)
+        ]
+        order = Order.objects.create(user=user, order_status="pending", total_amount=0)
+        for variant, quantity in zip(variants, (1, 2, 3)):
+            OrderItem.objects.create(order=order, product_variant=variant, quantity=quantity, price=10)
+
+        with mock.patch.object(reports, "get_chunk_size", return_value=2):
+            keys, counts, totals = reports.build_report("category")
+        self.assertEqual(keys.tolist(), [str(hats.pk), str(shoes.pk)])
+        self.assertEqual((counts.tolist(), totals.tolist()), ([1, 2], [10, 50]))
+
+    def test_missing_keys_in_one_chunk_merge_with_the_others(self):
+        # variant 9 is gone, so only the second chunk maps a key to None
+        spec = reports.ReportSpec(OrderItem, "product_variant", ("price",), key_lookup=lambda: np.array([-1, 5]))
+        chunks = [
+            (np.array([1, 1]), np.array([10, 20])),
+            (np.array([1, 9]), np.array([30, 40])),
+        ]
+        with mock.patch.dict(reports.REPORTS, {"test": spec}), \
+                mock.patch.object(reports.sharding, "get_shards", return_value=["default"]), \
+                mock.patch.object(reports, "iter_column_chunks", return_value=iter(chunks)):
+            keys, counts, totals = reports.build_report("test")
+
+        self.assertEqual(keys.tolist(), ["", "5"])
+        self.assertEqual(counts.tolist(), [1, 3])
+        self.assertEqual(totals.tolist(), [40, 60])
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        user = CustomUser.objects.create_user(
+            email="admin@example.com", password="pw", first_name="Ad", last_name="Min", is_staff=True
+        )
+        self.category = Category.objects.create(name="shoes")
+        self.old = Product.objects.create(name="old, boot", price=90, category=self.category)
+        self.new = Product.objects.create(name="sneaker", price=100, category=self.category)
+        # update() skips auto_now
+        Product.objects.filter(pk=self.old.pk).update(updates_at=date(2020, 1, 1))
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def export(self, query=""):
+        response = self.client.get(f"/product/export/{query}")
+        self.assertEqual(response.status_code, 200)
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_ndjson_has_one_object_per_row(self):
+        response, body = self.export()
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="product_all.ndjson"')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([row["id"] for row in rows], [self.old.pk, self.new.pk])
+        self.assertEqual(list(rows[0]), list(ProductAPIView.export_fields))
+        self.assertEqual((rows[0]["name"], rows[0]["price"], rows[0]["category"]), ("old, boot", 90, self.category.pk))
+        self.assertEqual(rows[0]["updates_at"], "2020-01-01")
+
+    def test_csv_has_a_header_then_one_line_per_row(self):
+        response, body = self.export("?export_format=csv")
+        self.assertEqual(response["Content-Type"], "text/csv")
+        header, *rows = csv.reader(io.StringIO(body))
+        self.assertEqual(header, list(ProductAPIView.export_fields))
+        self.assertEqual([row[:2] for row in rows], [[str(self.old.pk), "old, boot"], [str(self.new.pk), "sneaker"]])
+
+    def test_updated_since_only_exports_later_changes(self):
+        _, body = self.export(f"?updated_since={timezone.now().date().isoformat()}")
+        self.assertEqual([json.loads(line)["id"] for line in body.splitlines()], [self.new.pk])
+        _, body = self.export("?updated_since=2020-01-01&export_format=csv")
+        self.assertEqual(len(body.splitlines()), 3)
+
+    def test_bad_parameters(self):
+        self.assertEqual(self.client.get("/product/export/?updated_since=yesterday").status_code, 400)
+        self.assertEqual(self.client.get("/product/export/?export_format=xml").status_code, 400)
+
+
+class ImportTests(TestCase):
+    def test_malformed_json_line_is_a_row_error(self):
+        Category.objects.create(name="lamps")
+        job = ImportJob.objects.create(kind="products", source="imports/feed.jsonl")
+        feed = '{"sku": "LAMP-1", "name": "lamp", "price": 10, "category": "lamps"}\n{"sku": "LAMP-2",\n[1, 2]\n'
+        CatalogImporter(job).run(io.StringIO(feed), "jsonl")
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.committed_rows, job.error_count), (ImportStatus.COMPLETED.value, 3, 2))
+        self.assertEqual(list(job.row_errors.order_by("line").values_list("line", flat=True)), [2, 3])
+        self.assertTrue(Product.objects.filter(sku="LAMP-1").exists())
+
+    def test_fractions_and_booleans_are_not_integers(self):
+        Category.objects.create(name="lamps")
+        job = ImportJob.objects.create(kind="products", source="imports/feed.jsonl")
+        rows = [
+            {"sku": "LAMP-1", "name": "lamp", "price": 12.5, "category": "lamps"},
+            {"sku": "LAMP-2", "name": "lamp", "price": True, "category": "lamps"},
+            {"sku": "LAMP-3", "name": "lamp", "price": "7.25", "category": "lamps"},
+            {"sku": "LAMP-4", "name": "lamp", "price": "NaN", "category": "lamps"},
+            {"sku": "LAMP-5", "name": "lamp", "price": 12.0, "inventory_count": " 3 ", "category": "lamps"},
+        ]
+        CatalogImporter(job).run(io.StringIO("".join(json.dumps(row) + "\n" for row in rows)), "jsonl")
+
+        job.refresh_from_db()
+        self.assertEqual(list(job.row_errors.order_by("line").values_list("line", "message")), [
+            (line, "price must be an integer") for line in (1, 2, 3, 4)
+        ])
+        self.assertEqual(list(Product.objects.values_list("sku", "price", "inventory_count")), [("LAMP-5", 12, 3)])
+
+
+class BulkUpdateTests(TestCase):
+    def setUp(self):
+        user = CustomUser.objects.create_user(
+            email="admin@example.com", password="pw", first_name="Ad", last_name="Min", is_staff=True
+        )
+        self.shoes, hats = Category.objects.create(name="shoes"), Category.objects.create(name="hats")
+        self.cheap = Product.objects.create(name="flip flop", price=10, category=self.shoes)
+        self.dear = Product.objects.create(name="boot", price=105, discount_price=90, category=self.shoes)
+        self.hat = Product.objects.create(name="cap", price=20, category=hats)
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def bulk_update(self, **data):
+        response = self.client.post("/product/bulk-update/", {"category": self.shoes.pk, **data}, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def prices(self, field="price"):
+        return list(Product.objects.order_by("pk").values_list(field, flat=True))
+
+    def test_operations(self):
+        self.assertEqual(self.bulk_update(field="price", operation="add", value="5"), {"updated": 2})
+        self.assertEqual(self.prices(), [15, 110, 20])
+        # rounded to the nearest whole number
+        self.bulk_update(field="price", operation="percent", value="-10")
+        self.assertEqual(self.prices(), [14, 99, 20])
+        self.bulk_update(field="price", operation="set", value="50", ids=[self.dear.pk])
+        self.assertEqual(self.prices(), [14, 50, 20])
+
+    def test_floor_and_null_values(self):
+        self.bulk_update(field="price", operation="add", value="-30", floor=1)
+        self.assertEqual(self.prices(), [1, 75, 20])
+        self.assertEqual(self.bulk_update(field="discount_price", operation="percent", value="50"), {"updated": 1})
+        self.assertEqual(self.prices("discount_price"), [None, 135, None])
+
+    def test_dry_run_previews_without_writing(self):
+        result = self.bulk_update(field="price", operation="percent", value="-50", floor=8, dry_run=True)
+        self.assertEqual(result, {
+            "matched": 2,
+            "preview": [
+                {"id": self.cheap.pk, "price": 10, "new_value": 8},
+                # the database's ROUND(), halves go away from zero
+                {"id": self.dear.pk, "price": 105, "new_value": 53},
+            ],
+        })
+        self.assertEqual(self.prices(), [10, 105, 20])
+
+    def test_add_and_set_reject_fractions(self):
+        def valid(operation, value):
+            data = {"field": "price", "operation": operation, "value": value, "ids": [1]}
+            return BulkUpdateSerializer(data=data, context={"fields": ("price",)}).is_valid()
+
+        self.assertFalse(valid("add", "2.50"))
+        self.assertFalse(valid("set", "0.5"))
+        self.assertTrue(valid("set", "3.00"))
+        self.assertTrue(valid("percent", "-2.5"))
+
+
+class FastListTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="admin@example.com", password="pw", first_name="Ad", last_name="Min", is_staff=True
+        )
+        shoes = Category.objects.create(name="shoes", parent=Category.objects.create(name="root"))
+        for i in range(3):
+            product = Product.objects.create(name=f"shoe {i}", price=10 + i, category=shoes)
+            ProductVariant.objects.create(
+                product=product, variant_name=f"size {40 + i}", variant_value="medium", price=10 + i
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_rows_match_the_serializer(self):
+        for url, view in (
+            ("/category/", CategoryAPIView),
+            ("/category/?fields=name,parent", CategoryAPIView),
+            ("/product/", ProductAPIView),
+            ("/product/?fields=name,category", ProductAPIView),
+            ("/product/?exclude=price", ProductAPIView),
+            ("/productvariant/", ProductVariantAPIView),
+            ("/productvariant/?fields=product,variant_name", ProductVariantAPIView),
+        ):
+            with self.subTest(url=url):
+                request = Request(APIRequestFactory().get(url))
+                names = get_sparse_field_names(request, tuple(view.serializer_class().fields))
+                # every field of these lists is a plain column, so they take the values_list() path
+                self.assertIsNotNone(compile_row_mapper(view.serializer_class, names))
+
+                serializer = view.serializer_class(view.queryset.all(), many=True, context={"request": request})
+                expected = json.loads(JSONRenderer().render(serializer.data))
+                self.assertEqual(self.client.get(url).json()["results"], expected)
+
+
+class RendererTests(TestCase):
+    def test_same_bytes_as_the_drf_renderer(self):
+        data = {
+            "price": Decimal("10.50"),
+            "created": datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=dt_timezone.utc),
+            "day": date(2024, 5, 1),
+            "id": uuid.UUID(int=7),
+            "name": "caf\u00e9 \u2028",
+            "nested": [{1: None, "ok": True, "ratio": 0.5}],
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_nan_becomes_null_instead_of_raising(self):
+        data = {"ratio": float("nan"), "limit": float("inf")}
+        with self.assertRaises(ValueError):
+            JSONRenderer().render(data)
+        self.assertEqual(ORJSONRenderer().render(data), b'{"ratio":null,"limit":null}')
+
+
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        user = CustomUser.objects.create_user(
+            email="admin@example.com", password="pw", first_name="Ad", last_name="Min", is_staff=True
+        )
+        self.product = Product.objects.create(
+            name="boot", price=10, category=Category.objects.create(name="shoes"), description="x" * 1000
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def test_only_the_requested_columns_are_read(self):
+        request = Request(APIRequestFactory().get("/product/?fields=name,price"))
+        view = ProductAPIView(request=request, kwargs={})
+        product = view.filter_queryset(view.get_queryset()).get()
+        self.assertEqual(product.get_deferred_fields(), {
+            field.attname for field in Product._meta.concrete_fields
+        } - {"id", "name", "price"})
+
+        for url in ("/product/?fields=name,price", f"/product/{self.product.pk}/?exclude=category"):
+            with self.subTest(url=url), CaptureQueriesContext(connections["default"]) as queries:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            sql = queries.captured_queries[-1]["sql"]
+            self.assertIn('"name"', sql)
+            self.assertNotIn('"description"', sql)
+
+        with CaptureQueriesContext(connections["default"]) as queries:
+            self.client.get(f"/product/{self.product.pk}/")
+        self.assertIn('"description"', queries.captured_queries[-1]["sql"])
+
+
+class BatchRetrieveTests(TestCase):
+    def setUp(self):
+        user = CustomUser.objects.create_user(
+            email="admin@example.com", password="pw", first_name="Ad", last_name="Min", is_staff=True
+        )
+        shoes = Category.objects.create(name="shoes")
+        self.boot, self.clog, self.sandal = (
+            Product.objects.create(name=name, price=10, category=shoes) for name in ("boot", "clog", "sandal")
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def test_results_follow_the_requested_order_once_each(self):
+        gone = self.sandal.pk + 100
+        response = self.client.get(f"/product/?ids={self.sandal.pk},{self.boot.pk},{gone},{self.sandal.pk},")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row["name"] for row in response.json()["results"]], ["sandal", "boot"])
+        self.assertEqual(response.json()["missing"], [gone])
+
+    def test_filters_still_apply(self):
+        Product.objects.filter(pk=self.clog.pk).update(is_active=False)
+        response = self.client.get(f"/product/?ids={self.clog.pk},{self.boot.pk}&is_active=true")
+        self.assertEqual([row["name"] for row in response.json()["results"]], ["boot"])
+        self.assertEqual(response.json()["missing"], [self.clog.pk])
+
+    @override_settings(BATCH_RETRIEVE_MAX_IDS=2)
+    def test_bad_and_too_many_ids(self):
+        self.assertEqual(self.client.get("/product/?ids=1,two").status_code, 400)
+        # duplicates count once
+        self.assertEqual(self.client.get("/product/?ids=1,2,2,1").status_code, 200)
+        response = self.client.get("/product/?ids=1,2,3")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("At most 2 ids", response.json()["detail"])
+
+
+class ProductDetailTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            email="admin@example.com", password="pw", first_name="Ad", last_name="Min", is_staff=True
+        )
+        root = Category.objects.create(name="root", slug="root")
+        self.shoes = Category.objects.create(name="shoes", slug="shoes", parent=root)
+        Category.objects.create(name="sandals", parent=self.shoes)
+        self.product = Product.objects.create(name="boot", price=10, category=self.shoes)
+        self.variant = ProductVariant.objects.create(
+            product=self.product, variant_name="size 42", variant_value="medium", price=10
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.urls = (
+            f"/product/{self.product.pk}/detail/",
+            f"/product/00{self.product.pk}/detail/",
+            f"/product/category/{self.shoes.pk}/{self.product.pk}/detail/",
+        )
+
+    def details(self):
+        return [self.client.get(url).json() for url in self.urls]
+
+    def test_ancestry_is_read_in_one_query(self):
+        with CaptureQueriesContext(connections["default"]) as queries:
+            ancestry = views.category_ancestry(self.shoes.pk)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(ancestry, [
+            {"id": self.shoes.parent_id, "name": "root", "slug": "root"},
+            {"id": self.shoes.pk, "name": "shoes", "slug": "shoes"},
+        ])
+        self.assertEqual(views.category_ancestry(self.shoes.pk + 100), [])
+
+    def test_reviews_refresh_every_cached_copy(self):
+        self.assertEqual([data["rating"]["count"] for data in self.details()], [0, 0, 0])
+        # served from the cache
+        with CaptureQueriesContext(connections["default"]) as queries:
+            self.details()
+        self.assertEqual(len(queries), 0)
+
+        review = Review.objects.create(product=self.product, user=self.user, rating=4, comment="ok")
+        self.assertEqual([data["rating"]["average"] for data in self.details()], [4, 4, 4])
+        review.delete()
+        self.assertEqual([data["rating"]["count"] for data in self.details()], [0, 0, 0])
+
+    def test_variant_changes_refresh_every_cached_copy(self):
+        self.details()
+        self.variant.stock_count = 7
+        self.variant.save()
+        for data in self.details():
+            self.assertEqual(data["product"]["variants"][0]["stock_count"], 7)
+
+        ProductVariant.objects.create(product=self.product, variant_name="size 43", variant_value="medium", price=10)
+        self.assertEqual([len(data["product"]["variants"]) for data in self.details()], [2, 2, 2])
+
+
+class MetricsTests(TestCase):
+    def test_closed_by_default(self):
+        # the test client, like a local proxy, connects from 127.0.0.1
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+
+    @override_settings(METRICS_ALLOWED_IPS=["127.0.0.1"])
+    def test_only_allowed_addresses_scrape(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 200)
+        self.assertEqual(self.client.get("/metrics", REMOTE_ADDR="10.0.0.9").status_code, 403)
+
+    @override_settings(METRICS_TOKEN="s3cret")
+    def test_scrapers_with_the_token(self):
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer s3cret").status_code, 200)
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer guess").status_code, 403)
+
+
+class ProfilingTests(TestCase):
+    async def test_async_views_are_profiled_on_the_event_loop(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        with override_settings(PROFILING_ENABLED=True, PROFILING_SECRET="s3cret", PROFILING_DIR=directory):
+            response = await AsyncClient().get("/async/product/", headers={"X-Profile": "s3cret"})
+            [entry] = profiling.load_index()
+        self.assertEqual(response.status_code, 200)
+
+        [pstats_file] = [name for name in entry["files"] if name.endswith(".pstats")]
+        functions = pstats.Stats(os.path.join(directory, pstats_file)).stats
+        self.assertIn("product_list", {name for _, _, name in functions})
+
+
+class ShardingTests(TestCase):
+    databases = set(aliases())
+
+    @override_settings(ORDER_SHARDS=["default", "orders_1", "orders_2"])
+    def test_ids_and_users_map_to_shards(self):
+        self.assertEqual(sharding.shard_for_id(5), "default")
+        self.assertEqual(sharding.shard_for_id((2 << sharding.SHARD_ID_BITS) + 5), "orders_2")
+        self.assertIsNone(sharding.shard_for_id(3 << sharding.SHARD_ID_BITS))
+        self.assertIsNone(sharding.shard_for_id("abc"))
+        # the same user always lands on the same shard, and users spread out
+        self.assertEqual(sharding.shard_for_user(42), sharding.shard_for_user("42"))
+        self.assertEqual({sharding.shard_for_user(i) for i in range(100)}, {"default", "orders_1", "orders_2"})
+
+    def test_orders_follow_their_user_and_merge_back_in_order(self):
+        users = CustomUser.objects.bulk_create(
+            CustomUser(email=f"user{i}@example.com", first_name="U", last_name="Ser", password="!")
+            for i in range(20)
+        )
+        orders = [
+            Order.objects.create(user=user, order_status="pending", total_amount=100 + i)
+            for i, user in enumerate(users)
+        ]
+        for order in orders:
+            self.assertEqual(order._state.db, sharding.shard_for_user(order.user_id))
+            self.assertEqual(sharding.shard_for_id(order.pk), order._state.db)
+            payment = Payment.objects.create(order=order, payment_method="Visa", amount=1, payment_status="paid")
+            self.assertEqual(payment._state.db, order._state.db)
+            self.assertEqual(sharding.for_user(Order, order.user_id).get(user=order.user_id), order)
+
+        merged = sharding.fan_out(Order.objects.order_by("-total_amount"))
+        self.assertEqual(merged.count(), 20)
+        self.assertEqual([order.total_amount for order in merged[2:5]], [117, 116, 115])
+        self.assertEqual(merged.get(pk=orders[3].pk), orders[3])
+        with self.assertRaises(Order.DoesNotExist):
+            merged.get(pk=-1)
+
+    @override_settings(ORDER_SHARDS=["orders_0", "default"])
+    def test_unsupported_backends_refuse_to_shard(self):
+        with mock.patch.object(connections["default"], "vendor", "oracle"):
+            with self.assertRaises(ImproperlyConfigured):
+                sharding.reserve_id_ranges(sender=apps.get_app_config("myapp"), using="default")
+
+    def test_only_staff_list_every_payment(self):
+        shopper, other = (
+            # create_user() makes staff unless told otherwise
+            CustomUser.objects.create_user(
+                email=f"{name}@example.com", password="pw", first_name="U", last_name="Ser", is_staff=False
+            )
+            for name in ("shopper", "other")
+        )
+        admin = CustomUser.objects.create_user(
+            email="admin@example.com", password="pw", first_name="Ad", last_name="Min", is_staff=True
+        )
+        orders = {}
+        for user, amount in ((shopper, 10), (other, 20)):
+            orders[user] = Order.objects.create(user=user, order_status="pending", total_amount=amount).pk
+            Payment.objects.create(order_id=orders[user], payment_method="Visa", amount=amount, payment_status="paid")
+
+        client = APIClient()
+        for user, expected in ((shopper, [orders[shopper]]), (other, [orders[other]]), (admin, [*orders.values()])):
+            client.force_authenticate(user)
+            response = client.get("/payment/?sort=amount")
+            self.assertEqual([payment["order"] for payment in response.json()["results"]], expected)
+
+    def test_deleting_a_user_deletes_their_order(self):
+        user = CustomUser.objects.create_user(email="gone@example.com", password="pw", first_name="G", last_name="One")
+        order = Order.objects.create(user=user, order_status="pending", total_amount=1)
+        user.delete()
+        self.assertFalse(sharding.for_id(Order, order.pk).filter(pk=order.pk).exists())
+
+
+class OutboxTests(TestCase):
+    databases = set(aliases())
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="buyer@example.com", password="secret-pw", first_name="Buy", last_name="Er"
+        )
+        self.order = Order.objects.create(user=self.user, order_status="pending", total_amount=500)
+        self.events = sharding.for_id(OutboxEvent, self.order.id)
+        self.alias = self.order._state.db
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def start_receiver(self, fail_rate=0.0):
+        receiver = StubReceiver(("127.0.0.1", 0), fail_rate=fail_rate, seed=0)
+        threading.Thread(target=receiver.serve_forever, daemon=True).start()
+        self.addCleanup(receiver.server_close)
+        self.addCleanup(receiver.shutdown)
+        return receiver
+
+    def emit(self, count):
+        with transaction.atomic(using=self.alias):
+            return [
+                outbox.emit(OutboxEventType.PAYMENT_CREATED, self.order.id, {"n": i}) for i in range(count)
+            ]
+
+    def test_changes_write_their_event_in_the_same_transaction(self):
+        response = self.client.post(
+            "/payment/", {"order": self.order.id, "payment_method": "Visa", "payment_status": "paid"}, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+        event = self.events.get()
+        self.assertEqual(event.event_type, OutboxEventType.PAYMENT_CREATED.value)
+        self.assertEqual(event.payload["amount"], 500)
+        self.assertEqual(event.status, OutboxStatus.PENDING.value)
+
+        Coupon.objects.create(code="TEN", discount_amount="10.00", expiration_date=timezone.now() + timedelta(days=1))
+        self.client.post(f"/coupon/{self.order.id}/apply_coupon/", {"code": "NOPE"}, format="json")
+        self.assertEqual(self.events.count(), 1)
+        # the discount, and its event, follow the commit on 'default' when the order is on another shard
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f"/coupon/{self.order.id}/apply_coupon/", {"code": "TEN"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        event = self.events.latest("id")
+        self.assertEqual(event.event_type, OutboxEventType.COUPON_APPLIED.value)
+        self.assertEqual(event.payload, {"coupon": "TEN", "discount_amount": "10.00", "total_amount": 490})
+
+    def test_dispatcher_delivers_every_event_once_in_batches(self):
+        events = self.emit(5)
+        receiver = self.start_receiver()
+        with outbox.Dispatcher([receiver.url], batch_size=2, concurrency=2) as dispatcher:
+            self.assertEqual(dispatcher.drain(), (5, 0))
+            self.assertEqual(dispatcher.run_once(), (0, 0))
+
+        self.assertEqual(sorted(event["id"] for event in receiver.events), [event.id for event in events])
+        self.assertEqual(receiver.events[0]["order"], self.order.id)
+        self.assertFalse(self.events.exclude(status=OutboxStatus.DELIVERED.value).exists())
+
+    @override_settings(OUTBOX_MAX_ATTEMPTS=2)
+    def test_failed_deliveries_back_off_then_give_up(self):
+        self.emit(3)
+        receiver = self.start_receiver(fail_rate=1.0)
+        with outbox.Dispatcher([receiver.url]) as dispatcher:
+            self.assertEqual(dispatcher.run_once(), (0, 3))
+            # not due again until the backoff has passed
+            self.assertEqual(dispatcher.run_once(), (0, 0))
+            for event in self.events.all():
+                self.assertEqual(event.attempts, 1)
+                self.assertIn("HTTP 503", event.last_error)
+                self.assertGreater(event.available_at, timezone.now())
+
+            self.events.update(available_at=timezone.now())
+            self.assertEqual(dispatcher.run_once(), (0, 3))
+        self.assertEqual(self.events.filter(status=OutboxStatus.FAILED.value).count(), 3)
+        self.assertEqual(receiver.events, [])
+
+    def test_claimed_events_stay_with_their_worker_until_the_lease_ends(self):
+        self.emit(3)
+        self.assertEqual(len(outbox.claim(self.alias, 10, lease=60)), 3)
+        self.assertEqual(outbox.claim(self.alias, 10, lease=60), [])
+
+        self.events.update(claimed_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(len(outbox.claim(self.alias, 2, lease=60)), 2)
+
+
+class IdempotencyTests(TestCase):
+    databases = set(aliases())
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            email="retry@example.com", password="secret-pw", first_name="Re", last_name="Try"
+        )
+        self.order = Order.objects.create(user=self.user, order_status="pending", total_amount=500)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.payload = {"order": self.order.id, "payment_method": "Visa", "payment_status": "paid"}
+
+    def pay(self, key, payload=None):
+        return self.client.post("/payment/", payload or self.payload, format="json", HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retries_replay_the_first_response(self):
+        first = self.pay("attempt-1")
+        self.assertEqual(first.status_code, 201)
+        with capture_queries() as queries:
+            retry = self.pay("attempt-1")
+        # only the key lookup, the action doesn't run again
+        self.assertEqual(len(queries), 1)
+        self.assertEqual((retry.status_code, retry.json()), (first.status_code, first.json()))
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(sharding.for_id(Payment, self.order.id).filter(order=self.order.id).count(), 1)
+
+        # another key is another request
+        self.assertEqual(self.pay("attempt-2").status_code, 201)
+        self.assertEqual(sharding.for_id(Payment, self.order.id).filter(order=self.order.id).count(), 2)
+
+    def test_an_expired_key_runs_again(self):
+        self.assertEqual(self.pay("attempt-1").status_code, 201)
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertNotIn("Idempotent-Replayed", self.pay("attempt-1"))
+        self.assertEqual(sharding.for_id(Payment, self.order.id).filter(order=self.order.id).count(), 2)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+    def test_a_key_is_bound_to_its_request_and_user(self):
+        self.pay("attempt-1")
+        response = self.pay("attempt-1", {**self.payload, "payment_method": "PayPal"})
+        self.assertEqual(response.status_code, 422)
+
+        other = CustomUser.objects.create_user(email="other@example.com", password="pw", first_name="O", last_name="T")
+        self.client.force_authenticate(other)
+        response = self.pay("attempt-1")
+        self.assertNotIn("Idempotent-Replayed", response)
+
+    def test_a_running_request_blocks_its_retries_and_a_crash_frees_the_key(self):
+        retries = []
+        with mock.patch.object(PaymentSerializer, "save", lambda serializer: retries.append(self.pay("attempt-1"))):
+            self.assertEqual(self.pay("attempt-1").status_code, 201)
+        self.assertEqual(retries[0].status_code, 409)
+
+        with mock.patch.object(PaymentSerializer, "save", side_effect=RuntimeError("payment provider down")):
+            with self.assertRaises(RuntimeError):
+                self.pay("attempt-2")
+        self.assertEqual(self.pay("attempt-2").status_code, 201)
+
+
+class CouponRedemptionTests(TestCase):
+    databases = set(aliases())
+
+    def setUp(self):
+        coupons.coupon_cache.invalidate()
+        self.users = [
+            CustomUser.objects.create_user(email=f"saver{i}@example.com", password="pw", first_name="S", last_name="Aver")
+            for i in range(3)
+        ]
+        self.orders = [
+            Order.objects.create(user=user, order_status="pending", total_amount=1000) for user in self.users
+        ]
+        self.client = APIClient()
+
+    def create_coupon(self, **fields):
+        defaults = {"code": "SALE", "discount_amount": "150.50", "expiration_date": timezone.now() + timedelta(days=1)}
+        return Coupon.objects.create(**{**defaults, **fields})
+
+    def apply(self, order, code="SALE", user=None):
+        self.client.force_authenticate(user or order.user)
+        # an order on another shard gets its discount once 'default' commits
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f"/coupon/{order.id}/apply_coupon/", {"code": code}, format="json")
+
+    def total(self, order):
+        return sharding.for_id(Order, order.id).values_list("total_amount", flat=True).get(pk=order.id)
+
+    def test_discount_is_applied_in_the_database(self):
+        self.create_coupon()
+        self.assertEqual(self.apply(self.orders[0]).status_code, 200)
+        self.assertEqual(self.apply(self.orders[0]).status_code, 200)
+        # truncated to whole units each time, like saving the total from Python did
+        self.assertEqual(self.total(self.orders[0]), 698)
+
+    def test_usage_limit_is_never_exceeded(self):
+        coupon = self.create_coupon(usage_limit=2)
+        statuses = [self.apply(order).status_code for order in self.orders]
+        self.assertEqual(statuses, [200, 200, 400])
+        coupon.refresh_from_db()
+        self.assertEqual(coupon.used_count, 2)
+        self.assertEqual(self.total(self.orders[2]), 1000)
+
+    def test_per_user_limit(self):
+        coupon = self.create_coupon(per_user_limit=1)
+        self.assertEqual(self.apply(self.orders[0]).status_code, 200)
+        response = self.apply(self.orders[0])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.apply(self.orders[1]).status_code, 200)
+        self.assertEqual(CouponUsage.objects.get(coupon=coupon, user=self.users[0]).used_count, 1)
+        # the refused use wasn't counted against the coupon either
+        coupon.refresh_from_db()
+        self.assertEqual(coupon.used_count, 2)
+
+    def test_expired_unknown_and_missing_orders(self):
+        self.create_coupon(code="OLD", expiration_date=timezone.now() - timedelta(minutes=1))
+        self.create_coupon(usage_limit=5)
+        self.assertEqual(self.apply(self.orders[0], "OLD").json(), {"Invalid Status": "Coupon has expired"})
+        self.assertEqual(self.apply(self.orders[0], "NOPE").status_code, 404)
+
+        missing = Order(pk=self.orders[0].pk + 1000, user=self.users[0])
+        self.assertEqual(self.apply(missing, user=self.users[0]).status_code, 404)
+        # the use claimed for the missing order was rolled back
+        self.assertEqual(Coupon.objects.get(code="SALE").used_count, 0)
+
+    def test_a_failed_commit_leaves_the_order_total_alone(self):
+        coupon = self.create_coupon()
+        order = self.orders[0]
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                coupons.redeem("SALE", order.id, order.user_id)
+                raise RuntimeError("commit failed")
+        coupon.refresh_from_db()
+        self.assertEqual((coupon.used_count, self.total(order)), (0, 1000))
+
+    def test_live_coupons_are_served_from_memory(self):
+        self.create_coupon()
+        coupons.coupon_cache.warm()
+        with capture_queries() as queries:
+            coupons.coupon_cache.get("SALE")
+            coupons.coupon_cache.get("NOPE")
+            coupons.coupon_cache.get("NOPE")
+        # only the first lookup of the unknown code
+        self.assertEqual(len(queries), 1)
+
+        Coupon.objects.filter(code="SALE").update(expiration_date=timezone.now())
+        coupons.coupon_cache.invalidate()
+        self.assertEqual(self.apply(self.orders[0]).status_code, 400)
+
+
+def image_upload(name="me.png", size=(300, 200), image_format="PNG"):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, "teal").save(buffer, image_format)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+class ProfilePictureTests(TestCase):
+    databases = set(aliases())
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.staff = CustomUser.objects.create_user(
+            email="staff@example.com", password="pw", first_name="St", last_name="Aff", is_staff=True
+        )
+        self.profile = Profile.objects.create(user=self.staff, contact_number="123456")
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def upload(self, picture):
+        return self.client.patch(f"/profile/{self.profile.id}/", {"profile_picture": picture}, format="multipart")
+
+    def test_uploads_schedule_thumbnails_after_commit(self):
+        with mock.patch.object(thumbnails, "get_pool") as get_pool:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.upload(image_upload())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["thumbnails"], {})
+        self.profile.refresh_from_db()
+        get_pool.return_value.submit.assert_called_once_with(
+            thumbnails._run, self.profile.id, self.profile.profile_picture.name
+        )
+
+    def test_thumbnails_are_rendered_and_exposed(self):
+        self.upload(image_upload())
+        self.profile.refresh_from_db()
+        rendered = thumbnails.process(self.profile.id, self.profile.profile_picture.name)
+        self.assertEqual(set(rendered), {"64.webp", "64.jpg", "256.webp", "256.jpg"})
+        with default_storage.open(rendered["64.webp"]) as fp, Image.open(fp) as image:
+            self.assertEqual((image.format, image.size), ("WEBP", (64, 43)))
+
+        urls = self.client.get(f"/profile/{self.profile.id}/").json()["thumbnails"]
+        self.assertEqual(urls["256.jpg"], default_storage.url(rendered["256.jpg"]))
+
+        # a picture replaced meanwhile keeps its own, not yet rendered, thumbnails
+        old = self.profile.profile_picture.name
+        self.upload(image_upload("new.png"))
+        thumbnails.process(self.profile.id, old)
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.thumbnails, {})
+
+    @override_settings(PROFILE_PICTURE_MAX_DIMENSION=250)
+    def test_format_and_dimensions_are_checked_from_the_header(self):
+        fits, too_large = image_upload(size=(250, 100)), image_upload(size=(251, 100))
+        bitmap = image_upload("me.bmp", size=(10, 10), image_format="BMP")
+        # decoding the pixels would fail the upload
+        with mock.patch.object(ImageFile.ImageFile, "load", side_effect=AssertionError("decoded")):
+            self.assertEqual(self.upload(fits).status_code, 200)
+            self.assertEqual(self.upload(too_large).status_code, 400)
+            self.assertEqual(self.upload(bitmap).status_code, 400)
+            response = self.upload(SimpleUploadedFile("me.png", b"not an image"))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["profile_picture"], ["Upload a valid image."])
+
+
+class MediaTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.content = bytes(range(256)) * 4
+        self.name = default_storage.save("profile_pics/blob.bin", SimpleUploadedFile("blob.bin", self.content))
+        self.url = default_storage.url(self.name)
+
+    def get(self, url=None, **headers):
+        response = self.client.get(url or self.url, headers=headers)
+        body = b"".join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_versioned_urls_are_cached_for_good(self):
+        response, body = self.get()
+        self.assertEqual((response.status_code, body), (200, self.content))
+        self.assertIn("immutable", response["Cache-Control"])
+
+        unversioned, _ = self.get(f"/media/{self.name}")
+        self.assertEqual(unversioned["Cache-Control"], "no-cache")
+        response, _ = self.get(f"/media/{self.name}", if_none_match=unversioned["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+        # new content, new URL
+        with default_storage.open(self.name, "wb") as fp:
+            fp.write(b"changed")
+        self.assertNotEqual(default_storage.url(self.name), self.url)
+
+    def test_range_requests(self):
+        response, body = self.get(range="bytes=10-19")
+        self.assertEqual((response.status_code, body), (206, self.content[10:20]))
+        self.assertEqual(response["Content-Range"], f"bytes 10-19/{len(self.content)}")
+        response, body = self.get(range="bytes=-5")
+        self.assertEqual(body, self.content[-5:])
+        response, body = self.get(range="bytes=1000-")
+        self.assertEqual(body, self.content[1000:])
+
+        self.assertEqual(self.get(range="bytes=5000-")[0].status_code, 416)
+        # a stale If-Range gets the whole, current file
+        response, body = self.get(range="bytes=0-9", if_range='"stale"')
+        self.assertEqual((response.status_code, body), (200, self.content))
+
+    def test_private_files_are_for_staff_only(self):
+        name = default_storage.save("imports/feed.csv", SimpleUploadedFile("feed.csv", b"sku,price\n"))
+        self.assertEqual(self.get(f"/media/{name}")[0].status_code, 404)
+        self.assertEqual(self.get("/media/../settings.py")[0].status_code, 404)
+        # a public prefix followed by .. is still the private file
+        self.assertEqual(self.get(f"/media/profile_pics/%2e%2e/{name}")[0].status_code, 404)
+        self.assertEqual(self.get(f"/media/profile_pics/../{name}")[0].status_code, 404)
+
+        staff = CustomUser.objects.create_user(
+            email="staff@example.com", password="pw", first_name="St", last_name="Aff", is_staff=True
+        )
+        self.client.force_login(staff)
+        response, body = self.get(f"/media/{name}")
+        self.assertEqual((response.status_code, body), (200, b"sku,price\n"))
+        self.assertIn("private", response["Cache-Control"])
+
+    @override_settings(MEDIA_SENDFILE="x-accel-redirect")
+    def test_the_front_server_can_send_the_file(self):
+        response, body = self.get()
+        self.assertEqual((response.status_code, body), (200, b""))
+        self.assertEqual(response["X-Accel-Redirect"], f"/protected-media/{self.name}")
+
+
+class WishlistTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            email="wisher@example.com", password="pw", first_name="Wi", last_name="Sher"
+        )
+        category = Category.objects.create(name="hats")
+        self.products = [Product.objects.create(name=f"hat {i}", price=10, category=category) for i in range(4)]
+        self.ids = [product.id for product in self.products]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def change(self, action, ids):
+        return self.client.post(f"/wishlist/{action}/", {"products": ids}, format="json")
+
+    def contains(self, ids):
+        return self.client.get(f"/wishlist/contains/?ids={','.join(map(str, ids))}").json()["wishlisted"]
+
+    def test_bulk_add_and_remove(self):
+        missing = self.ids[-1] + 100
+        response = self.change("add", [self.ids[2], self.ids[0], self.ids[2], missing])
+        self.assertEqual(response.json(), {"products": [self.ids[0], self.ids[2]], "missing": [missing]})
+        # adding again is a no-op, not an error
+        self.assertEqual(self.change("add", [self.ids[0], self.ids[1]]).json()["products"], self.ids[:3])
+        self.assertEqual(self.change("remove", [self.ids[0], missing]).json()["products"], self.ids[1:3])
+        self.assertEqual(self.client.get("/wishlist/").json(), {"products": self.ids[1:3]})
+        self.assertEqual(self.change("add", []).status_code, 400)
+
+    def test_membership_is_answered_from_the_cached_set(self):
+        self.change("add", [self.ids[1], self.ids[3]])
+        with capture_queries() as queries:
+            self.assertEqual(self.contains(reversed(self.ids)), [self.ids[3], self.ids[1]])
+        self.assertEqual(len(queries), 0)
+
+        # other users have their own set
+        other = CustomUser.objects.create_user(email="other@example.com", password="pw", first_name="O", last_name="T")
+        self.client.force_authenticate(other)
+        self.assertEqual(self.contains(self.ids), [])
+
+    def test_changes_made_elsewhere_drop_the_cached_set(self):
+        self.change("add", [self.ids[0]])
+        user_wishlist = Wishlist.objects.get(user=self.user)
+        user_wishlist.products.add(self.products[1])
+        self.assertEqual(self.contains(self.ids), self.ids[:2])
+        self.products[0].wishlist_set.clear()
+        self.assertEqual(self.contains(self.ids), self.ids[1:2])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[1].delete()
+        self.assertEqual(self.contains(self.ids), [])
+        user_wishlist.delete()
+        self.assertEqual(wishlist.product_ids(self.user.id), set())
+
+
+class SweeperTests(TestCase):
+    def setUp(self):
+        self.users = [
+            CustomUser.objects.create_user(email=f"idle{i}@example.com", password="pw", first_name="I", last_name="Dle")
+            for i in range(6)
+        ]
+        category = Category.objects.create(name="socks")
+        product = Product.objects.create(name="sock", price=5, category=category)
+        self.variant = ProductVariant.objects.create(
+            product=product, variant_name="size", variant_value="M", price=5, stock_count=10
+        )
+        self.carts = [Cart.objects.create(user=user) for user in self.users]
+        for cart in self.carts:
+            CartItem.objects.create(cart=cart, product_variant=self.variant, quantity=1, price_at_time=5)
+        # every other cart was last used two months ago
+        self.idle = self.carts[::2]
+        Cart.objects.filter(pk__in=[cart.pk for cart in self.idle]).update(
+            updates_at=date.today() - timedelta(days=60)
+        )
+
+    def test_idle_carts_are_deleted_in_chunks(self):
+        chunks = []
+        deleted = sweeper.run_sweep(
+            sweeper.SWEEPS["carts"], chunk_size=2, pause=0, progress=lambda *args: chunks.append(args)
+        )
+        self.assertEqual(deleted, 3)
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(chunks[-1], (self.carts[-1].pk, self.carts[-1].pk, 3))
+        self.assertEqual(set(Cart.objects.values_list("pk", flat=True)), {cart.pk for cart in self.carts[1::2]})
+        self.assertEqual(CartItem.objects.count(), 3)
+
+    def test_using_a_cart_keeps_it(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+        payload = {"items": [{"product_variant": self.variant.pk, "quantity": 1, "price_at_time": 0}]}
+        self.assertEqual(self.client.patch(f"/cart/{self.carts[0].pk}/", payload, format="json").status_code, 200)
+        self.assertEqual(sweeper.run_sweep(sweeper.SWEEPS["carts"], pause=0, dry_run=True), 2)
+
+    def test_expired_coupons_and_tokens(self):
+        now = timezone.now()
+        old = Coupon.objects.create(code="OLD", discount_amount="1.00", expiration_date=now - timedelta(days=90))
+        CouponUsage.objects.create(coupon=old, user=self.users[0], used_count=1)
+        Coupon.objects.create(code="RECENT", discount_amount="1.00", expiration_date=now - timedelta(days=1))
+        expired = RefreshToken.for_user(self.users[0])
+        expired.blacklist()
+        OutstandingToken.objects.filter(jti=expired["jti"]).update(expires_at=now - timedelta(days=1))
+        RefreshToken.for_user(self.users[1]).blacklist()
+
+        out = io.StringIO()
+        call_command("sweep", "coupons", "tokens", "--pause", "0", stdout=out)
+        self.assertIn("coupons: 1 deleted", out.getvalue())
+        self.assertIn("tokens: 1 deleted", out.getvalue())
+        self.assertEqual(list(Coupon.objects.values_list("code", flat=True)), ["RECENT"])
+        self.assertFalse(CouponUsage.objects.exists())
+        self.assertEqual(OutstandingToken.objects.count(), 1)
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
+
+
+class ArchiveTests(TestCase):
+    databases = set(aliases())
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            email="curator@example.com", password="pw", first_name="Cu", last_name="Rator"
+        )
+        self.category = Category.objects.create(name="lamps")
+        self.live = Product.objects.create(name="desk lamp", sku="LAMP-1", price=30, category=self.category)
+        self.retired = Product.objects.create(
+            name="lava lamp", sku="LAMP-2", price=40, category=self.category, is_active=False
+        )
+        Product.objects.filter(pk=self.retired.pk).update(created_at=date(2020, 1, 1))
+        self.variants = [
+            ProductVariant.objects.create(product=self.retired, variant_name=name, variant_value="low", price=40)
+            for name in ("red", "blue")
+        ]
+        self.review = Review.objects.create(product=self.retired, user=self.user, rating=5, comment="groovy")
+        Wishlist.objects.create(user=self.user).products.add(self.retired, self.live)
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product_variant=self.variants[0], quantity=1, price_at_time=40)
+        order = Order.objects.create(user=self.user, order_status="pending", total_amount=40)
+        self.order_item = OrderItem.objects.create(order=order, product_variant=self.variants[0], quantity=1, price=40)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_inactive_products_leave_the_hot_tables(self):
+        self.assertEqual(wishlist.product_ids(self.user.id), {self.live.pk, self.retired.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(archive.archive_inactive(batch_size=1), 1)
+
+        self.assertEqual(list(Product.objects.values_list("pk", flat=True)), [self.live.pk])
+        self.assertFalse(ProductVariant.objects.exists())
+        self.assertFalse(Review.objects.exists())
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(wishlist.product_ids(self.user.id), {self.live.pk})
+        archived = ArchivedProduct.objects.get()
+        self.assertEqual((archived.pk, archived.variants.count()), (self.retired.pk, 2))
+        # order history keeps pointing at the archived variant
+        self.assertTrue(sharding.for_id(OrderItem, self.order_item.order_id).filter(pk=self.order_item.pk).exists())
+
+        self.assertEqual(self.client.get("/product/").json()["count"], 1)
+        rows = self.client.get("/product/with-archived/").json()["results"]
+        self.assertEqual(
+            [(row["id"], row["archived"]) for row in rows], [(self.live.pk, False), (self.retired.pk, True)]
+        )
+
+    def test_restore_puts_everything_back(self):
+        archive.archive_inactive()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(archive.restore([self.retired.pk]), 1)
+
+        product = Product.objects.get(pk=self.retired.pk)
+        self.assertTrue(product.is_active)
+        self.assertEqual(product.created_at, date(2020, 1, 1))
+        self.assertEqual(
+            set(ProductVariant.objects.filter(product=product).values_list("pk", flat=True)),
+            {variant.pk for variant in self.variants},
+        )
+        review = Review.objects.get()
+        self.assertEqual((review.pk, review.created_at), (self.review.pk, self.review.created_at))
+        self.assertEqual(wishlist.product_ids(self.user.id), {self.live.pk, self.retired.pk})
+        self.assertFalse(ArchivedProduct.objects.exists())
+        self.assertFalse(ArchivedProductVariant.objects.exists())
+
+    def test_importing_an_archived_sku_reactivates_it(self):
+        archive.archive_inactive()
+        job = ImportJob.objects.create(kind="products", source="imports/feed.csv")
+        CatalogImporter(job).run(io.StringIO("sku,name,price,category\nLAMP-2,lava lamp II,45,lamps\n"), "csv")
+
+        product = Product.objects.get(sku="LAMP-2")
+        self.assertEqual((product.pk, product.name, product.is_active), (self.retired.pk, "lava lamp II", True))
+        self.assertEqual(ProductVariant.objects.filter(product=product).count(), 2)
+
+    def test_rejected_or_failed_rows_leave_the_product_archived(self):
+        archive.archive_inactive()
+        job = ImportJob.objects.create(kind="products", source="imports/feed.csv")
+        CatalogImporter(job).run(io.StringIO("sku,name,price,category\nLAMP-2,lava lamp II,cheap,lamps\n"), "csv")
+        self.assertEqual(job.error_count, 1)
+        self.assertTrue(ArchivedProduct.objects.filter(pk=self.retired.pk).exists())
+
+        job = ImportJob.objects.create(kind="products", source="imports/feed.csv")
+        with mock.patch.object(ImportRowError.objects, "bulk_create", side_effect=RuntimeError("disk full")):
+            with self.assertRaises(RuntimeError):
+                CatalogImporter(job).run(io.StringIO("sku,name,price,category\nLAMP-2,lava lamp II,45,lamps\n"), "csv")
+        self.assertTrue(ArchivedProduct.objects.filter(pk=self.retired.pk).exists())
+        self.assertFalse(Product.objects.filter(sku="LAMP-2").exists())
+
+    def test_products_whose_sku_was_taken_stay_archived(self):
+        archive.archive_inactive()
+        Product.objects.create(sku="LAMP-2", name="new lamp", price=10, category=self.category)
+        out, err = io.StringIO(), io.StringIO()
+        call_command("archive_products", "--restore", str(self.retired.pk), stdout=out, stderr=err)
+
+        self.assertEqual(out.getvalue().strip(), "0 restored")
+        self.assertIn(str(self.retired.pk), err.getvalue())
+        self.assertTrue(ArchivedProduct.objects.filter(pk=self.retired.pk).exists())
+        # the import updates the live product instead
+        job = ImportJob.objects.create(kind="products", source="imports/feed.csv")
+        CatalogImporter(job).run(io.StringIO("sku,name,price,category\nLAMP-2,lava lamp II,45,lamps\n"), "csv")
+        self.assertEqual(Product.objects.get(sku="LAMP-2").name, "lava lamp II")
+        self.assertTrue(ArchivedProduct.objects.filter(pk=self.retired.pk).exists())
+
+    def test_updating_an_archived_product_to_active_restores_it(self):
+        archive.archive_inactive()
+        self.user.is_staff = True
+        self.user.save()
+        url = f"/product/{self.retired.pk}/"
+        self.assertEqual(self.client.patch(url, {"price": 50}, format="json").status_code, 404)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(url, {"is_active": True, "price": 50}, format="json")
+        self.assertEqual(response.status_code, 200)
+        product = Product.objects.get(pk=self.retired.pk)
+        self.assertEqual((product.is_active, product.price), (True, 50))
+        self.assertFalse(ArchivedProduct.objects.exists())
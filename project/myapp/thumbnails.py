@@ -0,0 +1,105 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from myapp.models import Profile
+
+
+# Profile picture thumbnails, THUMBNAIL_SIZES x THUMBNAIL_FORMATS, written
+# next to the upload by a pool of THUMBNAIL_WORKERS threads once the upload
+# is committed, so the request only pays for storing the original.
+# Profile.thumbnails maps "<size>.<ext>" to the stored name; it is empty
+# until the worker is done.
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {"WEBP": "webp", "JPEG": "jpg"}
+SAVE_OPTIONS = {"WEBP": {"quality": 80, "method": 4}, "JPEG": {"quality": 85, "optimize": True, "progressive": True}}
+
+_pool = None
+_pool_lock = threading.Lock()
+_pending = set()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=settings.THUMBNAIL_WORKERS, thread_name_prefix="thumbnails")
+        return _pool
+
+
+def thumbnail_name(name, size, image_format):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return f"{os.path.dirname(name)}/thumbs/{stem}-{size}.{EXTENSIONS[image_format]}"
+
+
+def render(name, storage=default_storage):
+    """Write every thumbnail of the stored image `name`, returning the thumbnails mapping."""
+    largest = max(settings.THUMBNAIL_SIZES)
+    with storage.open(name, "rb") as fp, Image.open(fp) as image:
+        # lets JPEG decode straight at a fraction of the size, much less work
+        image.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            alpha = image.mode in ("LA", "PA") or "transparency" in image.info
+            image = image.convert("RGBA" if alpha else "RGB")
+
+        thumbnails = {}
+        for size in sorted(settings.THUMBNAIL_SIZES, reverse=True):
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            for image_format in settings.THUMBNAIL_FORMATS:
+                frame = image.convert("RGB") if image_format == "JPEG" and image.mode != "RGB" else image
+                buffer = io.BytesIO()
+                frame.save(buffer, image_format, **SAVE_OPTIONS.get(image_format, {}))
+                target = thumbnail_name(name, size, image_format)
+                if storage.exists(target):
+                    storage.delete(target)
+                thumbnails[f"{size}.{EXTENSIONS[image_format]}"] = storage.save(target, ContentFile(buffer.getvalue()))
+    return thumbnails
+
+
+def process(profile_id, name):
+    """Render the thumbnails of `name` and record them, unless the picture changed meanwhile."""
+    thumbnails = render(name)
+    Profile.objects.filter(pk=profile_id, profile_picture=name).update(thumbnails=thumbnails)
+    return thumbnails
+
+
+def _run(profile_id, name):
+    close_old_connections()
+    try:
+        return process(profile_id, name)
+    except Exception:
+        logger.exception("Thumbnails of profile %s (%s) failed", profile_id, name)
+        raise
+    finally:
+        close_old_connections()
+
+
+def schedule(profile):
+    """Render `profile`'s thumbnails in the pool once the current transaction commits."""
+    if not profile.profile_picture:
+        return
+    profile_id, name = profile.pk, profile.profile_picture.name
+
+    def submit():
+        future = get_pool().submit(_run, profile_id, name)
+        _pending.add(future)
+        future.add_done_callback(_pending.discard)
+
+    transaction.on_commit(submit)
+
+
+def wait():
+    """Block until every scheduled thumbnail job has finished."""
+    for future in list(_pending):
+        future.exception()
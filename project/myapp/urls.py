@@ -3,7 +3,7 @@ from rest_framework import routers
 from rest_framework_simplejwt.views import (TokenObtainPairView,
                                             TokenRefreshView)
 
-from myapp import views
+from myapp import async_views, views
 
 router = routers.DefaultRouter()
 router.register(r'profile', viewset=views.ProfileView, basename='profile')
@@ -17,6 +17,8 @@ router.register(r'cart', viewset=views.CartAPI, basename='cart')
 router.register(r'payment', viewset=views.PaymentAPIView, basename='payment')
 router.register(r'shippingaddress', viewset=views.ShippingAddressAPIView, basename='shipping_address')
 router.register(r'coupon', viewset=views.CouponAPIView, basename='coupon')
+router.register(r'wishlist', viewset=views.WishlistAPIView, basename='wishlist')
+router.register(r'import', viewset=views.CatalogImportAPIView, basename='import')
 
 
 urlpatterns = [
@@ -25,4 +27,13 @@ urlpatterns = [
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('logout/', views.LogoutView.as_view(), name='auth_logout'),
-]
\ No newline at end of file
+    path('reports/<str:name>/', views.ReportAPIView.as_view(), name='report'),
+
+    # async twins of the catalog reads (myapp/async_views.py), for ASGI workers
+    path('async/product/', async_views.product_list, name='async_product-list'),
+    path('async/product/<int:pk>/', async_views.product_retrieve, name='async_product-detail'),
+    path('async/product/category/<int:categoryname>/', async_views.product_list, name='async_product-category'),
+    path('async/productvariant/', async_views.variant_list, name='async_product_variant-list'),
+    path('async/productvariant/product/<int:product>/', async_views.variant_list, name='async_product_variant-product'),
+    path('async/category/hierarchy/', async_views.category_hierarchy, name='async_category-hierarchy'),
+]
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.validators import ValidationError
+from PIL import Image, UnidentifiedImageError
+
+
+def validate_image_header(image):
+    """Checks the format and dimensions from the image header, without decoding the pixels."""
+    position = image.tell()
+    try:
+        image.seek(0)
+        with Image.open(image) as header:
+            image_format, (width, height) = header.format, header.size
+    except (UnidentifiedImageError, OSError):
+        raise ValidationError("Upload a valid image.")
+    finally:
+        image.seek(position)
+
+    if image_format not in settings.PROFILE_PICTURE_FORMATS:
+        raise ValidationError(f"Image format must be one of {', '.join(settings.PROFILE_PICTURE_FORMATS)}.")
+    limit = settings.PROFILE_PICTURE_MAX_DIMENSION
+    if width > limit or height > limit:
+        raise ValidationError(f"Image must be at most {limit}x{limit} pixels.")
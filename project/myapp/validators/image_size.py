@@ -3,7 +3,7 @@ from django.core.validators import ValidationError
 
 
 def validate_image(image): # custom validator
-    file_size = image.file.size
+    file_size = image.size
     limit_mb = 5
     if file_size> limit_mb*1024*1024:
         raise ValidationError(f"Maximum Image size is{limit_mb}mb.")
\ No newline at end of file
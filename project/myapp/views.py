@@ -1,13 +1,28 @@
+from collections import defaultdict
 from rest_framework import generics, status, viewsets
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.decorators import action
 from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.serializers import BooleanField
 from .permissions import ModifiedAdminPermission
 import django_filters
-from django.db.models import Count
+import logging
+from django.db import connections, router
+from django.db.models import Avg, Count, Prefetch, Q
+from django.core.cache import cache
+from django.http import Http404, HttpResponse
+from datetime import date
+from django.conf import settings
+from django.utils import timezone
+from myapp import archive, bulk, coupons, exports, imports, reports, sharding, wishlist
+from myapp.fastpath import FastListMixin
+from myapp.idempotency import IdempotencyMixin
+from myapp.sparse import SparseFieldsViewMixin
+from myapp.cache import catalog_key
+from myapp.enum import ImportStatus
 
 
 from myapp.models import (
@@ -25,6 +40,7 @@ from myapp.models import (
     Product,
     ProductVariant,
     Category,
+    ImportJob,
 )
 
 from myapp.serializers import (
@@ -37,10 +53,17 @@ from myapp.serializers import (
     CategoryTreeSerializer,
     PaymentSerializer,
     AddressSerializer,
-    CouponSerializer
+    CouponSerializer,
+    ImportJobSerializer,
+    BulkUpdateSerializer,
+    WishlistChangeSerializer,
+    ProductDetailSerializer,
 )
 
 
+logger = logging.getLogger(__name__)
+
+
 class UserRegistrationView(generics.CreateAPIView):
     serializer_class = UserRegisterSerializer
     permission_classes = [AllowAny]
@@ -69,21 +92,125 @@ class ProfileView(viewsets.ModelViewSet):
         return self.queryset.filter(user=self.request.user.id)
 
 
-class CategoryAPIView(viewsets.ModelViewSet):
+class CategoryAPIView(SparseFieldsViewMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
 
     @action(detail=False, methods=['get'], url_path='hierarchy')
     def hierarchy(self, request):
+        # Load the whole tree at once and group it by parent
+        children = defaultdict(list)
+        for category in Category.objects.only("id", "name", "parent").order_by("id"):
+            children[category.parent_id].append(category)
+
         # Only top-level categories
-        queryset = Category.objects.filter(parent=None)
-        serializer = CategoryTreeSerializer(queryset, many=True)
+        serializer = CategoryTreeSerializer(children[None], many=True, context={"children": children})
         return Response(serializer.data)
 
 
 
-class ProductAPIView(viewsets.ModelViewSet):
+class ExportMixin:
+    # Streams every filtered row as NDJSON/CSV without building model instances.
+    export_fields = ()
+    updated_since_field = None
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request, *args, **kwargs):
+        fmt = request.query_params.get("export_format", "ndjson")
+        if fmt not in exports.EXPORT_FORMATS:
+            return Response({"detail": "Invalid export format"}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.filter_queryset(self.get_queryset().order_by("pk"))
+
+        updated_since = request.query_params.get("updated_since")
+        if updated_since:
+            try:
+                updated_since = date.fromisoformat(updated_since)
+            except ValueError:
+                return Response(
+                    {"detail": "updated_since must be YYYY-MM-DD"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            queryset = queryset.filter(**{f"{self.updated_since_field}__gte": updated_since})
+
+        return exports.export_response(queryset, self.export_fields, fmt, self.basename)
+
+
+def parse_ids(ids):
+    """The ids of a ?ids=3,1,2 parameter, deduplicated, or an error Response."""
+    try:
+        ids = list(dict.fromkeys(int(pk) for pk in ids.split(",") if pk.strip()))
+    except ValueError:
+        return Response({"detail": "ids must be a comma separated list of integers"}, status=status.HTTP_400_BAD_REQUEST)
+
+    max_ids = getattr(settings, "BATCH_RETRIEVE_MAX_IDS", 100)
+    if len(ids) > max_ids:
+        return Response(
+            {"detail": f"At most {max_ids} ids can be requested at once"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    return ids
+
+
+class BatchRetrieveMixin:
+    # GET ?ids=3,1,2 returns those objects, in that order, from one in_bulk() query.
+    def list(self, request, *args, **kwargs):
+        ids = request.query_params.get("ids")
+        if ids is None:
+            return super().list(request, *args, **kwargs)
+
+        ids = parse_ids(ids)
+        if isinstance(ids, Response):
+            return ids
+
+        found = self.filter_queryset(self.get_queryset()).in_bulk(ids)
+        serializer = self.get_serializer([found[pk] for pk in ids if pk in found], many=True)
+        return Response(
+            {"results": serializer.data, "missing": [pk for pk in ids if pk not in found]},
+            status=status.HTTP_200_OK,
+        )
+
+
+class BulkUpdateMixin:
+    # Rule based price/stock changes applied as one UPDATE ... SET x = f(x).
+    bulk_update_fields = ()
+    bulk_category_lookup = "category"
+
+    def get_bulk_update_extra(self):
+        return {}
+
+    @action(detail=False, methods=['post'], url_path='bulk-update', permission_classes=[IsAdminUser])
+    def bulk_update(self, request, *args, **kwargs):
+        serializer = BulkUpdateSerializer(data=request.data, context={"fields": self.bulk_update_fields})
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        if "category" not in data and not data.get("ids"):
+            return Response(
+                {"detail": "Give a category or a list of ids to update"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        queryset = self.get_queryset()
+        if "category" in data:
+            queryset = queryset.filter(**{self.bulk_category_lookup: data["category"]})
+        if data.get("ids"):
+            queryset = queryset.filter(id__in=data["ids"])
+
+        result = bulk.apply_bulk_update(
+            queryset,
+            data["field"],
+            data["operation"],
+            data["value"],
+            floor=data.get("floor"),
+            dry_run=data["dry_run"],
+            extra=self.get_bulk_update_extra(),
+        )
+        return Response(result, status=status.HTTP_200_OK)
+
+
+class ProductAPIView(BatchRetrieveMixin, SparseFieldsViewMixin, FastListMixin, BulkUpdateMixin, ExportMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     pagination_class = LimitOffsetPagination
@@ -92,6 +219,12 @@ class ProductAPIView(viewsets.ModelViewSet):
     filterset_fields = ['name', 'is_active','category']
     ordering_fields = ['price']  
     search_fields = ['name']
+    export_fields = (
+        "id", "name", "slug", "description", "price", "discount_price",
+        "category", "inventory_count", "is_active", "created_at", "updates_at",
+    )
+    updated_since_field = "updates_at"
+    bulk_update_fields = ("price", "discount_price", "inventory_count")
 
     def get_queryset(self):
         categoryname = self.kwargs.get("categoryname", None)
@@ -100,8 +233,59 @@ class ProductAPIView(viewsets.ModelViewSet):
             return self.queryset.filter(category=categoryname)
 
         return self.queryset
+
+    def get_bulk_update_extra(self):
+        # update() skips auto_now, keep incremental exports seeing the change
+        return {"updates_at": timezone.now().date()}
+
+    def update(self, request, *args, **kwargs):
+        # an archived product is no longer in Product (myapp/archive.py); an
+        # update setting is_active moves it back first, then applies the rest
+        pk = str(kwargs.get(self.lookup_field, ""))
+        is_active = request.data.get("is_active")
+        if pk.isdigit() and isinstance(is_active, (bool, int, str)) and is_active in BooleanField.TRUE_VALUES:
+            archive.restore([int(pk)])
+        return super().update(request, *args, **kwargs)
+
+    @action(detail=True, methods=['get'], url_path='detail')
+    def full_detail(self, request, pk=None, **kwargs):
+        # product, variants, category ancestry and rating summary in 4 queries,
+        # cached as one unit until the catalog or the product's reviews change;
+        # the category route caches its own copy, it only finds that category's products
+        categoryname = self.kwargs.get("categoryname")
+        # keyed on the numeric ids the review signal invalidates, not the URL
+        # text (/product/007/detail/ is product 7)
+        try:
+            pk = int(pk)
+            categoryname = int(categoryname) if categoryname else None
+        except ValueError:
+            raise Http404
+        key = catalog_key("product-detail", pk, *([categoryname] if categoryname else []))
+        data = cache.get(key)
+        if data is None:
+            # the category comes from category_ancestry(), no join needed here
+            queryset = self.get_queryset().prefetch_related(
+                Prefetch("productvariant_set", queryset=ProductVariant.objects.order_by("id"))
+            )
+            product = generics.get_object_or_404(queryset, pk=pk)
+            data = {
+                "product": ProductDetailSerializer(product).data,
+                "category": category_ancestry(product.category_id),
+                "rating": rating_summary(product.pk),
+            }
+            cache.set(key, data, getattr(settings, "PRODUCT_DETAIL_CACHE_TIMEOUT", 300))
+
+        return Response(data)
     
 
+    @action(detail=False, methods=['get'], url_path='with-archived', permission_classes=[IsAdminUser])
+    def with_archived(self, request, **kwargs):
+        # the one product route that reads the archive tables too (myapp/archive.py)
+        categoryname = self.kwargs.get("categoryname")
+        filters = {"category": categoryname} if categoryname else {}
+        page = self.paginate_queryset(archive.all_products(**filters).order_by("id"))
+        return self.get_paginated_response(page)
+
     @action(detail=False, methods=['get'], url_path='group-by')
     def group_by_attribute(self, request):
         attribute = request.query_params.get('attribute')
@@ -120,10 +304,51 @@ class ProductAPIView(viewsets.ModelViewSet):
         return Response(grouped_data)
 
 
-class ProductVariantAPIView(viewsets.ModelViewSet):
+# deeper chains can only be a cycle in the parent links
+MAX_CATEGORY_DEPTH = 64
+
+
+def category_ancestry(category_id):
+    # walks up from category_id with one recursive query, so only the
+    # category's own ancestors are read, root first
+    connection = connections[router.db_for_read(Category)]
+    table = connection.ops.quote_name(Category._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "WITH RECURSIVE ancestry (id, parent_id, name, slug, depth) AS ("
+            f" SELECT id, parent_id, name, slug, 0 FROM {table} WHERE id = %s"
+            " UNION ALL"
+            " SELECT c.id, c.parent_id, c.name, c.slug, a.depth + 1"
+            f" FROM {table} c JOIN ancestry a ON c.id = a.parent_id WHERE a.depth < %s"
+            ") SELECT id, name, slug FROM ancestry ORDER BY depth DESC",
+            [category_id, MAX_CATEGORY_DEPTH],
+        )
+        return [{"id": pk, "name": name, "slug": slug} for pk, name, slug in cursor.fetchall()]
+
+
+def rating_summary(product_id):
+    summary = Review.objects.filter(product=product_id).aggregate(
+        count=Count("id"),
+        average=Avg("rating"),
+        **{str(rating): Count("id", filter=Q(rating=rating)) for rating in range(1, 6)},
+    )
+    average = summary.pop("average")
+    count = summary.pop("count")
+    return {
+        "count": count,
+        "average": round(average, 2) if average is not None else None,
+        "distribution": summary,
+    }
+
+
+class ProductVariantAPIView(BatchRetrieveMixin, SparseFieldsViewMixin, FastListMixin, BulkUpdateMixin, ExportMixin, viewsets.ModelViewSet):
     queryset = ProductVariant.objects.all()
     serializer_class = ProductVariantSerializer
     permission_classes = [ModifiedAdminPermission]
+    export_fields = ("id", "product", "variant_name", "variant_value", "price", "stock_count", "updates_at")
+    updated_since_field = "updates_at"
+    bulk_update_fields = ("price", "stock_count")
+    bulk_category_lookup = "product__category"
 
     def get_queryset(self):
         product = self.kwargs.get("product", None)
@@ -132,6 +357,9 @@ class ProductVariantAPIView(viewsets.ModelViewSet):
 
         return self.queryset
 
+    def get_bulk_update_extra(self):
+        return {"updates_at": timezone.now().date()}
+
 
 class CartAPI(viewsets.ModelViewSet):
     queryset = Cart.objects.all()
@@ -150,6 +378,7 @@ class CartAPI(viewsets.ModelViewSet):
         print(serializer)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        cart.touch()
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=["patch"])
@@ -166,6 +395,7 @@ class CartAPI(viewsets.ModelViewSet):
             quantity = request.data["quantity"]
             item.quantity = quantity
             item.save()
+            cart.touch()
 
         except Exception:
             return Response(
@@ -183,6 +413,7 @@ class CartAPI(viewsets.ModelViewSet):
 
         try:
             CartItem.objects.get(cart=cart, id=pk).delete()
+            cart.touch()
 
         except Exception:
             return Response(
@@ -194,12 +425,37 @@ class CartAPI(viewsets.ModelViewSet):
         )
 
 
-class PaymentAPIView(viewsets.ModelViewSet):
+class PaymentFilter(django_filters.FilterSet):
+    # a plain id, the default choice filter would look the order up on 'default'
+    order = django_filters.NumberFilter(field_name="order_id")
+
+    class Meta:
+        model = Payment
+        fields = ["order"]
+
+
+class PaymentAPIView(IdempotencyMixin, viewsets.ModelViewSet):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
-    filterset_fields = ['order']
+    filterset_class = PaymentFilter
     ordering_fields = ['amount']  
 
+    def get_queryset(self):
+        # Access control: a non-staff user lists only their own payments,
+        # read from their own shard. Before the payments were sharded every
+        # authenticated user listed everyone's; staff still do (filter_queryset).
+        user = self.request.user
+        if user.is_staff:
+            return self.queryset.all()
+        return sharding.for_user(Payment, user.id).filter(order__user=user.id)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.request.user.is_staff:
+            # staff see every shard, filtered on each and merged
+            return sharding.fan_out(queryset)
+        return queryset
+
     def create(self, request):
         serializer = PaymentSerializer(data=self.request.data)
         print(serializer)
@@ -212,22 +468,22 @@ class PaymentAPIView(viewsets.ModelViewSet):
 
     def retrieve(self, request, pk=None):
         try:
-            order = Order.objects.get(id=pk)
+            order = sharding.for_id(Order, pk).get(id=pk)
         except:
             return Response(
                 {"detail": "Order not found"}, status=status.HTTP_404_NOT_FOUND
             )
         try:
-            payment_info = Payment.objects.get(order=order)
+            payment_info = order.payment_set.get()
         except:
             return Response(
                 {"detail": "Payment info not found"}, status=status.HTTP_404_NOT_FOUND
             )
 
-        return Response(payment_info, status=status.HTTP_200_OK)
+        return Response(PaymentSerializer(payment_info).data, status=status.HTTP_200_OK)
 
 
-class ShippingAddressAPIView(viewsets.ModelViewSet):
+class ShippingAddressAPIView(SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = ShippingAddress.objects.all()
     serializer_class = AddressSerializer
 
@@ -239,44 +495,119 @@ class ShippingAddressAPIView(viewsets.ModelViewSet):
                 {"detail": "Address not found"}, status=status.HTTP_404_NOT_FOUND
             )
         
-        serializer = AddressSerializer(address, many=True)
+        address = self.filter_queryset(address)
+        serializer = AddressSerializer(address, many=True, context=self.get_serializer_context())
 
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
-class CouponAPIView(viewsets.ModelViewSet):
+class CouponAPIView(IdempotencyMixin, viewsets.ModelViewSet):
     queryset = Coupon.objects.all()
     serializer_class = CouponSerializer
+    idempotent_actions = ("create", "apply_coupon")
 
     @action(detail=True,methods=["post"])
     def apply_coupon(self, request, pk=None):
 
-        code = request.data["code"]
+        try:
+            coupons.redeem(request.data.get("code"), pk, request.user.id)
+        except coupons.RedemptionError as exc:
+            return Response(exc.data, status=exc.status_code)
+
+        return Response(
+            {"detail": "Coupon Successfully applied"}, status=status.HTTP_200_OK)
+
+
+class WishlistAPIView(viewsets.ViewSet):
+    # The current user's wishlist, as product ids. Reads come from the cached
+    # id set in myapp/wishlist.py, changes are one INSERT or DELETE each.
+
+    def list(self, request):
+        return Response({"products": sorted(wishlist.product_ids(request.user.id))}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["post"])
+    def add(self, request):
+        serializer = WishlistChangeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        missing = wishlist.add(request.user.id, serializer.validated_data["products"])
+        return Response(
+            {"products": sorted(wishlist.product_ids(request.user.id)), "missing": missing},
+            status=status.HTTP_200_OK,
+        )
+
+    @action(detail=False, methods=["post"])
+    def remove(self, request):
+        serializer = WishlistChangeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        wishlist.remove(request.user.id, serializer.validated_data["products"])
+        return Response({"products": sorted(wishlist.product_ids(request.user.id))}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["get"])
+    def contains(self, request):
+        # GET ?ids=3,1,2 -> which of them are wishlisted, for the hearts on a list page
+        ids = parse_ids(request.query_params.get("ids", ""))
+        if isinstance(ids, Response):
+            return ids
+        return Response({"wishlisted": wishlist.wishlisted(request.user.id, ids)}, status=status.HTTP_200_OK)
+
+
+class ReportAPIView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, name):
+        if name not in reports.REPORTS:
+            return Response({"detail": "Invalid report"}, status=status.HTTP_404_NOT_FOUND)
 
         try:
-            order = Order.objects.get(id = pk)
-            print(order)
-        except Exception:
+            start = request.query_params.get("start")
+            end = request.query_params.get("end")
+            start = date.fromisoformat(start) if start else None
+            end = date.fromisoformat(end) if end else None
+        except ValueError:
             return Response(
-                {"detail": "Order not found"}, status=status.HTTP_404_NOT_FOUND
+                {"detail": "start/end must be YYYY-MM-DD"},
+                status=status.HTTP_400_BAD_REQUEST,
             )
 
+        report = reports.build_report(name, start=start, end=end)
+        response = HttpResponse(content_type="text/csv")
+        response["Content-Disposition"] = f'attachment; filename="{name}.csv"'
+        reports.write_csv(report, response, key_name=name)
+        return response
+
+
+class CatalogImportAPIView(viewsets.ReadOnlyModelViewSet):
+    queryset = ImportJob.objects.all().order_by("-id")
+    serializer_class = ImportJobSerializer
+    permission_classes = [IsAdminUser]
+
+    def create(self, request):
+        serializer = ImportJobSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job = serializer.save()
+        return self._run(job, status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=["post"])
+    def resume(self, request, pk=None):
+        job = self.get_object()
+        if job.status == ImportStatus.COMPLETED.value:
+            return Response({"detail": "Import already completed"}, status=status.HTTP_400_BAD_REQUEST)
+        return self._run(job, status.HTTP_200_OK)
+
+    @action(detail=True, methods=["get"])
+    def errors(self, request, pk=None):
+        job = self.get_object()
+        response = HttpResponse(content_type="text/csv")
+        response["Content-Disposition"] = f'attachment; filename="import-{job.id}-errors.csv"'
+        imports.write_error_report(job, response)
+        return response
+
+    def _run(self, job, success_status):
         try:
-            coupon = Coupon.objects.get(code = code)
-            print(coupon)
+            imports.run_import(job)
         except Exception:
-            return Response(
-                {"detail": "Coupon not found"}, status=status.HTTP_404_NOT_FOUND
-            )
-        
-        if not coupon.is_active:
-            return Response(
-                {"Invalid Status": "Coupon has expired"},
-                status=status.HTTP_400_BAD_REQUEST)
-        
-        discount = coupon.discount_amount
-        order.total_amount -= discount 
-        order.save()
-
-        return Response(
-            {"detail": "Coupon Successfully applied"}, status=status.HTTP_200_OK)
\ No newline at end of file
+            logger.exception("Import %s failed", job.pk)
+            # progress up to the last committed batch is kept, see resume
+            job.refresh_from_db()
+            return Response(ImportJobSerializer(job).data, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response(ImportJobSerializer(job).data, status=success_status)
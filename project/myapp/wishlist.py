@@ -0,0 +1,104 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router, transaction
+from django.db.models.signals import m2m_changed, post_delete, pre_delete
+from django.dispatch import receiver
+
+from myapp.models import Product, Wishlist, archiving
+
+
+# A user's wishlisted product ids are cached as one set, so a list page can
+# mark all its tiles from a single cache read. add() and remove() store the
+# new set right after the change; changes made any other way (the admin,
+# wishlist.products.add(), deleting a product) drop it and the next read
+# loads it in one query. With a per-process cache other workers only see a
+# change once their copy expires, so WISHLIST_CACHE_TTL is kept short.
+
+WishlistItem = Wishlist.products.through
+
+
+def cache_key(user_id):
+    return f"wishlist:{user_id}"
+
+
+def load(user_id, using=None):
+    items = WishlistItem.objects.using(using) if using else WishlistItem.objects
+    ids = set(items.filter(wishlist__user=user_id).values_list("product_id", flat=True))
+    cache.set(cache_key(user_id), ids, settings.WISHLIST_CACHE_TTL)
+    return ids
+
+
+def reload(user_id):
+    # from the database just written to, a read replica may not have the change yet
+    load(user_id, using=router.db_for_write(WishlistItem))
+
+
+def product_ids(user_id):
+    """The ids of every product `user_id` wishlisted."""
+    ids = cache.get(cache_key(user_id))
+    return load(user_id) if ids is None else ids
+
+
+def wishlisted(user_id, ids):
+    """The ones among `ids` that `user_id` wishlisted, in the order given."""
+    saved = product_ids(user_id)
+    return [pk for pk in ids if pk in saved]
+
+
+def add(user_id, ids):
+    """Wishlist the products `ids` in one INSERT; returns the ids that don't exist."""
+    found = set(Product.objects.filter(pk__in=ids).values_list("pk", flat=True))
+    if found:
+        with transaction.atomic():
+            wishlist = Wishlist.objects.filter(user=user_id).order_by("id").first()
+            if wishlist is None:
+                wishlist = Wishlist.objects.create(user_id=user_id)
+            # already wishlisted products hit the (wishlist, product) unique constraint and are skipped
+            WishlistItem.objects.bulk_create(
+                [WishlistItem(wishlist=wishlist, product_id=pk) for pk in found], ignore_conflicts=True
+            )
+        reload(user_id)
+    return [pk for pk in ids if pk not in found]
+
+
+def remove(user_id, ids):
+    """Take the products `ids` off the wishlist in one DELETE."""
+    WishlistItem.objects.filter(wishlist__user=user_id, product_id__in=ids).delete()
+    reload(user_id)
+
+
+def forget(user_id):
+    cache.delete(cache_key(user_id))
+
+
+@receiver(m2m_changed, sender=WishlistItem)
+def invalidate_wishlist_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith("post_"):
+            forget(instance.user_id)
+        return
+    # product.wishlist_set changes, the wishlists of any number of users
+    if action == "pre_clear":
+        wishlists = Wishlist.objects.filter(products=instance)
+    elif action in ("post_add", "post_remove"):
+        wishlists = Wishlist.objects.filter(pk__in=pk_set)
+    else:
+        return
+    for user_id in wishlists.values_list("user", flat=True).distinct():
+        forget(user_id)
+
+
+@receiver(post_delete, sender=Wishlist)
+def forget_deleted_wishlist(sender, instance, **kwargs):
+    forget(instance.user_id)
+
+
+@receiver(pre_delete, sender=Product)
+def forget_deleted_product(sender, instance, using, **kwargs):
+    if archiving.get():
+        return
+    # the cascade deletes its wishlist rows without m2m_changed; look up whose
+    # they are while they still exist, forget the sets once they are gone
+    users = set(WishlistItem.objects.using(using).filter(product=instance).values_list("wishlist__user", flat=True))
+    if users:
+        transaction.on_commit(lambda: cache.delete_many([cache_key(user_id) for user_id in users]), using=using)
@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
 
 application = get_asgi_application()
+
+from myapp.coupons import warm_coupon_cache  # noqa: E402
+
+warm_coupon_cache()
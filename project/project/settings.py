@@ -32,6 +32,36 @@ ALLOWED_HOSTS = []
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Media is served by myapp/media.py, which checks access and then lets the
+# front server send the file when MEDIA_SENDFILE is 'x-accel-redirect' (nginx,
+# with an internal location at MEDIA_ACCEL_REDIRECT_PREFIX aliased to
+# MEDIA_ROOT) or 'x-sendfile' (Apache mod_xsendfile, lighttpd). Without it
+# Django streams the file, with Range support. Paths under
+# MEDIA_PUBLIC_PREFIXES are served to everyone, the rest to staff only.
+# Media URLs carry a content hash, so they are cached for MEDIA_CACHE_MAX_AGE.
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE') or None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+MEDIA_PUBLIC_PREFIXES = ('profile_pics/',)
+MEDIA_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+STORAGES = {
+    'default': {'BACKEND': 'myapp.media.HashedMediaStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+# Uploads are streamed to a temporary file in chunks, never held in memory;
+# saving to MEDIA_ROOT then moves the file instead of copying it.
+FILE_UPLOAD_HANDLERS = ['django.core.files.uploadhandler.TemporaryFileUploadHandler']
+
+# Profile pictures (myapp/validators/image_header.py, myapp/thumbnails.py).
+# Only the image header is read to validate them; thumbnails are rendered by
+# a pool of THUMBNAIL_WORKERS threads after the upload is committed.
+PROFILE_PICTURE_FORMATS = ('JPEG', 'PNG', 'WEBP', 'GIF')
+PROFILE_PICTURE_MAX_DIMENSION = 6000
+THUMBNAIL_SIZES = (64, 256)
+THUMBNAIL_FORMATS = ('WEBP', 'JPEG')
+THUMBNAIL_WORKERS = 2
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -63,6 +93,18 @@ REST_FRAMEWORK = {
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ],
 
+    # orjson backed, falls back to the stdlib json module when orjson is missing
+    'DEFAULT_RENDERER_CLASSES': [
+        'myapp.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+
+    'DEFAULT_PARSER_CLASSES': [
+        'myapp.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 20,
 
@@ -78,7 +120,35 @@ REST_FRAMEWORK = {
 
 }
 
+# Rows fetched per round trip when building finance reports (myapp/reports.py)
+REPORT_CHUNK_SIZE = 10000
+
+# Rows fetched per round trip by the streaming catalog export (myapp/exports.py)
+EXPORT_CHUNK_SIZE = 2000
+
+# Largest ?ids= list accepted by the product/variant batch retrieve
+BATCH_RETRIEVE_MAX_IDS = 100
+
+# Seconds the composite product/<id>/detail/ response stays cached
+PRODUCT_DETAIL_CACHE_TIMEOUT = 300
+
+# The catalog and product detail caches (myapp/cache.py) are invalidated
+# by bumping or deleting keys. With the default local-memory cache every
+# worker process has its own copy and only the one that made the change
+# drops it, the others serve stale data until the timeout; set REDIS_URL
+# so all workers share one cache.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+
 MIDDLEWARE = [
+    'myapp.profiling.ProfilingMiddleware',
+    'myapp.metrics.MetricsMiddleware',
+    'myapp.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -88,6 +158,82 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Query instrumentation (myapp/middleware.py). Budgets are keyed by url name,
+# e.g. {"product_all-list": 5}. Repeated queries are logged; raising is for
+# tests only, it happens after the view's writes are committed.
+QUERY_BUDGET_DEFAULT = 30
+QUERY_BUDGETS = {}
+QUERY_REPEAT_LIMIT = 10
+QUERY_REPEAT_RAISE = False
+
+# Who may scrape /metrics (myapp/metrics.py): a request with the header
+# "Authorization: Bearer <METRICS_TOKEN>", or from one of METRICS_ALLOWED_IPS
+# (comma separated in the environment). Both are empty, closed, by default.
+# Behind a reverse proxy on the same host every request comes from
+# 127.0.0.1, so list addresses only when the scraper reaches Django directly,
+# and use the token otherwise.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_ALLOWED_IPS = [ip for ip in os.environ.get('METRICS_ALLOWED_IPS', '').split(',') if ip]
+
+# Request profiling (myapp/profiling.py), off unless PROFILING_ENABLED.
+# Requests with an X-Profile header equal to PROFILING_SECRET are always
+# profiled; PROFILING_SLOW_THRESHOLD_MS = None disables slow request capture.
+PROFILING_ENABLED = False
+PROFILING_SAMPLE_RATE = 0.0
+PROFILING_HEADER = 'X-Profile'
+PROFILING_SECRET = ''
+PROFILING_SLOW_THRESHOLD_MS = None
+PROFILING_SAMPLE_INTERVAL_MS = 5
+PROFILING_DIR = BASE_DIR / 'profiles'
+PROFILING_MAX_FILES = 500
+
+# Transactional outbox (myapp/outbox.py). `manage.py dispatch_outbox` posts
+# every event to each of OUTBOX_ENDPOINTS, OUTBOX_CONCURRENCY at a time, and
+# retries failures after OUTBOX_RETRY_BACKOFF seconds, doubled per attempt,
+# until OUTBOX_MAX_ATTEMPTS. A claimed batch is reserved for OUTBOX_LEASE
+# seconds, after which another worker may take it over.
+OUTBOX_ENDPOINTS = [url for url in os.environ.get('OUTBOX_ENDPOINTS', '').split(',') if url]
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_CONCURRENCY = 8
+OUTBOX_TIMEOUT = 5
+OUTBOX_MAX_ATTEMPTS = 10
+OUTBOX_RETRY_BACKOFF = 2
+OUTBOX_RETRY_MAX_DELAY = 3600
+OUTBOX_LEASE = 60
+
+# Idempotency-Key support (myapp/idempotency.py). Responses are replayed for
+# IDEMPOTENCY_TTL seconds; a request still running holds its key for at most
+# IDEMPOTENCY_LOCK_TIMEOUT. Keys are kept in the database, shared by every
+# worker, and expired ones are deleted by `manage.py sweep`.
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_TTL = 24 * 60 * 60
+IDEMPOTENCY_LOCK_TIMEOUT = 30
+
+# In-process cache of live coupons (myapp/coupons.py), reloaded after
+# COUPON_CACHE_TTL seconds or when a cached coupon expires.
+COUPON_CACHE_TTL = 30
+COUPON_CACHE_MAX_MISSES = 10000
+
+# Cached set of each user's wishlisted product ids (myapp/wishlist.py), kept
+# current on changes in this process; other processes' copies (the cache is
+# per process unless REDIS_URL is set) catch up within the TTL.
+WISHLIST_CACHE_TTL = 5 * 60
+
+# `manage.py sweep` (myapp/sweeper.py) deletes carts idle for
+# SWEEP_CART_MAX_AGE_DAYS, coupons expired for SWEEP_COUPON_MAX_AGE_DAYS,
+# expired tokens and expired idempotency keys, SWEEP_CHUNK_SIZE ids per
+# transaction with SWEEP_PAUSE seconds between chunks; with --loop it sweeps
+# every SWEEP_INTERVAL seconds.
+SWEEP_CART_MAX_AGE_DAYS = 30
+SWEEP_COUPON_MAX_AGE_DAYS = 30
+SWEEP_CHUNK_SIZE = 1000
+SWEEP_PAUSE = 0.05
+SWEEP_INTERVAL = 60 * 60
+
+# Products moved to the archive tables per transaction by
+# `manage.py archive_products` (myapp/archive.py)
+ARCHIVE_BATCH_SIZE = 500
+
 ROOT_URLCONF = 'project.urls'
 
 TEMPLATES = [
@@ -118,6 +264,49 @@ DATABASES = {
     }
 }
 
+# SQLite production profile (myapp/db.py), on with DJANGO_DB_PROFILE=production.
+# Every connection runs SQLITE_PRAGMAS, writers take the lock when their
+# transaction starts so busy_timeout applies, and reads go to a read-only
+# connection on the same file. WAL lets those reads run during a write.
+SQLITE_PRODUCTION = os.environ.get('DJANGO_DB_PROFILE') == 'production'
+SQLITE_READ_ALIAS = 'default'
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,  # ms
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # negative means KiB, so 64MB per connection
+    'temp_store': 'MEMORY',
+}
+
+# Order, OrderItem and Payment shards (myapp/sharding.py), picked by a hash of
+# the user id. ORDER_SHARD_COUNT=N spreads them over N SQLite files, each
+# migrated with `migrate --database orders_<i>`; unset keeps them in 'default'.
+ORDER_SHARD_COUNT = int(os.environ.get('ORDER_SHARD_COUNT', 0))
+ORDER_SHARDS = ['default']
+
+# the shard router goes first, it routes the sharded models on every alias
+DATABASE_ROUTERS = ['myapp.sharding.ShardRouter']
+
+if SQLITE_PRODUCTION:
+    DATABASES['default']['OPTIONS'] = {'transaction_mode': 'IMMEDIATE'}
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f"file:{BASE_DIR / 'db.sqlite3'}?mode=ro",
+        'TEST': {'MIRROR': 'default'},
+    }
+    SQLITE_READ_ALIAS = 'replica'
+    DATABASE_ROUTERS.append('myapp.db.ReadWriteRouter')
+
+if ORDER_SHARD_COUNT:
+    ORDER_SHARDS = [f'orders_{i}' for i in range(ORDER_SHARD_COUNT)]
+    for alias in ORDER_SHARDS:
+        DATABASES[alias] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / f'{alias}.sqlite3',
+            'OPTIONS': dict(DATABASES['default'].get('OPTIONS', {})),
+        }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
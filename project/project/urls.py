@@ -16,8 +16,16 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path,include
+from django.conf import settings
+from myapp.media import media_view
+from myapp.metrics import metrics_view
+from myapp.profiling import profile_download, profile_index
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
+    path('profiles/', profile_index, name='profile_index'),
+    path('profiles/<str:name>', profile_download, name='profile_download'),
+    path(f"{settings.MEDIA_URL.strip('/')}/<path:path>", media_view, name='media'),
     path("", include("myapp.urls"))
 ]